@@ -13,4 +13,9 @@ pip install whitenoise
 python manage.py collectstatic --noinput
 
 # Run database migrations
-python manage.py migrate
\ No newline at end of file
+python manage.py migrate
+
+# Build the offline indexes that migrations do not backfill: the LSH buckets for
+# similar-user lookup and the item-item song neighbors (incremental after the first run)
+python manage.py rebuild_lsh_index
+python manage.py refresh_song_neighbors
@@ -1,39 +1,45 @@
 import math
 from collections import defaultdict
-from django.db.models import Count, Q, F, Sum
-from .models import Action, Song, Recommendation, UserProfile, UserSimilarity
+from django.db.models import Count, Q, F, Sum, Case, When, Value, FloatField, prefetch_related_objects
+from .models import Action, Song, SongStats, Recommendation, UserProfile, UserSimilarity
 from django.contrib.auth.models import User
 import math, random
 from django.utils import timezone
 from .models import Action, UserProfile
 from django.db.models import Count, Avg
+from django.db import transaction
 import math
 
 # Import the utility functions from the new module instead of from views
 from .spotify_utils import get_spotify_track
+from .similarity import recompute_user_similarities
+from .lsh import similar_users_from_lsh
+from .interaction_matrix import load_interaction_matrix, INTERACTION_WEIGHTS
+from .model_store import save_model, load_model
+from .als import train_implicit_als, fold_in_user, ALS_ALPHA
+from .bpr import train_bpr, with_bias_column
+from .batch_scoring import cache_recommendations_for_all_users
+from .ranking import top_k
+from .recommendation_cache import cache_songs, current_recommendation_key, songs_from_payload
+from .user_features import rebuild_user_features
+from .song_tags import split_names
+from .catalog import get_catalog
+from .popularity import popular_songs
+from .trending import get_trending
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
 def update_user_similarities(user):
     """
     Update similarity scores between the given user and all other users
     Stores results in the UserSimilarity model for faster retrieval
+
+    Scores are computed in one batch with sparse matrix products (see similarity.py)
+    instead of calling calculate_user_similarity for every other user.
     """
-    other_users = User.objects.exclude(id=user.id)
-    
-    for other_user in other_users:
-        similarity = calculate_user_similarity(user, other_user)
-        
-        # Update or create the similarity record using your existing model structure
-        UserSimilarity.objects.update_or_create(
-            user1=user, 
-            user2=other_user,
-            defaults={'similarity_score': similarity}
-        )
-        
-        # Also create the reverse relationship for easier querying
-        UserSimilarity.objects.update_or_create(
-            user1=other_user, 
-            user2=user,
-            defaults={'similarity_score': similarity}
-        )
+    return recompute_user_similarities(user)
 
 
 def calculate_user_similarity(user1, user2):
@@ -108,49 +114,55 @@ def get_similar_users(user, top_n=10):
     """
     Gets similar users using the pre-calculated similarity scores
     """
-    update_preferences_based_on_actions(user)
     # Using your existing model structure with user1 and user2 relationship names
     similar_users = UserSimilarity.objects.filter(
         user1=user
     ).select_related('user2').order_by('-similarity_score')[:top_n]
     
+    if not similar_users:
+        # No stored neighbors yet: find candidates through the LSH index and
+        # score only those exactly (this also stores the neighbor list)
+        if not similar_users_from_lsh(user, top_n):
+            return []
+        similar_users = UserSimilarity.objects.filter(
+            user1=user
+        ).select_related('user2').order_by('-similarity_score')[:top_n]
+    
     return [(sim.user2, sim.similarity_score) for sim in similar_users]
 
+# Weight of a neighbor's action in collaborative scores; other action types count 1.0
+COLLABORATIVE_ACTION_WEIGHTS = {'like': 5.0, 'save': 3.0}
+
+
+def collaborative_song_scores(similar_users, exclude_song_ids=()):
+    """
+    Song id -> score summed over the similar users' actions, weighted by
+    similarity and action type. Reads all the neighbors' actions in one query.
+    """
+    similarity = {similar_user.id: score for similar_user, score in similar_users if score > 0}
+    song_scores = defaultdict(float)
+    if not similarity:
+        return song_scores
+    
+    actions = Action.objects.filter(
+        user_id__in=list(similarity), song__isnull=False
+    ).values_list('user_id', 'song_id', 'action_type')
+    for user_id, song_id, action_type in actions:
+        # Skip songs the user has already interacted with
+        if song_id in exclude_song_ids:
+            continue
+        song_scores[song_id] += similarity[user_id] * COLLABORATIVE_ACTION_WEIGHTS.get(action_type, 1.0)
+    
+    return song_scores
+
 def recommend_songs_collaborative(user, limit=50):
     """
     Enhanced collaborative filtering recommendation that gives higher weight to
     songs liked by users who are more similar to the target user
     """
-    update_preferences_based_on_actions(user)
-    similar_users = get_similar_users(user)
-    
-    # Keep track of scores for each recommended song
-    song_scores = defaultdict(float)
-    
     # Get songs the user has already interacted with
     user_song_ids = set(Action.objects.filter(user=user).values_list('song_id', flat=True))
-    
-    for similar_user, similarity_score in similar_users:
-        if similarity_score <= 0:
-            continue
-            
-        # Get actions for this similar user
-        actions = Action.objects.filter(user=similar_user)
-        
-        for action in actions:
-            # Skip songs the user has already interacted with
-            if action.song_id in user_song_ids:
-                continue
-                
-            # Weight based on action type
-            action_weight = 1.0
-            if action.action_type == 'like':
-                action_weight = 5.0
-            elif action.action_type == 'save':
-                action_weight = 3.0
-                
-            # Add to the song's score, weighted by similarity and action type
-            song_scores[action.song_id] += similarity_score * action_weight
+    song_scores = collaborative_song_scores(get_similar_users(user), user_song_ids)
     
     # Convert to list of (song_id, score) tuples and sort by score
     scored_songs = [(song_id, score) for song_id, score in song_scores.items()]
@@ -166,85 +178,53 @@ def recommend_songs_collaborative(user, limit=50):
     
     return recommended_songs, song_scores
 
-def recommend_songs_content_based(user, limit=50):
+def content_song_scores(favorite_artists, top_genres, exclude_song_ids=()):
     """
-    Enhanced content-based filtering that considers more factors than just artists
+    Song id -> content score against the catalog snapshot: 5 for a favorite
+    artist plus 2 per matching top genre, highest first.
     """
-    try:
-        user_profile = UserProfile.objects.get(user=user)
-    except UserProfile.DoesNotExist:
-        return [], {}
-    
-    song_scores = defaultdict(float)
-    
-    # Get songs the user has already interacted with
-    user_song_ids = set(Action.objects.filter(user=user).values_list('song_id', flat=True))
+    catalog = get_catalog()
+    scores = np.zeros(len(catalog))
     
     # Recommend based on favorite artists
-    favorite_artists = user_profile.preferences.get('favorite_artists', [])
     if favorite_artists:
-        artist_songs = Song.objects.filter(artist__in=favorite_artists).exclude(id__in=user_song_ids)
-        for song in artist_songs:
-            song_scores[song.id] += 5.0
-    
-    # Get user's most listened genres from their action history
-    user_actions = Action.objects.filter(user=user)
-    genre_counts = defaultdict(int)
-    
-    for action in user_actions:
-        song_genres = getattr(action.song, 'genres', [])
-        if song_genres:
-            for genre in song_genres:
-                genre_counts[genre] += 1
-    
-    # Get top genres
-    top_genres = sorted(genre_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-    top_genres = [genre for genre, _ in top_genres]
+        scores += 5.0 * catalog.artist_match(favorite_artists)
     
     # Recommend songs with matching genres
     if top_genres:
-        for song in Song.objects.exclude(id__in=user_song_ids):
-            song_genres = getattr(song, 'genres', [])
-            if song_genres:
-                matching_genres = set(song_genres) & set(top_genres)
-                song_scores[song.id] += len(matching_genres) * 2.0
+        scores += 2.0 * catalog.genre_match_counts(top_genres)
     
-    # Convert to list of (song_id, score) tuples and sort by score
-    scored_songs = [(song_id, score) for song_id, score in song_scores.items()]
-    scored_songs.sort(key=lambda x: x[1], reverse=True)
+    # Skip songs the user has already interacted with
+    scores[catalog.positions(exclude_song_ids)] = 0
     
-    # Get the top songs
-    top_song_ids = [song_id for song_id, _ in scored_songs[:limit]]
-    recommended_songs = list(Song.objects.filter(id__in=top_song_ids))
-    
-    # Sort the songs according to their scores
-    song_id_to_index = {song_id: i for i, song_id in enumerate(top_song_ids)}
-    recommended_songs.sort(key=lambda song: song_id_to_index.get(song.id, 9999))
-    
-    return recommended_songs, song_scores
+    # Scored songs, highest first
+    scored_rows = np.flatnonzero(scores)
+    scored_rows = scored_rows[np.argsort(-scores[scored_rows], kind='stable')]
+    return {int(catalog.song_ids[row]): float(scores[row]) for row in scored_rows}
 
-def recommend_songs_combined(user, limit=50):
+def recommend_songs_content_based(user, limit=50):
     """
-    Combines collaborative and content-based recommendations
+    Enhanced content-based filtering that considers more factors than just artists
     """
-    # Get recommendations from both methods
-    collab_songs, collab_scores = recommend_songs_collaborative(user)
-    content_songs, content_scores = recommend_songs_content_based(user)
-    
-    # Combine scores from both methods
-    combined_scores = defaultdict(float)
+    try:
+        user_profile = UserProfile.objects.get(user=user)
+    except UserProfile.DoesNotExist:
+        return [], {}
     
-    # Add collaborative scores (weighted higher)
-    for song_id, score in collab_scores.items():
-        combined_scores[song_id] += score * 0.7
+    # Get user's most listened genres from their action history
+    genre_counts = Action.objects.filter(
+        user=user, song__genres__isnull=False
+    ).values('song__genres__name').annotate(count=Count('id')).order_by('-count')
     
-    # Add content-based scores
-    for song_id, score in content_scores.items():
-        combined_scores[song_id] += score * 0.3
+    # Get top genres
+    top_genres = [item['song__genres__name'] for item in genre_counts[:5]]
     
-    # Convert to list of (song_id, score) tuples and sort by score
-    scored_songs = [(song_id, score) for song_id, score in combined_scores.items()]
-    scored_songs.sort(key=lambda x: x[1], reverse=True)
+    song_scores = content_song_scores(
+        user_profile.preferences.get('favorite_artists', []),
+        top_genres,
+        Action.objects.filter(user=user).values_list('song_id', flat=True)
+    )
+    scored_songs = list(song_scores.items())
     
     # Get the top songs
     top_song_ids = [song_id for song_id, _ in scored_songs[:limit]]
@@ -254,151 +234,89 @@ def recommend_songs_combined(user, limit=50):
     song_id_to_index = {song_id: i for i, song_id in enumerate(top_song_ids)}
     recommended_songs.sort(key=lambda song: song_id_to_index.get(song.id, 9999))
     
-    return recommended_songs, combined_scores
+    return recommended_songs, song_scores
 
 def calculate_recommendation_scores(user):
     """
-    Calculate and store recommendation scores for all potential songs for a user
+    Calculate and store recommendation scores for a user's candidate songs:
+    songs the combined recommenders scored, songs by favorite artists and
+    songs the user has interacted with. Replaces the user's stored rows.
     """
-    update_preferences_based_on_actions(user)
+    from .pipeline import COMBINED_SCORES
 
-    # Get all songs
-    all_songs = Song.objects.all()
+    # Collaborative and content-based scores, weighted 0.7 / 0.3
+    context = COMBINED_SCORES.run(user)
+    combined_scores = context.scores
 
     # Get songs the user has already interacted with
-    user_actions = Action.objects.filter(user=user)
-    user_song_ids = set(user_actions.values_list('song_id', flat=True))
-
-    # Get recommendations from combined method
-    _, combined_scores = recommend_songs_combined(user)
+    user_actions = Action.objects.filter(user=user, song__isnull=False)
+    user_song_ids = context.seen_song_ids
 
     # Calculate explicit user feature-based scores
-    try:
-        user_profile = UserProfile.objects.get(user=user)
-        favorite_artists = user_profile.preferences.get('favorite_artists', [])
-    except UserProfile.DoesNotExist:
-        favorite_artists = []
-
-    # For each song, calculate and store recommendation score
-    for song in all_songs:
-        # Skip songs the user has already interacted with
-        if song.id in user_song_ids:
-            continue
-
-        score = combined_scores.get(song.id, 0)
-
-        # Add additional score if the song is by a favorite artist
-        if song.artist in favorite_artists:
-            score += 5
-
-        # Update or create recommendation record
-        Recommendation.objects.update_or_create(
-            user=user,
-            song=song,
-            defaults={'recommendation_score': score}
-        )
-
-    # Also recalculate scores for songs the user has interacted with but may want to engage with more
-    for action in user_actions:
-        score = 0
-
-        # Base score on action type
-        if action.action_type == 'like':
+    favorite_artists = set(context.favorite_artists)
+
+    scores = defaultdict(float)
+
+    # Combined score for new songs
+    for song_id, score in combined_scores.items():
+        if song_id not in user_song_ids:
+            scores[song_id] += score
+
+    # Add additional score if the song is by a favorite artist
+    catalog = get_catalog()
+    for song_id in catalog.song_ids[catalog.artist_match(favorite_artists)].tolist():
+        if song_id not in user_song_ids:
+            scores[song_id] += 5
+
+    # Also score songs the user has interacted with but may want to engage with more
+    action_scores = {'like': 3, 'save': 2, 'play': 1}
+    for song_id, action_type, artist in user_actions.order_by('timestamp', 'id').values_list('song_id', 'action_type', 'song__artist'):
+        # Base score on action type, boosted if by favorite artist (the latest action wins)
+        score = action_scores.get(action_type, 0)
+        if favorite_artists & set(split_names(artist)):
             score += 3
-        elif action.action_type == 'save':
-            score += 2
-        elif action.action_type == 'play':
-            score += 1
+        scores[song_id] = score
 
-        # Boost score if by favorite artist
-        if action.song.artist in favorite_artists:
-            score += 3
+    if not scores:
+        Recommendation.objects.filter(user=user).delete()
+        return
 
-        # Update recommendation score
-        Recommendation.objects.update_or_create(
-            user=user,
-            song=action.song,
-            defaults={'recommendation_score': score}
-        )
+    song_ids = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+    values = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
 
-    # Calculate the average play count
-    average_play_count = Action.objects.filter(
-        action_type='play'
-    ).values('song').annotate(
-        play_count=Count('id')
-    ).aggregate(avg_play_count=Avg('play_count'))['avg_play_count']
+    # Average play count of the played songs, from the per-song counters (one row per song, not per play)
+    average_play_count = SongStats.objects.filter(play_count__gt=0).aggregate(
+        avg_play_count=Avg('play_count')
+    )['avg_play_count']
 
     if average_play_count is not None:
-        # For each recommendation
-        for recommendation in Recommendation.objects.filter(user=user):
-            # Get play count for this song
-            song_play_count = Action.objects.filter(
-                song=recommendation.song,
-                action_type='play'
-            ).count()
-
-            # Calculate popularity normalization factor
-            if song_play_count > average_play_count:
-                popularity_factor = math.log(average_play_count) / math.log(max(1, song_play_count))
-
-                # Apply correction (reduce score for very popular songs)
-                recommendation.recommendation_score *= popularity_factor
-                recommendation.save()
+        # Play counts of every candidate in one query
+        play_counts = dict(
+            SongStats.objects.filter(song_id__in=song_ids.tolist()).values_list('song_id', 'play_count')
+        )
+        counts = np.array([play_counts.get(song_id, 0) for song_id in song_ids.tolist()], dtype=np.float64)
+
+        # Popularity normalization: reduce the score of songs played more than average
+        popular = counts > average_play_count
+        values[popular] *= math.log(average_play_count) / np.log(np.maximum(counts[popular], 1))
+
+    with transaction.atomic():
+        Recommendation.objects.filter(user=user).delete()
+        Recommendation.objects.bulk_create(
+            [
+                Recommendation(user=user, song_id=song_id, recommendation_score=score)
+                for song_id, score in zip(song_ids.tolist(), values.tolist())
+            ],
+            batch_size=1000
+        )
 
 def update_preferences_based_on_actions(user):
     """
-    Automatically updates the user preferences based on their interaction history.
-    The function analyzes the user's actions (likes, saves, plays) to update their preferences.
+    Rebuilds the user's features and preferences from their full interaction history.
+    Actions keep the features current as they are written (see user_features.py),
+    so this is only needed to backfill or repair them.
     """
-    # Get all actions of the user (e.g., likes, saves, plays)
-    actions = Action.objects.filter(user=user)
-    
-    # Track frequency of artists and genres the user interacts with
-    artist_count = defaultdict(int)
-    genre_count = defaultdict(int)
-
-    for action in actions:
-        song = action.song
-        # Count favorite artists
-        if song.artist:  # Check if artist exists
-            artist_count[song.artist] += 1
-
-        # Count favorite genres - fix the error here
-        # The issue is that you're trying to access song.genre, but in your model
-        # the field might be called song.genres (plural) or it's None
-        # Let's handle both cases:
-        
-        genres = getattr(song, 'genres', None) or getattr(song, 'genre', None) or []
-        
-        # Make sure genres is iterable even if it's a string or None
-        if isinstance(genres, str):
-            genres = [genres]
-        elif genres is None:
-            genres = []
-            
-        for genre in genres:
-            genre_count[genre] += 1
-
-    # Identify top artists and genres based on the user's interaction frequency
-    favorite_artists = sorted(artist_count, key=artist_count.get, reverse=True)[:5]
-    favorite_genres = sorted(genre_count, key=genre_count.get, reverse=True)[:5]
-
-    # Get the user's profile and update preferences
-    try:
-        user_profile = UserProfile.objects.get(user=user)
-    except UserProfile.DoesNotExist:
-        user_profile = UserProfile.objects.create(user=user)
-
-    # Initialize preferences if it doesn't exist
-    if not hasattr(user_profile, 'preferences') or user_profile.preferences is None:
-        user_profile.preferences = {}
-
-    # Update the preferences field with the updated favorites
-    user_profile.preferences['favorite_artists'] = favorite_artists
-    user_profile.preferences['favorite_genres'] = favorite_genres
-
-    # Save the updated user profile
-    user_profile.save()
+    rebuild_user_features(user.id)
 
 
 def diversify_recommendations(recommendations, diversity_factor=0.2):
@@ -421,27 +339,12 @@ def diversify_recommendations(recommendations, diversity_factor=0.2):
     
     return top_recommendations
 
-def get_trending_songs(days=7, limit=20):
+def get_trending_songs(days=7, limit=20, rank='score'):
     """
-    Get trending songs based on recent activity
+    Get trending songs based on recent activity, from the hourly buckets (see trending.py).
+    rank='velocity' orders by growth over the previous window instead.
     """
-    # Define the timeframe for trending
-    recent_date = timezone.now() - timezone.timedelta(days=days)
-    
-    # Get songs with most actions in the recent timeframe
-    trending = Action.objects.filter(
-        timestamp__gte=recent_date
-    ).values('song').annotate(
-        action_count=Count('id')
-    ).order_by('-action_count')[:limit]
-    
-    # Get the actual songs
-    song_ids = [item['song'] for item in trending]
-    songs = Song.objects.filter(id__in=song_ids)
-    
-    # Sort by popularity
-    song_id_to_count = {item['song']: item['action_count'] for item in trending}
-    return sorted(songs, key=lambda s: song_id_to_count.get(s.id, 0), reverse=True)
+    return get_trending(days=days, limit=limit, rank=rank)
 
 
 
@@ -485,94 +388,84 @@ from .spotify_utils import get_spotify_track, store_spotify_tracks, get_spotify_
 import requests
 
 def build_user_song_matrix():
-    """Build a sparse user-song interaction matrix"""
-    # Get all users and songs
-    users = User.objects.all()
-    songs = Song.objects.all()
-    
-    # Create mappings from DB IDs to matrix indices
-    user_indices = {user.id: i for i, user in enumerate(users)}
-    song_indices = {song.id: i for i, song in enumerate(songs)}
-    
-    # Create a sparse matrix (most cells will be 0)
-    matrix = np.zeros((len(users), len(songs)))
-    
-    # Fill the matrix with weighted action values
-    actions = Action.objects.select_related('user', 'song').all()
-    for action in actions:
-        user_idx = user_indices.get(action.user.id)
-        song_idx = song_indices.get(action.song.id)
-        if user_idx is not None and song_idx is not None:
-            # Weight different actions
-            if action.action_type == 'like':
-                matrix[user_idx, song_idx] = 5.0
-            elif action.action_type == 'save':
-                matrix[user_idx, song_idx] = 3.0
-            elif action.action_type == 'play':
-                matrix[user_idx, song_idx] = 1.0
-    
-    return matrix, user_indices, song_indices
-
-
-def calculate_svd_recommendations(user, limit=50):
-    """Calculate recommendations using SVD"""
-    # Get or calculate the decomposed matrices
-    matrix, user_indices, song_indices = build_user_song_matrix()
-    
-    if matrix.shape[0] == 0 or matrix.shape[1] == 0:
-        return []  # Empty matrix, no recommendations possible
-    
-    # Invert the mappings for lookup
-    idx_to_song = {idx: song_id for song_id, idx in song_indices.items()}
-    
-    # Number of latent factors (hyperparameter you can tune)
-    # Ensure k is valid for the matrix dimensions
-    k = min(10, min(matrix.shape) - 1)
+    """
+    Build the sparse user-song interaction matrix.
+
+    Returns (csr_matrix, user_indices, song_indices). The matrix is kept as an
+    on-disk snapshot and only actions newer than the snapshot are read.
+    """
+    data = load_interaction_matrix()
+    return data.matrix, data.user_index, data.song_index
+
+
+def train_svd_model(k=10):
+    """
+    Truncated SVD of the interaction matrix, stored as the current 'svd' model.
+    U is pre-multiplied by Sigma so serving a user is one row x item-matrix product.
+    """
+    data = load_interaction_matrix()
+    matrix = data.matrix
     
+    # Ensure k is valid for the matrix dimensions
+    k = min(k, min(matrix.shape) - 1)
     if k <= 0:
-        return []  # Not enough data for SVD
+        return None  # Not enough data for SVD
     
-    # Apply SVD
-    try:
-        u, sigma, vt = svds(matrix, k=k)
-        
-        # Convert to diagonal matrix
-        sigma_diag = np.diag(sigma)
-        
-        # Get user's predicted ratings for all items
-        user_idx = user_indices.get(user.id)
+    u, sigma, vt = svds(matrix.astype(np.float64), k=k)
+    save_model(
+        'svd',
+        {'user_factors': u * sigma, 'item_factors': vt.T},
+        user_ids=data.user_ids,
+        item_ids=data.song_ids,
+        meta={'k': k, 'high_water_mark': data.high_water_mark}
+    )
+    return load_model('svd')
+
+
+def recommend_from_factors(model, user, limit=50, user_vector=None):
+    """
+    Score every item for the user with a stored factor model and return the top unseen songs.
+    user_vector overrides the user's stored row (e.g. a fold-in vector).
+    """
+    if user_vector is None:
+        user_idx = model.user_index.get(user.id)
         if user_idx is None:
             return []
-            
-        # Calculate predicted ratings
-        user_pred = u[user_idx].dot(sigma_diag).dot(vt)
-        
-        # Get songs user has already interacted with
-        user_song_ids = set(Action.objects.filter(user=user).values_list('song_id', flat=True))
-        
-        # Get indices of songs the user hasn't interacted with
-        unrated_indices = [i for i in range(len(user_pred)) if i in idx_to_song and idx_to_song[i] not in user_song_ids]
-        
-        # Sort by prediction score
-        recommendations = [(idx_to_song[idx], user_pred[idx]) for idx in unrated_indices]
-        recommendations.sort(key=lambda x: x[1], reverse=True)
-        
-        # Get top song IDs
-        top_song_ids = [song_id for song_id, _ in recommendations[:limit]]
-        
-        # Fetch the songs
-        songs = Song.objects.filter(id__in=top_song_ids)
-        
-        # Return in correct order
-        song_id_to_index = {song_id: i for i, song_id in enumerate(top_song_ids)}
-        return sorted(songs, key=lambda s: song_id_to_index.get(s.id, 999))
+        user_vector = model['user_factors'][user_idx]
+    
+    # Calculate predicted ratings
+    user_pred = model['item_factors'].dot(user_vector)
     
+    # Mask the songs the user has already interacted with and keep the best unseen ones
+    user_song_ids = np.fromiter(
+        Action.objects.filter(user=user, song__isnull=False).values_list('song_id', flat=True).distinct(), dtype=np.int64
+    )
+    top_song_ids, _ = top_k(user_pred, limit, seen=np.isin(model.item_ids, user_song_ids), ids=model.item_ids)
+    top_song_ids = top_song_ids.tolist()
+    
+    # Fetch the songs in rank order
+    songs = Song.objects.in_bulk(top_song_ids)
+    return [songs[song_id] for song_id in top_song_ids if song_id in songs]
+
+
+def calculate_svd_recommendations(user, limit=50, with_model=False):
+    """
+    Calculate recommendations using SVD.
+    with_model=True returns (songs, the model that scored them, or None).
+    """
+    # Factors are trained offline and memory-mapped from the model store;
+    # only train here if no model has been saved yet
+    try:
+        model = load_model('svd') or train_svd_model()
     except Exception as e:
         # Log the error
         import logging
         logger = logging.getLogger(__name__)
         logger.error(f"SVD calculation error: {str(e)}")
-        return []
+        model = None
+    
+    songs = recommend_from_factors(model, user, limit) if model is not None else []
+    return (songs, model) if with_model else songs
 
 
 def als_factorization(R, n_factors=10, n_iterations=5, reg_param=0.1):
@@ -589,163 +482,226 @@ def als_factorization(R, n_factors=10, n_iterations=5, reg_param=0.1):
     - P: User features matrix (users x factors)
     - Q: Item features matrix (items x factors)
     """
-    # Get dimensions of the matrix
-    n_users, n_items = R.shape
-    
-    # Initialize factor matrices randomly
-    P = np.random.normal(scale=1./n_factors, size=(n_users, n_factors))
-    Q = np.random.normal(scale=1./n_factors, size=(n_items, n_factors))
-    
-    # Create a mask for non-zero elements
-    mask = R > 0
-    
-    # Convert to sparse matrix for efficiency
-    R_csr = csr_matrix(R)
-    
-    # Run the ALS algorithm
-    for _ in range(n_iterations):
-        # Fix Q and estimate P
-        for u in range(n_users):
-            # Get indices of items rated by user u
-            u_items = R_csr[u].indices
-            if len(u_items) == 0:
-                continue
-                
-            # Get Q matrix for those items
-            Q_u = Q[u_items, :]
-            
-            # Get ratings for those items
-            R_u = R[u, u_items]
-            
-            # Calculate improved P_u with regularization
-            A = Q_u.T.dot(Q_u) + reg_param * np.eye(n_factors)
-            b = Q_u.T.dot(R_u)
-            P[u, :] = np.linalg.solve(A, b)
-        
-        # Fix P and estimate Q
-        for i in range(n_items):
-            # Get indices of users who rated item i
-            i_users = R_csr.getcol(i).indices
-            if len(i_users) == 0:
-                continue
-                
-            # Get P matrix for those users
-            P_i = P[i_users, :]
-            
-            # Get ratings from those users
-            R_i = R[i_users, i]
-            
-            # Calculate improved Q_i with regularization
-            A = P_i.T.dot(P_i) + reg_param * np.eye(n_factors)
-            b = P_i.T.dot(R_i)
-            Q[i, :] = np.linalg.solve(A, b)
-    
-    return P, Q
-
-
-def calculate_als_recommendations(user, limit=50):
-    """Calculate recommendations using ALS factorization"""
-    # Get or calculate the matrix
-    matrix, user_indices, song_indices = build_user_song_matrix()
-    
-    # Invert the mappings for lookup
-    idx_to_song = {idx: song_id for song_id, idx in song_indices.items()}
-    
-    # Number of latent factors (hyperparameter)
-    k = 10
-    
-    # Get user index
-    user_idx = user_indices.get(user.id)
-    if user_idx is None:
-        return []
-    
-    # Check if we have the ALS matrices in cache
-    als_key = "als_matrices"
-    cached_als = cache.get(als_key)
-    
-    if cached_als:
-        P, Q = cached_als
-    else:
-        # Run ALS factorization
-        P, Q = als_factorization(matrix, n_factors=k, n_iterations=15, reg_param=0.1)
-        # Cache the matrices
-        cache.set(als_key, (P, Q), 86400)  # Cache for 24 hours
+    return train_implicit_als(R, factors=n_factors, iterations=n_iterations, reg=reg_param)
+
+
+def _warm_start_factors(data, n_factors):
+    """
+    Factors and changed rows for warm-starting ALS from the current model.
+
+    Returns None when there is no compatible model: different factor count, or
+    an index map that is not a prefix of the current one (after a full rebuild).
+    """
+    previous = load_model('als')
+    if previous is None or previous.meta.get('n_factors') != n_factors:
+        return None
+    n_users, n_items = len(previous.user_ids), len(previous.item_ids)
+    if not (np.array_equal(previous.user_ids, data.user_ids[:n_users])
+            and np.array_equal(previous.item_ids, data.song_ids[:n_items])):
+        return None
     
-    # Calculate predicted ratings
-    user_pred = P[user_idx].dot(Q.T)
+    # Rows whose interactions changed since the model was trained, plus new rows
+    changed_users, changed_items = set(range(n_users, data.shape[0])), set(range(n_items, data.shape[1]))
+    for user_id, song_id in Action.objects.filter(
+        id__gt=previous.meta.get('high_water_mark', 0), id__lte=data.high_water_mark,
+        song__isnull=False, action_type__in=list(INTERACTION_WEIGHTS)
+    ).values_list('user_id', 'song_id').distinct().iterator(chunk_size=20000):
+        changed_users.add(data.user_index[user_id])
+        changed_items.add(data.song_index[song_id])
+    
+    return {
+        'user_factors': previous['user_factors'],
+        'item_factors': previous['item_factors'],
+        'changed_users': np.fromiter(sorted(changed_users), dtype=np.int64),
+        'changed_items': np.fromiter(sorted(changed_items), dtype=np.int64),
+    }
+
+
+def train_als_model(n_factors=10, n_iterations=15, reg_param=0.1, warm_start=False, warm_iterations=5, tol=1e-3):
+    """
+    Factorize the interaction matrix with ALS and store it as the current 'als' model.
+    With warm_start the previous model's factors are reused: changed rows are
+    updated first, then at most warm_iterations sweeps run until the loss converges.
+    """
+    data = load_interaction_matrix()
     
-    # Get songs user has already interacted with
-    user_song_ids = set(Action.objects.filter(user=user).values_list('song_id', flat=True))
+    warm = _warm_start_factors(data, n_factors) if warm_start else None
+    if warm is not None:
+        P, Q = train_implicit_als(
+            data.matrix, factors=n_factors, iterations=warm_iterations, reg=reg_param, tol=tol, **warm
+        )
+    else:
+        if warm_start:
+            logger.info("No compatible ALS model to warm-start from, training from scratch")
+        P, Q = als_factorization(data.matrix, n_factors=n_factors, n_iterations=n_iterations, reg_param=reg_param)
     
-    # Get indices of songs the user hasn't interacted with
-    unrated_indices = [i for i in range(len(user_pred)) if i in idx_to_song and idx_to_song[i] not in user_song_ids]
+    save_model(
+        'als',
+        {'user_factors': P, 'item_factors': Q},
+        user_ids=data.user_ids,
+        item_ids=data.song_ids,
+        meta={'n_factors': n_factors, 'n_iterations': n_iterations, 'reg_param': reg_param,
+              'alpha': ALS_ALPHA, 'high_water_mark': data.high_water_mark, 'warm_start': warm is not None}
+    )
+    return load_model('als')
+
+
+def als_user_vector_cache_key(user_id):
+    return f"als_user_vector:{user_id}"
+
+
+def invalidate_als_user_vector(user_id):
+    """Called when the user's actions change so the next request folds them in again"""
+    cache.delete(als_user_vector_cache_key(user_id))
+
+
+# YtY of the item factors per ALS model version, shared by every fold-in
+_item_gram = {}
+
+
+def get_als_user_vector(model, user_id):
+    """
+    Factor vector for the user under the current ALS model.
+
+    Users the model was trained on who have not acted since use their trained
+    row. New users, and users with actions newer than the model, are folded in:
+    their vector is solved against the fixed item factors from their own
+    interactions only. Either way the vector is cached until the model version
+    changes or the user logs another action.
+    """
+    cache_key = als_user_vector_cache_key(user_id)
+    cached = cache.get(cache_key)
+    if cached is not None and cached[0] == model.version:
+        return np.asarray(cached[1], dtype=np.float32)
     
-    # Sort by prediction score
-    recommendations = [(idx_to_song[idx], user_pred[idx]) for idx in unrated_indices]
-    recommendations.sort(key=lambda x: x[1], reverse=True)
+    user_idx = model.user_index.get(user_id)
+    high_water_mark = model.meta.get('high_water_mark', 0)
+    if user_idx is not None and not Action.objects.filter(user_id=user_id, id__gt=high_water_mark).exists():
+        vector = np.asarray(model['user_factors'][user_idx], dtype=np.float32)
+    else:
+        # Strongest action per song, weighted like the training matrix
+        strengths = {}
+        for song_id, action_type in Action.objects.filter(
+            user_id=user_id, song__isnull=False, action_type__in=list(INTERACTION_WEIGHTS)
+        ).values_list('song_id', 'action_type'):
+            item_idx = model.item_index.get(song_id)
+            if item_idx is not None:
+                strengths[item_idx] = max(strengths.get(item_idx, 0.0), INTERACTION_WEIGHTS[action_type])
+        if not strengths:
+            return None
+        
+        if model.version not in _item_gram:
+            item_factors = np.asarray(model['item_factors'], dtype=np.float32)
+            _item_gram.clear()
+            _item_gram[model.version] = item_factors.T @ item_factors
+        
+        vector = fold_in_user(
+            model['item_factors'],
+            np.fromiter(strengths.keys(), dtype=np.int64),
+            np.fromiter(strengths.values(), dtype=np.float32),
+            reg=model.meta.get('reg_param', 0.1),
+            alpha=model.meta.get('alpha', ALS_ALPHA),
+            YtY=_item_gram[model.version]
+        )
     
-    # Get top song IDs
-    top_song_ids = [song_id for song_id, _ in recommendations[:limit]]
+    cache.set(cache_key, (model.version, vector.tolist()), 86400)
+    return vector
+
+
+def calculate_als_recommendations(user, limit=50, with_model=False):
+    """
+    Calculate recommendations using ALS factorization.
+    with_model=True returns (songs, the model that scored them, or None).
+    """
+    # Factors are trained offline and memory-mapped from the model store;
+    # only train here if no model has been saved yet
+    model = load_model('als') or train_als_model()
+    songs = []
+    if model is not None:
+        # Up-to-date vector for the user, folded in if they are new or acted since training
+        user_vector = get_als_user_vector(model, user.id)
+        if user_vector is not None:
+            songs = recommend_from_factors(model, user, limit, user_vector=user_vector)
+    return (songs, model) if with_model else songs
+
+
+
+
+def train_bpr_model(n_factors=20, n_epochs=20, learning_rate=0.05, reg_param=0.01):
+    """
+    Train BPR on the interaction matrix and store it as the current 'bpr' model.
+    Items are the whole catalog, so negatives include songs nobody has played yet.
+    """
+    data = load_interaction_matrix()
+    if data.nnz == 0:
+        return None
     
-    # Fetch the songs
-    songs = Song.objects.filter(id__in=top_song_ids)
+    catalog_ids = get_catalog().song_ids
+    item_ids = np.concatenate([data.song_ids, catalog_ids[~np.isin(catalog_ids, data.song_ids)]])
+    R = csr_matrix((data.values, (data.rows, data.cols)), shape=(len(data.user_ids), len(item_ids)))
     
-    # Return in correct order
-    song_id_to_index = {song_id: i for i, song_id in enumerate(top_song_ids)}
-    return sorted(songs, key=lambda s: song_id_to_index.get(s.id, 999))
+    P, Q, bias, stats = train_bpr(R, factors=n_factors, epochs=n_epochs, learning_rate=learning_rate, reg=reg_param)
+    user_factors, item_factors = with_bias_column(P, Q, bias)
+    save_model(
+        'bpr',
+        {'user_factors': user_factors, 'item_factors': item_factors},
+        user_ids=data.user_ids,
+        item_ids=item_ids,
+        meta={'n_factors': n_factors, 'n_epochs': n_epochs, 'learning_rate': learning_rate, 'reg_param': reg_param,
+              'high_water_mark': data.high_water_mark, 'epochs': stats}
+    )
+    return load_model('bpr')
 
 
+def calculate_bpr_recommendations(user, limit=50, with_model=False):
+    """
+    Calculate recommendations using the BPR model (users it was not trained on get none).
+    with_model=True returns (songs, the model that scored them, or None).
+    """
+    model = load_model('bpr') or train_bpr_model()
+    songs = recommend_from_factors(model, user, limit) if model is not None else []
+    return (songs, model) if with_model else songs
 
 
 def cached_get_recommendations(user, limit=50, cache_timeout=3600, algorithm='svd'):
-    """Get recommendations with caching"""
-    cache_key = f"user_recommendations:{user.id}:{algorithm}"
+    """
+    Get recommendations with caching. The key embeds the model version and the
+    user's activity version, so a new model or a new action is a miss right
+    away; entries hold the song payloads, so a hit runs no queries.
+    """
+    cache_key = current_recommendation_key(user.id, algorithm)
     
     # Try to get recommendations from cache
     cached_recommendations = cache.get(cache_key)
     if cached_recommendations:
-        # Deserialize and return cached recommendations
-        song_ids = json.loads(cached_recommendations)
-        songs = Song.objects.filter(id__in=song_ids)
-        
-        # Sort based on the original order
-        song_id_to_index = {id: i for i, id in enumerate(song_ids)}
-        return sorted(songs, key=lambda s: song_id_to_index.get(s.id, 999))
+        return songs_from_payload(cached_recommendations[:limit])
     
     # If not in cache, calculate recommendations
     if algorithm == 'als':
         recommendations = calculate_als_recommendations(user, limit)
+    elif algorithm == 'bpr':
+        recommendations = calculate_bpr_recommendations(user, limit)
     else:  # Default to SVD
         recommendations = calculate_svd_recommendations(user, limit)
     
-    # Cache the song IDs (more efficient than caching full objects)
-    song_ids = [song.id for song in recommendations]
-    cache.set(cache_key, json.dumps(song_ids), cache_timeout)
+    cache_songs(cache_key, recommendations, cache_timeout)
     
     return recommendations
 
 
-def schedule_recommendation_updates():
+def schedule_recommendation_updates(workers=None, chunk_size=1024):
     """
     Schedule periodic updates of recommendations for all users
     This could run as a nightly background job
     """
-    # First, calculate the ALS matrices
-    matrix, _, _ = build_user_song_matrix()
-    P, Q = als_factorization(matrix, n_factors=20, n_iterations=15, reg_param=0.1)
-    cache.set("als_matrices", (P, Q), 86400)  # Cache for 24 hours
-    
-    # Now update recommendations for each user
-    for user in User.objects.all():
-        # Calculate and cache SVD recommendations
-        svd_recommendations = calculate_svd_recommendations(user)
-        svd_song_ids = [song.id for song in svd_recommendations]
-        cache.set(f"user_recommendations:{user.id}:svd", json.dumps(svd_song_ids), 86400)
-        
-        # Calculate and cache ALS recommendations
-        als_recommendations = calculate_als_recommendations(user)
-        als_song_ids = [song.id for song in als_recommendations]
-        cache.set(f"user_recommendations:{user.id}:als", json.dumps(als_song_ids), 86400)
+    # First, train the factor models once; serving processes pick up the new versions
+    train_als_model(n_factors=20, n_iterations=15, reg_param=0.1, warm_start=True)
+    train_svd_model()
+    train_bpr_model()
+    
+    # Now score all users in chunks and cache their recommendations
+    for algorithm in ('svd', 'als', 'bpr'):
+        cache_recommendations_for_all_users(algorithm, chunk_size=chunk_size, workers=workers)
 
 
 def create_or_update_song_from_spotify(spotify_track_id):
@@ -788,115 +744,6 @@ def create_or_update_song_from_spotify(spotify_track_id):
     return song
 
 
-def recommend_songs_combined(user, limit=50):
-    """
-    Combined recommendation approach that uses multiple algorithms
-    
-    Returns:
-        tuple: (recommendations, source_info)
-            - recommendations: list of Song objects
-            - source_info: string describing which algorithm was used
-    """
-    # First try to get cached recommendations
-    cache_key_als = f"user_recommendations:{user.id}:als"
-    cache_key_svd = f"user_recommendations:{user.id}:svd"
-    
-    cached_als = cache.get(cache_key_als)
-    cached_svd = cache.get(cache_key_svd)
-    
-    # Check if user has enough interactions
-    user_action_count = Action.objects.filter(user=user).count()
-    
-    if user_action_count < 5:
-        # Not enough user data, fall back to popularity-based recommendations
-        popular_songs = Song.objects.annotate(
-            action_count=Count('action')
-        ).order_by('-action_count')[:limit]
-        
-        return popular_songs, "popularity"
-    
-    # Prefer ALS for users with more data (it can handle implicit feedback better)
-    if user_action_count > 20 and cached_als:
-        song_ids = json.loads(cached_als)
-        songs = Song.objects.filter(id__in=song_ids)
-        song_id_to_index = {id: i for i, id in enumerate(song_ids)}
-        sorted_songs = sorted(songs, key=lambda s: song_id_to_index.get(s.id, 999))
-        return sorted_songs, "cached_als"
-    
-    # Fall back to SVD if we have those cached
-    if cached_svd:
-        song_ids = json.loads(cached_svd)
-        songs = Song.objects.filter(id__in=song_ids)
-        song_id_to_index = {id: i for i, id in enumerate(song_ids)}
-        sorted_songs = sorted(songs, key=lambda s: song_id_to_index.get(s.id, 999))
-        return sorted_songs, "cached_svd"
-    
-    # Nothing in cache, so calculate on the fly
-    if user_action_count > 20:
-        # More user data, use ALS
-        recommendations = calculate_als_recommendations(user, limit)
-        algorithm = "als"
-    else:
-        # Less user data, use SVD
-        recommendations = calculate_svd_recommendations(user, limit)
-        algorithm = "svd"
-    
-    # Cache for future requests
-    song_ids = [song.id for song in recommendations]
-    cache.set(f"user_recommendations:{user.id}:{algorithm}", json.dumps(song_ids), 3600)
-    
-    return recommendations, algorithm
-
-
-def hybrid_recommendation(user, limit=50):
-    """
-    A hybrid recommendation approach that combines collaborative filtering
-    with content-based filtering using song genres
-    """
-    # Get user's favorite genres based on their listening history
-    user_actions = Action.objects.filter(user=user).select_related('song')
-    genre_counts = {}
-    
-    for action in user_actions:
-        if not action.song.genre:
-            continue
-            
-        # Split genres (if it's a comma-separated string)
-        genres = [g.strip() for g in action.song.genre.split(',')]
-        
-        # Weight by action type
-        weight = 5.0 if action.action_type == 'like' else 3.0 if action.action_type == 'save' else 1.0
-        
-        for genre in genres:
-            if genre:
-                genre_counts[genre] = genre_counts.get(genre, 0) + weight
-    
-    # Get recommendations from the best algorithm for this user
-    recs, algorithm = recommend_songs_combined(user, limit=limit*2)  # Get more than needed
-    
-    # Add a score to each recommendation based on genre match
-    scored_recs = []
-    for song in recs:
-        base_score = 1.0  # Base score from original algorithm
-        genre_score = 0.0
-        
-        if song.genre and genre_counts:
-            song_genres = [g.strip() for g in song.genre.split(',')]
-            for genre in song_genres:
-                if genre in genre_counts:
-                    # Add weighted genre score
-                    genre_score += genre_counts[genre] / max(genre_counts.values())
-        
-        # Combine scores (you can adjust the weighting)
-        final_score = base_score + (genre_score * 0.5)
-        scored_recs.append((song, final_score))
-    
-    # Sort by final score and get top recommendations
-    scored_recs.sort(key=lambda x: x[1], reverse=True)
-    
-    return [song for song, _ in scored_recs[:limit]], f"hybrid_{algorithm}"
-
-
     
 
 
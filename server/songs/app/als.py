@@ -0,0 +1,196 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+logger = logging.getLogger(__name__)
+
+# Confidence scale: an interaction of strength r counts with confidence 1 + ALS_ALPHA * r
+ALS_ALPHA = 10.0
+
+
+def _cg_update_rows(X, Y, YtY, indptr, indices, confidence, rows, reg, cg_steps):
+    """
+    Conjugate-gradient update of rows X[rows] for the implicit ALS objective.
+
+    Each row x_u solves (YtY + Y_u^T (C_u - I) Y_u + reg*I) x_u = Y_u^T C_u p_u,
+    where C_u holds the confidences of the items the row interacted with.
+    YtY is shared by every row, so only the interacted items contribute the
+    correction term. All the rows are iterated together: the per-row sums
+    over items become one sparse x dense product.
+    """
+    n_block = len(rows)
+    if n_block == 0:
+        return
+
+    # Gather the CSR entries of the selected rows into a compact block
+    starts, lengths = indptr[rows], indptr[rows + 1] - indptr[rows]
+    block_indptr = np.concatenate([[0], np.cumsum(lengths)])
+    positions = np.repeat(starts - block_indptr[:-1], lengths) + np.arange(block_indptr[-1])
+    block_indices = indices[positions]
+    block_conf = confidence[positions]
+    nnz_rows = np.repeat(np.arange(n_block), lengths)
+    Y_nnz = Y[block_indices]
+    shape = (n_block, Y.shape[0])
+
+    def apply_A(P):
+        # (C_u - I) Y_u p_u for every row, summed back through a sparse product
+        weights = np.einsum('ij,ij->i', Y_nnz, P[nnz_rows]) * (block_conf - 1.0)
+        correction = csr_matrix((weights, block_indices, block_indptr), shape=shape) @ Y
+        return P @ YtY + reg * P + correction
+
+    x = X[rows]
+    # Y_u^T C_u p_u with p_u = 1 for every interacted item
+    b = csr_matrix((block_conf, block_indices, block_indptr), shape=shape) @ Y
+
+    r = b - apply_A(x)
+    p = r.copy()
+    rs_old = np.einsum('ij,ij->i', r, r)
+
+    for _ in range(cg_steps):
+        if not rs_old.any():
+            break
+        Ap = apply_A(p)
+        denom = np.einsum('ij,ij->i', p, Ap)
+        step = np.divide(rs_old, denom, out=np.zeros_like(rs_old), where=denom > 0)
+        x += step[:, None] * p
+        r -= step[:, None] * Ap
+        rs_new = np.einsum('ij,ij->i', r, r)
+        beta = np.divide(rs_new, rs_old, out=np.zeros_like(rs_new), where=rs_old > 0)
+        p = r + beta[:, None] * p
+        rs_old = rs_new
+
+    X[rows] = x
+
+
+def _update_factors(executor, X, Y, indptr, indices, confidence, reg, cg_steps, block_size, rows=None):
+    """Update rows of X (all of them by default) against fixed Y, one thread-pool task per row block"""
+    YtY = Y.T @ Y
+    if rows is None:
+        rows = np.arange(X.shape[0])
+    futures = [
+        executor.submit(_cg_update_rows, X, Y, YtY, indptr, indices, confidence, rows[start:start + block_size], reg, cg_steps)
+        for start in range(0, len(rows), block_size)
+    ]
+    for future in futures:
+        future.result()
+
+
+def implicit_als_loss(R_csr, confidence, P, Q, reg, chunk_size=1000000):
+    """
+    Value of the implicit ALS objective
+    sum_ui c_ui (p_ui - x_u.y_i)^2 + reg (|X|^2 + |Y|^2).
+
+    The sum over all user x item cells is split into the c=1, p=0 part for
+    every cell, which is trace(X^T X Y^T Y), plus a correction over the
+    observed entries only, so the dense score matrix is never formed.
+    """
+    loss = float(np.sum((P.T @ P) * (Q.T @ Q), dtype=np.float64))
+
+    rows = np.repeat(np.arange(R_csr.shape[0]), np.diff(R_csr.indptr))
+    for start in range(0, R_csr.nnz, chunk_size):
+        end = start + chunk_size
+        scores = np.einsum('ij,ij->i', P[rows[start:end]], Q[R_csr.indices[start:end]]).astype(np.float64)
+        loss += float(np.sum(confidence[start:end] * (1.0 - scores) ** 2 - scores ** 2))
+
+    return loss + reg * float(np.sum(P.astype(np.float64) ** 2) + np.sum(Q.astype(np.float64) ** 2))
+
+
+def _init_factors(rng, n_rows, factors, previous=None):
+    """Random factors, keeping the rows of a previous model (new rows are appended at the end)"""
+    X = rng.normal(scale=0.01, size=(n_rows, factors)).astype(np.float32)
+    if previous is not None:
+        n_previous = min(len(previous), n_rows)
+        X[:n_previous] = np.asarray(previous[:n_previous], dtype=np.float32)
+    return X
+
+
+def train_implicit_als(R, factors=10, iterations=15, reg=0.1, alpha=ALS_ALPHA, cg_steps=3,
+                       block_size=1024, num_threads=None, random_state=None,
+                       user_factors=None, item_factors=None, changed_users=None, changed_items=None, tol=None):
+    """
+    Implicit-feedback ALS (Hu, Koren & Volinsky) with conjugate-gradient solves.
+
+    R is a sparse users x items matrix of interaction strengths; each entry is
+    treated as a positive preference with confidence 1 + alpha * r. Users are
+    updated from the CSR layout and items from the CSC layout, so neither step
+    slices columns. Returns float32 (user_factors, item_factors).
+
+    Warm start: user_factors/item_factors from a previous model initialize the
+    rows they cover (rows beyond them are new users/items and start random).
+    changed_users/changed_items get a targeted update pass before the full
+    sweeps, and with tol set training stops once an iteration improves the
+    loss by less than that fraction.
+    """
+    R_csr = csr_matrix(R, dtype=np.float32)
+    R_csr.sum_duplicates()
+    R_csc = R_csr.tocsc()
+    n_users, n_items = R_csr.shape
+
+    rng = np.random.default_rng(random_state)
+    P = _init_factors(rng, n_users, factors, user_factors)
+    Q = _init_factors(rng, n_items, factors, item_factors)
+
+    user_conf = 1.0 + alpha * R_csr.data
+    item_conf = 1.0 + alpha * R_csc.data
+    reg = np.float32(reg)
+
+    num_threads = num_threads or os.cpu_count() or 1
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        if changed_users is not None or changed_items is not None:
+            focus_started = time.time()
+            users = np.asarray(changed_users if changed_users is not None else [], dtype=np.int64)
+            items = np.asarray(changed_items if changed_items is not None else [], dtype=np.int64)
+            _update_factors(executor, P, Q, R_csr.indptr, R_csr.indices, user_conf, reg, cg_steps, block_size, rows=users)
+            _update_factors(executor, Q, P, R_csc.indptr, R_csc.indices, item_conf, reg, cg_steps, block_size, rows=items)
+            logger.info(
+                f"ALS warm start: updated {len(users)} changed users and {len(items)} changed items "
+                f"in {time.time() - focus_started:.2f}s, loss {implicit_als_loss(R_csr, user_conf, P, Q, reg):.4f}"
+            )
+
+        previous_loss = None
+        for iteration in range(iterations):
+            iteration_started = time.time()
+            _update_factors(executor, P, Q, R_csr.indptr, R_csr.indices, user_conf, reg, cg_steps, block_size)
+            _update_factors(executor, Q, P, R_csc.indptr, R_csc.indices, item_conf, reg, cg_steps, block_size)
+            loss = implicit_als_loss(R_csr, user_conf, P, Q, reg)
+            logger.info(
+                f"ALS iteration {iteration + 1}/{iterations} took {time.time() - iteration_started:.2f}s, loss {loss:.4f}"
+            )
+
+            if tol is not None and previous_loss is not None and previous_loss - loss < tol * abs(previous_loss):
+                logger.info(f"ALS converged after {iteration + 1} iterations")
+                break
+            previous_loss = loss
+
+    logger.info(
+        f"Trained implicit ALS on {n_users}x{n_items} ({R_csr.nnz} interactions, {factors} factors) "
+        f"in {time.time() - started:.2f}s with {num_threads} threads"
+    )
+    return P, Q
+
+
+def fold_in_user(item_factors, item_indices, values, reg=0.1, alpha=ALS_ALPHA, YtY=None):
+    """
+    Solve one user's factor vector against fixed item factors.
+
+    Same objective as a user row in train_implicit_als, but solved exactly since
+    it is a single k x k system. item_indices/values are the user's interacted
+    items and strengths; YtY can be passed in when it is cached per model.
+    """
+    Y = np.asarray(item_factors, dtype=np.float32)
+    factors = Y.shape[1]
+    if YtY is None:
+        YtY = Y.T @ Y
+    if len(item_indices) == 0:
+        return np.zeros(factors, dtype=np.float32)
+
+    Y_u = Y[item_indices]
+    confidence = 1.0 + alpha * np.asarray(values, dtype=np.float32)
+    A = YtY + (Y_u.T * (confidence - 1.0)) @ Y_u + reg * np.eye(factors, dtype=np.float32)
+    b = Y_u.T @ confidence
+    return np.linalg.solve(A, b).astype(np.float32)
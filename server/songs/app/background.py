@@ -0,0 +1,29 @@
+import logging
+import threading
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_in_background(lock, refresh, name):
+    """
+    Run refresh() in a daemon thread so the request that noticed a stale
+    snapshot does not wait for it. Does nothing while another refresh holding
+    `lock` is still running; returns whether a thread was started.
+    """
+    if not lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            refresh()
+        except Exception:
+            logger.exception(f"Background refresh of the {name} failed")
+        finally:
+            # The thread's own database connections would otherwise stay open
+            connections.close_all()
+            lock.release()
+
+    threading.Thread(target=run, name=f"refresh-{name}", daemon=True).start()
+    return True
@@ -0,0 +1,146 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Action, Song
+from .model_store import load_model
+from .interaction_matrix import get_data_dir
+from .ranking import top_k
+from .recommendation_cache import recommendation_cache_key, serialize_song, user_activity_versions
+from .scoring_worker import init_worker, score_chunk_in_worker
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_CACHE_TIMEOUT = 86400  # 24 hours, same as the nightly job
+
+
+def build_seen_matrix(model, chunk_size=20000):
+    """
+    Boolean users x items matrix (aligned with the model's rows and columns)
+    of every song each user has any action with.
+    """
+    user_index, item_index = model.user_index, model.item_index
+    rows, cols = [], []
+    pairs = Action.objects.filter(song__isnull=False).values_list('user_id', 'song_id').distinct()
+    for user_id, song_id in pairs.iterator(chunk_size=chunk_size):
+        row = user_index.get(user_id)
+        col = item_index.get(song_id)
+        if row is not None and col is not None:
+            rows.append(row)
+            cols.append(col)
+
+    shape = (len(model.user_ids), len(model.item_ids))
+    return csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=shape)
+
+
+def top_n_for_rows(user_factors, item_factors, seen_block, start, end, n):
+    """
+    Score users start:end against every item with one matrix product, mask the
+    items they have seen (seen_block holds the seen rows start:end) and return
+    (top item indices, scores), best first. Masked items come back with a score of -inf.
+    """
+    scores = np.asarray(user_factors[start:end]) @ np.asarray(item_factors).T
+    return top_k(scores, n, seen=seen_block)
+
+
+def _cache_chunk(model, algorithm, seen_block, activity_versions, start, end, limit, timeout):
+    """
+    Score users start:end of the model and write their lists with one set_many,
+    keyed by the model version and each user's activity version (activity_versions
+    holds the versions of rows start:end, read before the seen matrix was built).
+    """
+    top, top_scores = top_n_for_rows(model['user_factors'], model['item_factors'], seen_block, start, end, limit)
+
+    song_lists = []
+    for offset in range(end - start):
+        valid = np.isfinite(top_scores[offset])
+        song_lists.append(model.item_ids[top[offset][valid]].tolist())
+    songs = Song.objects.in_bulk({song_id for song_ids in song_lists for song_id in song_ids})
+    payloads = {song_id: serialize_song(song) for song_id, song in songs.items()}
+
+    entries = {}
+    for offset, song_ids in enumerate(song_lists):
+        key = recommendation_cache_key(int(model.user_ids[start + offset]), algorithm, model.version, int(activity_versions[offset]))
+        entries[key] = [payloads[song_id] for song_id in song_ids if song_id in payloads]
+    cache.set_many(entries, timeout)
+    return len(entries)
+
+
+def _log_chunk(algorithm, done, total, start, end, seconds):
+    logger.info(f"{algorithm} chunk {done}/{total} (users {start}-{end}) scored in {seconds:.2f}s")
+
+
+def cache_recommendations_for_all_users(algorithm, limit=50, chunk_size=1024, timeout=RECOMMENDATION_CACHE_TIMEOUT, workers=None):
+    """
+    Score every user in the current `algorithm` model in chunks and write all
+    the top-N lists (song payloads) to the cache, one set_many (a pipelined
+    multi-set on Redis) per chunk.
+
+    With more than one worker the chunks run in a process pool. Workers
+    memory-map the model version and a seen-items CSR written next to it, so
+    the factors are never pickled or copied per process.
+    Returns the number of users written.
+    """
+    model = load_model(algorithm)
+    if model is None:
+        logger.warning(f"No {algorithm} model to score")
+        return 0
+
+    started = time.time()
+    # Versions are read first: a user who acts while the job runs is keyed past the list written for them
+    activity_versions = np.array(user_activity_versions(model.user_ids.tolist()), dtype=np.int64)
+    seen = build_seen_matrix(model)
+    n_users = len(model.user_ids)
+    chunks = [(start, min(start + chunk_size, n_users)) for start in range(0, n_users, chunk_size)]
+
+    if workers is None:
+        workers = settings.RECOMMENDATION_WORKERS
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(chunks))
+
+    written = 0
+    if workers <= 1:
+        for done, (start, end) in enumerate(chunks, 1):
+            chunk_started = time.time()
+            written += _cache_chunk(model, algorithm, seen[start:end], activity_versions[start:end], start, end, limit, timeout)
+            _log_chunk(algorithm, done, len(chunks), start, end, time.time() - chunk_started)
+    else:
+        seen_dir = tempfile.mkdtemp(prefix=f'seen-{algorithm}-', dir=get_data_dir())
+        try:
+            np.save(os.path.join(seen_dir, 'indptr.npy'), seen.indptr)
+            np.save(os.path.join(seen_dir, 'indices.npy'), seen.indices)
+            np.save(os.path.join(seen_dir, 'activity_versions.npy'), activity_versions)
+
+            # Spawned workers start with no inherited DB or cache connections
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(algorithm, model.version, seen_dir)
+            ) as executor:
+                futures = [
+                    executor.submit(score_chunk_in_worker, algorithm, start, end, limit, timeout)
+                    for start, end in chunks
+                ]
+                for done, future in enumerate(as_completed(futures), 1):
+                    start, end, chunk_written, seconds = future.result()
+                    written += chunk_written
+                    _log_chunk(algorithm, done, len(chunks), start, end, seconds)
+        finally:
+            shutil.rmtree(seen_dir, ignore_errors=True)
+
+    logger.info(
+        f"Cached {algorithm} recommendations for {written} users "
+        f"(model {model.version}) in {time.time() - started:.2f}s with {workers} worker(s)"
+    )
+    return written
@@ -0,0 +1,198 @@
+import copy
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .background import refresh_in_background
+from .models import Song
+from .song_tags import split_names
+
+logger = logging.getLogger(__name__)
+
+# New songs are picked up at most this often; a full rebuild (edits, deletes) runs after CATALOG_MAX_AGE
+CATALOG_REFRESH_INTERVAL = 60
+CATALOG_MAX_AGE = 3600
+
+
+class CatalogSnapshot:
+    """
+    Compact, array-backed copy of the song catalog for vectorized content scoring.
+
+    Row i describes song_ids[i]. Artists are stored CSR-style (artist_indptr /
+    artist_indices, first entry = primary artist); genres are bitsets with one
+    bit per genre across genre_bits.shape[1] uint64 words. Rows are appended in
+    song id order, so new songs are added by reading past max_song_id.
+
+    A snapshot other threads can see is never changed: new songs go into a
+    copy (see _load_new_songs), whose arrays are replaced, not written to.
+    """
+
+    def __init__(self):
+        self.song_ids = np.empty(0, dtype=np.int64)
+        self.artist_indptr = np.zeros(1, dtype=np.int64)
+        self.artist_indices = np.empty(0, dtype=np.int32)
+        self.artist_rows = np.empty(0, dtype=np.int32)  # Song row of each artist_indices entry
+        self.genre_bits = np.zeros((0, 1), dtype=np.uint64)
+        self.artist_index = {}  # Artist name -> index
+        self.genre_index = {}  # Genre name -> bit position
+        self.max_song_id = 0
+        self.built_at = time.time()
+        self.checked_at = 0.0
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    @property
+    def primary_artists(self):
+        """Index of each song's first artist, -1 when it has none"""
+        has_artist = np.diff(self.artist_indptr) > 0
+        primary = np.full(len(self), -1, dtype=np.int32)
+        primary[has_artist] = self.artist_indices[self.artist_indptr[:-1][has_artist]]
+        return primary
+
+    def copy(self):
+        """Copy to append to; the arrays are shared until add_songs replaces them"""
+        catalog = copy.copy(self)
+        catalog.artist_index = dict(self.artist_index)
+        catalog.genre_index = dict(self.genre_index)
+        return catalog
+
+    def add_songs(self, rows):
+        """Append (id, artist, genre) rows with ids above max_song_id (only to a snapshot not yet shared)"""
+        if not rows:
+            return
+
+        artist_lengths, artist_indices, genre_positions = [], [], []
+        for _, artist, genre in rows:
+            names = split_names(artist)
+            artist_lengths.append(len(names))
+            artist_indices.extend(self.artist_index.setdefault(name, len(self.artist_index)) for name in names)
+            genre_positions.append([self.genre_index.setdefault(name, len(self.genre_index)) for name in split_names(genre)])
+
+        n_words = max(self.genre_bits.shape[1], (len(self.genre_index) + 63) // 64, 1)
+        if n_words > self.genre_bits.shape[1]:
+            grown = np.zeros((len(self), n_words), dtype=np.uint64)
+            grown[:, :self.genre_bits.shape[1]] = self.genre_bits
+            self.genre_bits = grown
+
+        new_bits = np.zeros((len(rows), n_words), dtype=np.uint64)
+        for row, positions in enumerate(genre_positions):
+            for position in positions:
+                new_bits[row, position // 64] |= np.uint64(1) << np.uint64(position % 64)
+
+        self.song_ids = np.concatenate([self.song_ids, np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))])
+        self.artist_indptr = np.concatenate([self.artist_indptr, self.artist_indptr[-1] + np.cumsum(artist_lengths)])
+        self.artist_indices = np.concatenate([self.artist_indices, np.asarray(artist_indices, dtype=np.int32)])
+        self.artist_rows = np.concatenate([
+            self.artist_rows, np.repeat(np.arange(len(self.song_ids) - len(rows), len(self.song_ids), dtype=np.int32), artist_lengths)
+        ])
+        self.genre_bits = np.concatenate([self.genre_bits, new_bits])
+        self.max_song_id = int(self.song_ids[-1])
+
+    def genre_mask(self, genres):
+        """Bitset (one row of genre_bits) with the bits of the given genre names"""
+        mask = np.zeros(self.genre_bits.shape[1], dtype=np.uint64)
+        for name in genres:
+            position = self.genre_index.get(name)
+            if position is not None:
+                mask[position // 64] |= np.uint64(1) << np.uint64(position % 64)
+        return mask
+
+    def genre_match_counts(self, genres):
+        """Number of the given genres each song has (popcount of the AND with the genre mask)"""
+        mask = self.genre_mask(genres)
+        if not mask.any():
+            return np.zeros(len(self), dtype=np.int64)
+        return np.bitwise_count(self.genre_bits & mask).sum(axis=1, dtype=np.int64)
+
+    def artist_match(self, artists):
+        """Boolean array: song has at least one of the given artists"""
+        wanted = [self.artist_index[name] for name in artists if name in self.artist_index]
+        if not wanted:
+            return np.zeros(len(self), dtype=bool)
+        hits = np.isin(self.artist_indices, wanted)
+        return np.bincount(self.artist_rows[hits], minlength=len(self)) > 0
+
+    def positions(self, song_ids):
+        """Rows of the given song ids that are in the snapshot (ids are sorted, so this is a binary search)"""
+        song_ids = np.fromiter((song_id for song_id in song_ids if song_id is not None), dtype=np.int64)
+        if len(self) == 0 or len(song_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.song_ids, song_ids), len(self) - 1)
+        return rows[self.song_ids[rows] == song_ids]
+
+    def memory_usage(self):
+        """Bytes held by the arrays"""
+        arrays = (self.song_ids, self.artist_indptr, self.artist_indices, self.artist_rows, self.genre_bits)
+        return sum(array.nbytes for array in arrays)
+
+
+def _load_new_songs(catalog, chunk_size=20000):
+    """
+    The snapshot with the songs past its max id appended, read in
+    keyset-paginated chunks: a copy when there are any, else the snapshot itself.
+    """
+    updated = None
+    while True:
+        rows = list(
+            Song.objects.filter(id__gt=(updated or catalog).max_song_id).order_by('id').values_list('id', 'artist', 'genre')[:chunk_size]
+        )
+        if not rows:
+            return updated or catalog
+        if updated is None:
+            updated = catalog.copy()
+        updated.add_songs(rows)
+
+
+_catalog = None
+# Held while a snapshot is built, so one process never builds two at once
+_build_lock = threading.Lock()
+
+
+def build_catalog(rebuild=False):
+    """
+    Top this process's snapshot up with songs added since it was built (or
+    read every song into a new one when rebuild=True), and swap the result in
+    once it is complete; readers keep the snapshot they already hold.
+    """
+    global _catalog
+    started = time.time()
+    previous = _catalog if not rebuild else None
+    catalog = _load_new_songs(previous or CatalogSnapshot())
+    catalog.checked_at = time.time()
+    if catalog is not previous:
+        logger.info(
+            f"Catalog snapshot: {len(catalog) - (len(previous) if previous else 0)} songs added, {len(catalog)} total, "
+            f"{len(catalog.artist_index)} artists, {len(catalog.genre_index)} genres, "
+            f"{catalog.memory_usage() / 1024:.0f} KiB in {time.time() - started:.2f}s"
+        )
+    _catalog = catalog
+    return catalog
+
+
+def _refresh_catalog():
+    catalog = _catalog
+    build_catalog(rebuild=catalog is not None and time.time() - catalog.built_at > CATALOG_MAX_AGE)
+
+
+def get_catalog(force_refresh=False):
+    """
+    This process's catalog snapshot. Only the first call (or force_refresh)
+    builds it in the caller's thread; after that a stale snapshot is served
+    while a background thread adds songs created since the last check (at most
+    every CATALOG_REFRESH_INTERVAL seconds) or, once it is older than
+    CATALOG_MAX_AGE, rebuilds it from scratch to pick up edits and deletes.
+    """
+    catalog = _catalog
+    if catalog is None or force_refresh:
+        with _build_lock:
+            catalog = _catalog
+            if catalog is None or force_refresh:
+                catalog = build_catalog()
+        return catalog
+
+    if time.time() - catalog.checked_at >= CATALOG_REFRESH_INTERVAL:
+        refresh_in_background(_build_lock, _refresh_catalog, 'catalog snapshot')
+    return catalog
@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .background import refresh_in_background
+from .interaction_matrix import load_interaction_matrix
+from .ranking import top_k
+
+logger = logging.getLogger(__name__)
+
+# New interactions are folded in at most this often; a full rebuild (deleted actions) runs after GRAPH_MAX_AGE
+GRAPH_REFRESH_INTERVAL = 60
+GRAPH_MAX_AGE = 3600
+
+# Each query takes WALK_STEPS user -> song -> user hops spread over WALKERS parallel walkers.
+# After every hop pair a walker jumps back to its start with RESTART_PROBABILITY,
+# so walks stay close to the query (about 1 / RESTART_PROBABILITY hop pairs each)
+WALK_STEPS = 20000
+WALKERS = 500
+RESTART_PROBABILITY = 0.3
+
+
+def _adjacency(matrix):
+    """(indptr, indices, cumulative edge weights) of a CSR matrix, for weighted neighbor sampling"""
+    matrix = matrix.tocsr()
+    matrix.sort_indices()
+    return matrix.indptr, matrix.indices, np.cumsum(matrix.data, dtype=np.float64)
+
+
+class InteractionGraph:
+    """
+    The user <-> song bipartite graph of the interaction matrix as two CSR
+    adjacency arrays. Edges are weighted by interaction strength, so a walker
+    moves to a neighbor with probability proportional to its edge weight.
+    """
+
+    def __init__(self, data):
+        matrix = data.matrix
+        self.n_users, self.n_songs = matrix.shape
+        self.user_ids, self.song_ids = data.user_ids, data.song_ids
+        # A shared matrix snapshot never changes its id maps
+        self._user_index = data.user_index
+        self._song_index = data.song_index
+        self.user_songs = _adjacency(matrix)
+        self.song_users = _adjacency(matrix.T)
+        self.high_water_mark = data.high_water_mark
+        self.built_at = time.time()
+        self.checked_at = time.time()
+
+    def user_node(self, user_id):
+        node = self._user_index.get(user_id)
+        return node if node is not None and node < self.n_users else None
+
+    def song_node(self, song_id):
+        node = self._song_index.get(song_id)
+        return node if node is not None and node < self.n_songs else None
+
+    def songs_of_user(self, node):
+        indptr, indices, _ = self.user_songs
+        return indices[indptr[node]:indptr[node + 1]]
+
+    @staticmethod
+    def _step(adjacency, nodes, rng):
+        """One weighted random neighbor of each node (every node in the graph has at least one edge)"""
+        indptr, indices, cumulative = adjacency
+        start, end = indptr[nodes], indptr[nodes + 1]
+        before = np.where(start > 0, cumulative[start - 1], 0.0)
+        targets = before + rng.random(len(nodes)) * (cumulative[end - 1] - before)
+        positions = np.clip(np.searchsorted(cumulative, targets, side='right'), start, end - 1)
+        return indices[positions]
+
+    def walk(self, user_nodes=(), song_nodes=(), steps=WALK_STEPS, restart_probability=RESTART_PROBABILITY, seed=None):
+        """
+        Random walk with restart from the given user and/or song nodes, with the
+        walkers shared out over the start nodes. Returns (song nodes, visits)
+        and (user nodes, visits) of every node reached; a walk from a song
+        counts its first hop to a listener as a user visit.
+        """
+        rng = np.random.default_rng(seed)
+        starts = np.concatenate([np.asarray(user_nodes, dtype=np.int64), np.asarray(song_nodes, dtype=np.int64)])
+        if not len(starts):
+            empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+            return empty, empty
+
+        n_walkers = min(WALKERS, steps)
+        origins = np.resize(starts, n_walkers)
+        from_song = np.resize(np.r_[np.zeros(len(user_nodes), dtype=bool), np.ones(len(song_nodes), dtype=bool)], n_walkers)
+
+        def restart(walkers):
+            users = origins[walkers].copy()
+            on_song = from_song[walkers]
+            users[on_song] = self._step(self.song_users, origins[walkers][on_song], rng)
+            return users
+
+        users = restart(np.arange(n_walkers))
+        song_visits, user_visits = [], []
+        for _ in range(-(-steps // n_walkers)):
+            songs = self._step(self.user_songs, users, rng)
+            users = self._step(self.song_users, songs, rng)
+            song_visits.append(songs)
+            user_visits.append(users)
+
+            restarting = np.flatnonzero(rng.random(n_walkers) < restart_probability)
+            if len(restarting):
+                users[restarting] = restart(restarting)
+
+        return (
+            np.unique(np.concatenate(song_visits), return_counts=True),
+            np.unique(np.concatenate(user_visits), return_counts=True)
+        )
+
+    def _top_visited(self, nodes, visits, ids, limit, exclude_nodes):
+        """[(id, share of visits)] of the most visited nodes, excluding exclude_nodes"""
+        if not len(nodes):
+            return []
+        top, counts = top_k(visits, limit, seen=np.isin(nodes, exclude_nodes), ids=nodes)
+        total = int(visits.sum())
+        return [(int(node_id), count / total) for node_id, count in zip(ids[top].tolist(), counts.tolist())]
+
+    def recommend_for_user(self, user_id, limit=20, exclude_song_ids=(), **walk_options):
+        """[(song id, visit share)] reached from the user, skipping their own songs and exclude_song_ids"""
+        node = self.user_node(user_id)
+        if node is None:
+            return []
+        (songs, visits), _ = self.walk(user_nodes=[node], **walk_options)
+        excluded = np.concatenate([self.songs_of_user(node), self._song_nodes(exclude_song_ids)])
+        return self._top_visited(songs, visits, self.song_ids, limit, excluded)
+
+    def similar_songs(self, song_ids, limit=20, **walk_options):
+        """[(song id, visit share)] reached from one or more query songs, skipping the queries"""
+        nodes = self._song_nodes(song_ids)
+        if not len(nodes):
+            return []
+        (songs, visits), _ = self.walk(song_nodes=nodes, **walk_options)
+        return self._top_visited(songs, visits, self.song_ids, limit, nodes)
+
+    def similar_users(self, user_id, limit=20, exclude_user_ids=(), **walk_options):
+        """[(user id, visit share)] of the listeners the user's walks reach most often"""
+        node = self.user_node(user_id)
+        if node is None:
+            return []
+        _, (users, visits) = self.walk(user_nodes=[node], **walk_options)
+        excluded = np.r_[node, [other for other in map(self.user_node, exclude_user_ids) if other is not None]].astype(np.int64)
+        return self._top_visited(users, visits, self.user_ids, limit, excluded)
+
+    def _song_nodes(self, song_ids):
+        return np.asarray([n for n in map(self.song_node, song_ids) if n is not None], dtype=np.int64)
+
+
+_graph = None
+# Held while a graph is built, so one process never builds two at once
+_build_lock = threading.Lock()
+
+
+def build_graph(rebuild=False):
+    """
+    Build this process's interaction graph from the interaction matrix (every
+    action from scratch when rebuild=True) into a new object, and swap it in
+    once it is complete; readers keep the graph they already hold.
+    """
+    global _graph
+    started = time.time()
+    previous = _graph
+    # Serving processes keep their own copy; the snapshot on disk belongs to the offline jobs
+    data = load_interaction_matrix(rebuild=rebuild, save=False)
+    if previous is not None and not rebuild and data.high_water_mark == previous.high_water_mark:
+        previous.checked_at = time.time()
+        return previous
+
+    graph = InteractionGraph(data)
+    if previous is not None and not rebuild:
+        graph.built_at = previous.built_at
+    logger.info(
+        f"Interaction graph: {graph.n_users} users, {graph.n_songs} songs, "
+        f"{len(graph.user_songs[1])} edges (action {graph.high_water_mark}) in {time.time() - started:.2f}s"
+    )
+    _graph = graph
+    return graph
+
+
+def _refresh_graph():
+    graph = _graph
+    build_graph(rebuild=graph is not None and time.time() - graph.built_at > GRAPH_MAX_AGE)
+
+
+def get_graph(force_refresh=False):
+    """
+    This process's interaction graph. Only the first call (or force_refresh)
+    builds it in the caller's thread; after that a stale graph is served while
+    a background thread folds in new actions (checked at most every
+    GRAPH_REFRESH_INTERVAL seconds) or, once it is older than GRAPH_MAX_AGE,
+    rebuilds it from every action.
+    """
+    graph = _graph
+    if graph is None or force_refresh:
+        with _build_lock:
+            graph = _graph
+            if graph is None or force_refresh:
+                graph = build_graph()
+        return graph
+
+    if time.time() - graph.checked_at >= GRAPH_REFRESH_INTERVAL:
+        refresh_in_background(_build_lock, _refresh_graph, 'interaction graph')
+    return graph
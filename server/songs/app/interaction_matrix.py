@@ -0,0 +1,221 @@
+import copy
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from django.conf import settings
+
+from .models import Action
+
+logger = logging.getLogger(__name__)
+
+# Implicit feedback strength per action type (same values the dense builder used)
+INTERACTION_WEIGHTS = {
+    'like': 5.0,
+    'save': 3.0,
+    'play': 1.0
+}
+
+SNAPSHOT_FILENAME = 'interactions.npz'
+
+
+def get_data_dir():
+    """Directory for recommender snapshots and model files"""
+    data_dir = settings.RECOMMENDER_DATA_DIR
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
+def _dedupe_max(rows, cols, values):
+    """Keep one entry per (row, col): the strongest action wins"""
+    if len(rows) == 0:
+        return rows, cols, values
+    order = np.lexsort((values, cols, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    last = np.r_[(rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1]), True]
+    return rows[last], cols[last], values[last]
+
+
+class InteractionMatrix:
+    """
+    Sparse user x song interaction matrix with stable id <-> index maps.
+
+    Users and songs keep their index once assigned; ids seen for the first
+    time are appended, so an incremental rebuild never renumbers existing rows
+    or columns. high_water_mark is the largest Action id folded in.
+
+    The in-process snapshot is shared between threads and never changed:
+    load_interaction_matrix folds new actions into a copy and swaps it in.
+    """
+
+    def __init__(self, user_ids=None, song_ids=None, rows=None, cols=None, values=None, high_water_mark=0):
+        self.user_ids = np.asarray(user_ids if user_ids is not None else [], dtype=np.int64)
+        self.song_ids = np.asarray(song_ids if song_ids is not None else [], dtype=np.int64)
+        self.rows = np.asarray(rows if rows is not None else [], dtype=np.int32)
+        self.cols = np.asarray(cols if cols is not None else [], dtype=np.int32)
+        self.values = np.asarray(values if values is not None else [], dtype=np.float32)
+        self.high_water_mark = int(high_water_mark)
+        self._reset_cached()
+
+    def _reset_cached(self):
+        self._matrix = None
+        self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids.tolist())}
+        self.song_index = {song_id: i for i, song_id in enumerate(self.song_ids.tolist())}
+
+    @property
+    def shape(self):
+        return len(self.user_ids), len(self.song_ids)
+
+    @property
+    def nnz(self):
+        return len(self.values)
+
+    @property
+    def matrix(self):
+        """CSR matrix (users x songs), built lazily"""
+        if self._matrix is None:
+            self._matrix = csr_matrix((self.values, (self.rows, self.cols)), shape=self.shape)
+        return self._matrix
+
+    def copy(self):
+        """Copy to fold interactions into; the arrays are shared until add_interactions replaces them"""
+        data = copy.copy(self)
+        data.user_index = dict(self.user_index)
+        data.song_index = dict(self.song_index)
+        data._matrix = None
+        return data
+
+    def _indices_for(self, ids, id_index, known_ids):
+        """Map ids to indices, appending unseen ids to the end of the map"""
+        new_ids = [i for i in dict.fromkeys(ids.tolist()) if i not in id_index]
+        for new_id in new_ids:
+            id_index[new_id] = len(id_index)
+        if new_ids:
+            known_ids = np.concatenate([known_ids, np.asarray(new_ids, dtype=np.int64)])
+        return np.fromiter((id_index[i] for i in ids.tolist()), dtype=np.int32, count=len(ids)), known_ids
+
+    def add_interactions(self, user_ids, song_ids, values, high_water_mark):
+        """Fold a batch of (user_id, song_id, weight) interactions into the matrix (only one not yet shared)"""
+        rows, self.user_ids = self._indices_for(user_ids, self.user_index, self.user_ids)
+        cols, self.song_ids = self._indices_for(song_ids, self.song_index, self.song_ids)
+
+        self.rows, self.cols, self.values = _dedupe_max(
+            np.concatenate([self.rows, rows]),
+            np.concatenate([self.cols, cols]),
+            np.concatenate([self.values, np.asarray(values, dtype=np.float32)])
+        )
+        self.high_water_mark = max(self.high_water_mark, int(high_water_mark))
+        self._matrix = None
+
+    def save(self, path):
+        """
+        Write a compressed snapshot; the rename makes the swap atomic for
+        readers, and each writer has its own temp file, so concurrent saves
+        never interleave (the last rename wins).
+        """
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.interactions-', suffix='.npz', delete=False) as tmp:
+            tmp_path = tmp.name
+        try:
+            np.savez_compressed(
+                tmp_path,
+                user_ids=self.user_ids,
+                song_ids=self.song_ids,
+                rows=self.rows,
+                cols=self.cols,
+                values=self.values,
+                high_water_mark=np.int64(self.high_water_mark)
+            )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as snapshot:
+            return cls(
+                user_ids=snapshot['user_ids'],
+                song_ids=snapshot['song_ids'],
+                rows=snapshot['rows'],
+                cols=snapshot['cols'],
+                values=snapshot['values'],
+                high_water_mark=int(snapshot['high_water_mark'])
+            )
+
+
+def stream_interactions(since_id=0, chunk_size=50000):
+    """
+    Yield (user_ids, song_ids, weights, last_action_id) numpy chunks of weighted
+    actions with id > since_id, using keyset pagination on the Action id.
+    """
+    last_id = since_id
+    while True:
+        chunk = list(
+            Action.objects.filter(
+                id__gt=last_id,
+                song__isnull=False,
+                action_type__in=list(INTERACTION_WEIGHTS)
+            ).order_by('id').values_list('id', 'user_id', 'song_id', 'action_type')[:chunk_size]
+        )
+        if not chunk:
+            return
+
+        action_ids, user_ids, song_ids, action_types = zip(*chunk)
+        last_id = action_ids[-1]
+        yield (
+            np.asarray(user_ids, dtype=np.int64),
+            np.asarray(song_ids, dtype=np.int64),
+            np.asarray([INTERACTION_WEIGHTS[t] for t in action_types], dtype=np.float32),
+            last_id
+        )
+
+
+_cached_matrix = None
+
+
+def load_interaction_matrix(rebuild=False, save=True, chunk_size=50000):
+    """
+    Get the current interaction matrix.
+
+    Starts from the in-process copy or the on-disk snapshot and folds in only
+    the actions above its high-water mark. rebuild=True starts from scratch,
+    which also drops interactions whose Action rows were deleted (e.g. unlikes).
+    New actions go into a copy of the in-process snapshot, which replaces it
+    once complete, so callers holding the previous one never see it change.
+    """
+    global _cached_matrix
+    started = time.time()
+    path = os.path.join(get_data_dir(), SNAPSHOT_FILENAME)
+
+    shared = None
+    if rebuild:
+        data = InteractionMatrix()
+    elif _cached_matrix is not None:
+        data = shared = _cached_matrix
+    elif os.path.exists(path):
+        data = InteractionMatrix.load(path)
+    else:
+        data = InteractionMatrix()
+
+    previous_mark = data.high_water_mark
+    for user_ids, song_ids, weights, last_id in stream_interactions(previous_mark, chunk_size):
+        if data is shared:
+            data = shared.copy()
+        data.add_interactions(user_ids, song_ids, weights, last_id)
+
+    if data.high_water_mark != previous_mark or rebuild:
+        logger.info(
+            f"Interaction matrix {data.shape[0]}x{data.shape[1]} with {data.nnz} entries "
+            f"updated to action {data.high_water_mark} in {time.time() - started:.2f}s"
+        )
+        if save:
+            data.save(path)
+
+    # A concurrent load may have swapped in a newer snapshot meanwhile; keep that one
+    current = _cached_matrix
+    if rebuild or current is None or data.high_water_mark >= current.high_water_mark:
+        _cached_matrix = data
+    return data
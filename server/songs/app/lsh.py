@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Action, UserProfile, UserMinHash, LSHBucket
+from .similarity import SIMILARITY_TOP_K, score_user_against, replace_user_neighbors, upsert_similarities
+
+logger = logging.getLogger(__name__)
+
+# MinHash signature length and banding: LSH_BANDS bands of (LSH_NUM_PERM // LSH_BANDS) rows.
+# Two users with Jaccard similarity s collide in at least one band with probability
+# 1 - (1 - s^rows)^bands, so 16 bands of 4 rows catches most pairs above s ~ 0.4.
+LSH_NUM_PERM = getattr(settings, 'LSH_NUM_PERM', 64)
+LSH_BANDS = getattr(settings, 'LSH_BANDS', 16)
+LSH_ROWS = LSH_NUM_PERM // LSH_BANDS
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Fixed seed so signatures stay comparable across processes and rebuilds
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=LSH_NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=LSH_NUM_PERM, dtype=np.uint64)
+
+
+def song_token(song_id):
+    return f"s:{song_id}"
+
+
+def artist_token(artist):
+    return f"a:{artist}"
+
+
+def _token_hashes(tokens):
+    """Stable 32-bit hash of each token"""
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), 'little') for token in tokens],
+        dtype=np.uint64
+    )
+
+
+def minhash_signature(tokens, signature=None):
+    """
+    MinHash signature of a token set. When an existing signature is given the
+    tokens are folded into it, which is how new interactions are added incrementally.
+    """
+    if signature is None:
+        signature = np.full(LSH_NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    if not tokens:
+        return signature
+
+    hashes = _token_hashes(tokens)
+    with np.errstate(over='ignore'):
+        permuted = ((hashes[:, None] * _PERM_A + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+    return np.minimum(signature, permuted.min(axis=0))
+
+
+def band_hashes(signature):
+    """One signed 64-bit bucket key per band"""
+    bands = signature.astype(np.uint32).reshape(LSH_BANDS, LSH_ROWS)
+    return [
+        int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), 'little', signed=True)
+        for band in bands
+    ]
+
+
+def user_tokens(user_id):
+    """Songs the user interacted with plus their favorite artists"""
+    song_ids = Action.objects.filter(user_id=user_id, song__isnull=False).values_list('song_id', flat=True).distinct()
+    tokens = [song_token(song_id) for song_id in song_ids]
+
+    preferences = UserProfile.objects.filter(user_id=user_id).values_list('preferences', flat=True).first() or {}
+    tokens.extend(artist_token(artist) for artist in preferences.get('favorite_artists') or [])
+    return tokens
+
+
+def _store_signature(user_id, signature):
+    """Persist a signature and move the user to the buckets of the bands that changed"""
+    if (signature == _MAX_HASH).all():
+        # Empty token set: every such user would share the same buckets
+        LSHBucket.objects.filter(user_id=user_id).delete()
+        return []
+
+    buckets = band_hashes(signature)
+
+    with transaction.atomic():
+        UserMinHash.objects.update_or_create(
+            user_id=user_id,
+            defaults={'signature': signature.astype(np.uint32).tobytes()}
+        )
+        current = dict(LSHBucket.objects.filter(user_id=user_id).values_list('band', 'bucket'))
+        changed = [
+            LSHBucket(user_id=user_id, band=band, bucket=bucket)
+            for band, bucket in enumerate(buckets)
+            if current.get(band) != bucket
+        ]
+        if changed:
+            LSHBucket.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['user', 'band'],
+                update_fields=['bucket']
+            )
+    return buckets
+
+
+def load_signature(user_id):
+    stored = UserMinHash.objects.filter(user_id=user_id).values_list('signature', flat=True).first()
+    if stored is None:
+        return None
+    return np.frombuffer(bytes(stored), dtype=np.uint32).astype(np.uint64)
+
+
+def update_user_signature(user_id, new_tokens=None):
+    """
+    Keep a user's signature current. New tokens (e.g. the song of a new action)
+    are folded into the stored signature; without a stored signature, or
+    without new tokens, the signature is recomputed from the user's history.
+    """
+    signature = load_signature(user_id) if new_tokens else None
+    if signature is None:
+        signature = minhash_signature(user_tokens(user_id))
+    else:
+        signature = minhash_signature(new_tokens, signature)
+    return _store_signature(user_id, signature)
+
+
+def rebuild_lsh_index(batch_size=1000):
+    """Recompute every user's signature and bucket assignment from scratch"""
+    started = time.time()
+
+    tokens_by_user = {}
+    for user_id, song_id in Action.objects.filter(song__isnull=False).values_list('user_id', 'song_id').distinct().iterator(chunk_size=20000):
+        tokens_by_user.setdefault(user_id, []).append(song_token(song_id))
+    for user_id, preferences in UserProfile.objects.values_list('user_id', 'preferences'):
+        artists = (preferences or {}).get('favorite_artists') or []
+        if artists:
+            tokens_by_user.setdefault(user_id, []).extend(artist_token(artist) for artist in artists)
+
+    user_ids = list(tokens_by_user)
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        signatures, buckets = [], []
+        for user_id in batch:
+            signature = minhash_signature(tokens_by_user[user_id])
+            signatures.append(UserMinHash(user_id=user_id, signature=signature.astype(np.uint32).tobytes()))
+            buckets.extend(
+                LSHBucket(user_id=user_id, band=band, bucket=bucket)
+                for band, bucket in enumerate(band_hashes(signature))
+            )
+
+        with transaction.atomic():
+            UserMinHash.objects.filter(user_id__in=batch).delete()
+            LSHBucket.objects.filter(user_id__in=batch).delete()
+            UserMinHash.objects.bulk_create(signatures, batch_size=5000)
+            LSHBucket.objects.bulk_create(buckets, batch_size=5000)
+
+    logger.info(f"LSH index rebuilt for {len(user_ids)} users in {time.time() - started:.1f}s")
+    return len(user_ids)
+
+
+def find_candidate_neighbors(user_id, limit=200):
+    """
+    Users sharing at least one LSH bucket with the given user, most shared bands first.
+    The number of shared bands grows with the Jaccard similarity of the two users.
+    """
+    buckets = list(LSHBucket.objects.filter(user_id=user_id).values_list('band', 'bucket'))
+    if not buckets:
+        buckets = list(enumerate(update_user_signature(user_id)))
+    if not buckets:
+        return []
+
+    match = Q()
+    for band, bucket in buckets:
+        match |= Q(band=band, bucket=bucket)
+
+    candidates = LSHBucket.objects.filter(match).exclude(user_id=user_id).values('user_id').annotate(
+        shared_bands=Count('id')
+    ).order_by('-shared_bands')[:limit]
+    return [item['user_id'] for item in candidates]
+
+
+def similar_users_from_lsh(user, top_n=10):
+    """
+    Approximate nearest neighbors: fetch LSH candidates, rescore only those
+    exactly with the similarity engine and store them as the user's neighbor list.
+    Returns a list of (user_id, similarity_score), best first.
+    """
+    candidates = find_candidate_neighbors(user.id)
+    if not candidates:
+        return []
+
+    own, reverse = score_user_against(user.id, candidates, top_k=SIMILARITY_TOP_K)
+    with transaction.atomic():
+        replace_user_neighbors(user.id, own)
+        upsert_similarities(reverse)
+
+    own.sort(key=lambda sim: sim.similarity_score, reverse=True)
+    return [(sim.user2_id, sim.similarity_score) for sim in own[:top_n]]
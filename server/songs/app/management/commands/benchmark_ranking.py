@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from app.ranking import top_k
+
+
+def legacy_top_k(scores, k, seen_ids, item_ids):
+    """The per-item Python ranking recommend_from_factors used before the kernel"""
+    unrated_indices = [i for i in range(len(scores)) if item_ids[i] not in seen_ids]
+    recommendations = [(int(item_ids[idx]), scores[idx]) for idx in unrated_indices]
+    recommendations.sort(key=lambda x: x[1], reverse=True)
+    return recommendations[:k]
+
+
+def _timings(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return np.percentile(timings, 50), np.percentile(timings, 95)
+
+
+class Command(BaseCommand):
+    help = 'Measures top-K ranking latency on synthetic scores (no database access)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1_000_000, help='Items per score vector')
+        parser.add_argument('--k', type=int, default=50, help='Items to return per user')
+        parser.add_argument('--seen', type=int, default=500, help='Seen items masked per user')
+        parser.add_argument('--batch', type=int, default=64, help='Users per matrix in the batch measurement')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per measurement')
+        parser.add_argument('--legacy', action='store_true', help='Also time the old per-item Python ranking (slow)')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        n_items, k, repeat = options['items'], options['k'], options['repeat']
+        item_ids = np.arange(1, n_items + 1, dtype=np.int64)
+        scores = rng.standard_normal(n_items).astype(np.float32)
+        seen_ids = rng.choice(item_ids, size=min(options['seen'], n_items), replace=False)
+
+        def single():
+            top_k(scores, k, seen=np.isin(item_ids, seen_ids), ids=item_ids)
+
+        p50, p95 = _timings(single, repeat)
+        self.stdout.write(f'top_k, 1 user x {n_items} items, k={k}: p50 {p50:.2f} ms, p95 {p95:.2f} ms')
+
+        batch = rng.standard_normal((options['batch'], n_items)).astype(np.float32)
+        seen = np.zeros(batch.shape, dtype=bool)
+        seen[:, :options['seen']] = True
+
+        p50, p95 = _timings(lambda: top_k(batch, k, seen=seen), max(repeat // 4, 1))
+        self.stdout.write(
+            f'top_k, {options["batch"]} users x {n_items} items, k={k}: '
+            f'p50 {p50:.2f} ms ({p50 / options["batch"]:.2f} ms/user), p95 {p95:.2f} ms'
+        )
+
+        if options['legacy']:
+            seen_set = set(seen_ids.tolist())
+            expected, _ = top_k(scores, k, seen=np.isin(item_ids, seen_ids), ids=item_ids)
+            legacy = legacy_top_k(scores, k, seen_set, item_ids)
+            if [song_id for song_id, _ in legacy] != expected.tolist():
+                self.stdout.write(self.style.WARNING('Legacy ranking returned a different list'))
+            p50, p95 = _timings(lambda: legacy_top_k(scores, k, seen_set, item_ids), 1)
+            self.stdout.write(f'legacy, 1 user x {n_items} items, k={k}: {p50:.2f} ms')
+
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
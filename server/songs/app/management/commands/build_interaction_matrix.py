@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from app.interaction_matrix import load_interaction_matrix
+
+class Command(BaseCommand):
+    help = 'Updates the user-song interaction matrix snapshot from new actions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild from scratch instead of from the last snapshot')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Building interaction matrix...')
+
+        data = load_interaction_matrix(rebuild=options['full'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Interaction matrix {data.shape[0]}x{data.shape[1]} with {data.nnz} entries '
+            f'(up to action {data.high_water_mark})'
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from app.lsh import rebuild_lsh_index
+
+class Command(BaseCommand):
+    help = 'Rebuilds the MinHash/LSH index used for approximate similar-user lookup'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding LSH index...')
+
+        total = rebuild_lsh_index()
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} users'))
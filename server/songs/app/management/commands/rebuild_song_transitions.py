@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from app.next_track import rebuild_transitions
+
+class Command(BaseCommand):
+    help = 'Recomputes the song-to-song play transition counts from the listening history'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding song transitions...')
+
+        count = rebuild_transitions()
+
+        self.stdout.write(self.style.SUCCESS(f'Stored {count} song transitions'))
@@ -0,0 +1,16 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from app.user_features import rebuild_user_features
+
+class Command(BaseCommand):
+    help = 'Backfills UserFeatures (and profile favorites) from each user\'s action history'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding user features...')
+
+        count = 0
+        for user_id in User.objects.values_list('id', flat=True).iterator():
+            rebuild_user_features(user_id)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt features for {count} users'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from app.similarity import recompute_all_user_similarities
+
+class Command(BaseCommand):
+    help = 'Recomputes UserSimilarity for all users with the batch similarity engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--block-size', type=int, default=1000,
+                            help='Number of users scored per sparse matrix product')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Recomputing user similarities...')
+
+        total = recompute_all_user_similarities(block_size=options['block_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Stored {total} user similarities'))
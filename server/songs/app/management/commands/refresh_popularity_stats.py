@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from app.popularity import refresh_recent_stats, rebuild_popularity_stats, STATS_WINDOW_DAYS
+
+class Command(BaseCommand):
+    help = 'Re-aggregates the rolling-window song/artist popularity counters (run periodically, e.g. hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute the all-time counters from the full action history too')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write('Rebuilding popularity stats...')
+            rebuild_popularity_stats()
+        else:
+            self.stdout.write(f'Refreshing {STATS_WINDOW_DAYS}-day popularity counters...')
+            refresh_recent_stats()
+
+        self.stdout.write(self.style.SUCCESS('Popularity stats updated'))
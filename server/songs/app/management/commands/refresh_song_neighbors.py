@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from app.song_similarity import refresh_song_neighbors
+
+class Command(BaseCommand):
+    help = 'Updates the item-item song neighbor lists from interactions since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Rescore every song instead of only the changed ones')
+        parser.add_argument('--block-size', type=int, default=500,
+                            help='Number of songs scored per sparse matrix product')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Refreshing song neighbors...')
+
+        songs, rows = refresh_song_neighbors(rebuild=options['rebuild'], block_size=options['block_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Rescored {songs} songs, stored {rows} neighbors'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from app.trending import prune_buckets, rebuild_buckets, BUCKET_RETENTION_DAYS
+
+class Command(BaseCommand):
+    help = 'Prunes hourly trending buckets past the retention period (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute the buckets from the action history')
+        parser.add_argument('--days', type=int, default=BUCKET_RETENTION_DAYS, help='Retention period in days')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write('Rebuilding trending buckets...')
+            count = rebuild_buckets(options['days'])
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} buckets'))
+
+        deleted = prune_buckets(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} expired buckets'))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from app.algorithms import train_als_model, train_svd_model, train_bpr_model
+
+class Command(BaseCommand):
+    help = 'Trains the factor models and publishes them as the current version in the model store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=['all', 'als', 'svd', 'bpr'], default='all', help='Model to train')
+        parser.add_argument('--factors', type=int, default=20, help='Number of latent factors')
+        parser.add_argument('--iterations', type=int, default=15, help='Number of ALS iterations')
+        parser.add_argument('--reg', type=float, default=0.1, help='Regularization parameter')
+        parser.add_argument('--epochs', type=int, default=20, help='Number of BPR epochs')
+        parser.add_argument('--learning-rate', type=float, default=0.05, help='BPR learning rate')
+        parser.add_argument('--warm-start', action='store_true',
+                            help='Continue from the current ALS model instead of training from scratch')
+
+    def handle(self, *args, **options):
+        if options['model'] in ('all', 'als'):
+            self.stdout.write('Training ALS model...')
+            model = train_als_model(
+                n_factors=options['factors'],
+                n_iterations=options['iterations'],
+                reg_param=options['reg'],
+                warm_start=options['warm_start']
+            )
+            self.stdout.write(self.style.SUCCESS(f'ALS model version {model.version} is now current'))
+
+        if options['model'] in ('all', 'svd'):
+            self.stdout.write('Training SVD model...')
+            model = train_svd_model(k=options['factors'])
+            if model is None:
+                self.stdout.write(self.style.WARNING('Not enough data to train the SVD model'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'SVD model version {model.version} is now current'))
+
+        if options['model'] in ('all', 'bpr'):
+            self.stdout.write('Training BPR model...')
+            model = train_bpr_model(
+                n_factors=options['factors'],
+                n_epochs=options['epochs'],
+                learning_rate=options['learning_rate']
+            )
+            if model is None:
+                self.stdout.write(self.style.WARNING('No interactions to train the BPR model'))
+            else:
+                for epoch in model.meta['epochs']:
+                    self.stdout.write(
+                        f"  epoch {epoch['epoch']}: {epoch['seconds']:.2f}s, "
+                        f"{epoch['samples_per_second']:.0f} samples/s, loss {epoch['loss']:.4f}"
+                    )
+                self.stdout.write(self.style.SUCCESS(f'BPR model version {model.version} is now current'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from app.algorithms import schedule_recommendation_updates
+
+class Command(BaseCommand):
+    help = 'Retrains the factor models and recomputes cached recommendations for all users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Scoring processes (defaults to RECOMMENDATION_WORKERS, 0 = one per core)')
+        parser.add_argument('--chunk-size', type=int, default=1024,
+                            help='Users scored per work unit')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Updating recommendations...')
+
+        schedule_recommendation_updates(workers=options['workers'], chunk_size=options['chunk_size'])
+
+        self.stdout.write(self.style.SUCCESS('Recommendations updated'))
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:54
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_scores_into_terms(apps, schema_editor):
+    # Existing rows keep their score: overlap_score / normalizer(1.0) == similarity_score
+    UserSimilarity = apps.get_model('app', 'UserSimilarity')
+    UserSimilarity.objects.update(overlap_score=F('similarity_score'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_alter_song_spotify_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersimilarity',
+            name='artist_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='usersimilarity',
+            name='normalizer',
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.AddField(
+            model_name='usersimilarity',
+            name='overlap_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(copy_scores_into_terms, migrations.RunPython.noop),
+    ]
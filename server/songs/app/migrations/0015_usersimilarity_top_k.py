@@ -0,0 +1,38 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_pairs(apps, schema_editor):
+    # Both directions used to be written with update_or_create and no constraint;
+    # keep the newest row of each (user1, user2) pair
+    UserSimilarity = apps.get_model('app', 'UserSimilarity')
+    duplicates = UserSimilarity.objects.values('user1_id', 'user2_id').annotate(
+        keep_id=Max('id'), n=Count('id')
+    ).filter(n__gt=1).order_by()
+    for pair in duplicates.iterator():
+        UserSimilarity.objects.filter(
+            user1_id=pair['user1_id'], user2_id=pair['user2_id']
+        ).exclude(id=pair['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_usersimilarity_score_terms'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_pairs, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='usersimilarity',
+            index=models.Index(fields=['user1', '-similarity_score'], include=('user2',), name='usersim_user1_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='usersimilarity',
+            constraint=models.UniqueConstraint(fields=('user1', 'user2'), name='unique_user_similarity_pair'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Same weights and window as user_features.py at the time of this migration
+FEATURE_ACTION_WEIGHTS = {'like': 3.0, 'save': 3.0, 'share': 2.0, 'complete': 2.0, 'play': 1.0, 'view': 0.5, 'skip': -1.0}
+RECENT_PLAYS_LIMIT = 50
+
+
+def _split(value):
+    if not value:
+        return []
+    return list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+
+
+def _add_weight(weights, key, delta):
+    value = weights.get(key, 0.0) + delta
+    if abs(value) < 1e-9:
+        weights.pop(key, None)
+    else:
+        weights[key] = value
+
+
+def backfill_user_features(apps, schema_editor):
+    # Fold every user's action history into their counters, oldest first, as user_features.rebuild_user_features does
+    Action = apps.get_model('app', 'Action')
+    UserFeatures = apps.get_model('app', 'UserFeatures')
+
+    history = Action.objects.order_by('user_id', 'timestamp', 'id').values_list(
+        'user_id', 'action_type', 'song_id', 'song__artist', 'song__genre', 'timestamp'
+    )
+    batch, features = [], None
+    for user_id, action_type, song_id, artist, genre, timestamp in history.iterator(chunk_size=20000):
+        if features is None or features.user_id != user_id:
+            if features is not None:
+                batch.append(features)
+            features = UserFeatures(user_id=user_id, artist_weights={}, genre_weights={}, action_counts={}, recent_plays=[])
+            if len(batch) >= 1000:
+                UserFeatures.objects.bulk_create(batch)
+                batch = []
+
+        _add_weight(features.action_counts, action_type, 1)
+        weight = FEATURE_ACTION_WEIGHTS.get(action_type)
+        if song_id is None or weight is None:
+            continue
+        for name in _split(artist):
+            _add_weight(features.artist_weights, name, weight)
+        for name in _split(genre):
+            _add_weight(features.genre_weights, name, weight)
+        if action_type in ('like', 'save'):
+            features.last_liked_song_id = song_id
+        if action_type == 'play':
+            features.recent_plays.insert(0, [song_id, timestamp.timestamp()])
+            del features.recent_plays[RECENT_PLAYS_LIMIT:]
+
+    if features is not None:
+        batch.append(features)
+    UserFeatures.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_lsh_index'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserFeatures',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='features', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('artist_weights', models.JSONField(default=dict)),
+                ('genre_weights', models.JSONField(default=dict)),
+                ('action_counts', models.JSONField(default=dict)),
+                ('recent_plays', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_liked_song', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.song')),
+            ],
+        ),
+        migrations.RunPython(backfill_user_features, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+def _split(value):
+    if not value:
+        return []
+    return list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+
+
+def backfill_artists_and_genres(apps, schema_editor):
+    # Parse the comma-joined Song.artist / Song.genre strings into the new tables
+    Song = apps.get_model('app', 'Song')
+    Artist = apps.get_model('app', 'Artist')
+    Genre = apps.get_model('app', 'Genre')
+
+    songs = list(Song.objects.values_list('id', 'artist', 'genre'))
+    artist_names = {name for _, artist, _ in songs for name in _split(artist)}
+    genre_names = {name for _, _, genre in songs for name in _split(genre)}
+    Artist.objects.bulk_create([Artist(name=name) for name in artist_names], ignore_conflicts=True, batch_size=5000)
+    Genre.objects.bulk_create([Genre(name=name) for name in genre_names], ignore_conflicts=True, batch_size=5000)
+    artist_ids = dict(Artist.objects.values_list('name', 'id'))
+    genre_ids = dict(Genre.objects.values_list('name', 'id'))
+
+    SongArtist = Song.artists.through
+    SongGenre = Song.genres.through
+    SongArtist.objects.bulk_create([
+        SongArtist(song_id=song_id, artist_id=artist_ids[name])
+        for song_id, artist, _ in songs for name in _split(artist)
+    ], ignore_conflicts=True, batch_size=5000)
+    SongGenre.objects.bulk_create([
+        SongGenre(song_id=song_id, genre_id=genre_ids[name])
+        for song_id, _, genre in songs for name in _split(genre)
+    ], ignore_conflicts=True, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_user_features'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='artists',
+            field=models.ManyToManyField(blank=True, related_name='songs', to='app.artist'),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='genres',
+            field=models.ManyToManyField(blank=True, related_name='songs', to='app.genre'),
+        ),
+        migrations.RunPython(backfill_artists_and_genres, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+# Same counters, window and artist score as popularity.py at the time of this migration
+SONG_STAT_ACTIONS = ('play', 'like', 'save', 'skip', 'view', 'share', 'complete')
+RECENT_SONG_STAT_ACTIONS = ('play', 'like', 'save')
+ARTIST_STAT_ACTIONS = ('play', 'like', 'save')
+ARTIST_SCORE_WEIGHTS = {'play': 1.0, 'like': 5.0, 'save': 3.0}
+RECENT_ARTIST_BONUS = 2.0
+STATS_WINDOW_DAYS = 7
+
+
+def _counts(actions, group_field, action_types, prefix=''):
+    counts = {}
+    rows = actions.values(group_field, 'action_type').annotate(count=Count('id')).values_list(group_field, 'action_type', 'count')
+    for key, action_type, count in rows:
+        if key is None:
+            continue
+        counters = counts.setdefault(key, {})
+        counters[f'{prefix}action_count'] = counters.get(f'{prefix}action_count', 0) + count
+        if action_type in action_types:
+            counters[f'{prefix}{action_type}_count'] = counters.get(f'{prefix}{action_type}_count', 0) + count
+    return counts
+
+
+def backfill_song_artist_stats(apps, schema_editor):
+    # One GROUP BY per counter set over the action history, as popularity.rebuild_popularity_stats does
+    Action = apps.get_model('app', 'Action')
+    SongStats = apps.get_model('app', 'SongStats')
+    ArtistStats = apps.get_model('app', 'ArtistStats')
+
+    actions = Action.objects.filter(song__isnull=False)
+    recent = actions.filter(timestamp__gte=timezone.now() - timezone.timedelta(days=STATS_WINDOW_DAYS))
+
+    song_counts = _counts(actions, 'song_id', SONG_STAT_ACTIONS)
+    for song_id, counters in _counts(recent, 'song_id', RECENT_SONG_STAT_ACTIONS, prefix='recent_').items():
+        song_counts.setdefault(song_id, {}).update(counters)
+    SongStats.objects.bulk_create(
+        [SongStats(song_id=song_id, **counters) for song_id, counters in song_counts.items()], batch_size=1000
+    )
+
+    artist_counts = _counts(actions, 'song__artists', ARTIST_STAT_ACTIONS)
+    for artist_id, counters in _counts(recent, 'song__artists', (), prefix='recent_').items():
+        artist_counts.setdefault(artist_id, {}).update(counters)
+    ArtistStats.objects.bulk_create([
+        ArtistStats(
+            artist_id=artist_id,
+            score=sum(counters.get(f'{action_type}_count', 0) * weight for action_type, weight in ARTIST_SCORE_WEIGHTS.items())
+            + counters.get('recent_action_count', 0) * RECENT_ARTIST_BONUS,
+            **counters
+        )
+        for artist_id, counters in artist_counts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_artist_genre'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtistStats',
+            fields=[
+                ('artist', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='app.artist')),
+                ('play_count', models.IntegerField(default=0)),
+                ('like_count', models.IntegerField(default=0)),
+                ('save_count', models.IntegerField(default=0)),
+                ('action_count', models.IntegerField(default=0)),
+                ('recent_action_count', models.IntegerField(default=0)),
+                ('score', models.FloatField(default=0.0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score'], name='artiststats_score_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SongStats',
+            fields=[
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='app.song')),
+                ('play_count', models.IntegerField(default=0)),
+                ('like_count', models.IntegerField(default=0)),
+                ('save_count', models.IntegerField(default=0)),
+                ('skip_count', models.IntegerField(default=0)),
+                ('view_count', models.IntegerField(default=0)),
+                ('share_count', models.IntegerField(default=0)),
+                ('complete_count', models.IntegerField(default=0)),
+                ('action_count', models.IntegerField(default=0)),
+                ('recent_play_count', models.IntegerField(default=0)),
+                ('recent_like_count', models.IntegerField(default=0)),
+                ('recent_save_count', models.IntegerField(default=0)),
+                ('recent_action_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-play_count'], name='songstats_play_idx'), models.Index(fields=['-action_count'], name='songstats_action_idx'), models.Index(fields=['-recent_action_count'], name='songstats_recent_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_song_artist_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:15
+
+import django.db.models.deletion
+from datetime import timezone as dt_timezone
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+# Retention of trending.py at the time of this migration
+BUCKET_RETENTION_DAYS = 180
+
+
+def backfill_hourly_counts(apps, schema_editor):
+    # Bucket the actions of the retention period by song and UTC hour, as trending.rebuild_buckets does
+    Action = apps.get_model('app', 'Action')
+    SongHourlyCount = apps.get_model('app', 'SongHourlyCount')
+
+    since = (timezone.now() - timezone.timedelta(days=BUCKET_RETENTION_DAYS)).astimezone(dt_timezone.utc).replace(
+        minute=0, second=0, microsecond=0
+    )
+    rows = Action.objects.filter(timestamp__gte=since, song__isnull=False).annotate(
+        hour=TruncHour('timestamp', tzinfo=dt_timezone.utc)
+    ).values('song_id', 'hour').annotate(count=Count('id')).values_list('song_id', 'hour', 'count')
+    SongHourlyCount.objects.bulk_create(
+        [SongHourlyCount(song_id=song_id, hour=hour, count=count) for song_id, hour, count in rows.iterator()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_song_artist_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongHourlyCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_counts', to='app.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], include=('song', 'count'), name='songhourly_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('song', 'hour'), name='unique_song_hour')],
+            },
+        ),
+        migrations.RunPython(backfill_hourly_counts, migrations.RunPython.noop),
+    ]
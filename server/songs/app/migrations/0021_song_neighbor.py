@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_song_hourly_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('co_count', models.IntegerField(default=0)),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.song')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='app.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['song', '-score'], include=('neighbor',), name='songneighbor_song_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('song', 'neighbor'), name='unique_song_neighbor_pair')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_song_neighbor'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongTransition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='action',
+            index=models.Index(fields=['user', 'action_type', '-timestamp'], name='action_user_type_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='songtransition',
+            name='from_song',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='app.song'),
+        ),
+        migrations.AddField(
+            model_name='songtransition',
+            name='to_song',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.song'),
+        ),
+        migrations.AddIndex(
+            model_name='songtransition',
+            index=models.Index(fields=['from_song', '-count'], include=('to_song',), name='songtransition_from_count_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='songtransition',
+            constraint=models.UniqueConstraint(fields=('from_song', 'to_song'), name='unique_song_transition'),
+        ),
+    ]
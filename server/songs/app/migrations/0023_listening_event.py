@@ -0,0 +1,88 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from collections import Counter
+
+from django.db import migrations, models
+
+SESSION_GAP_SECONDS = 30 * 60
+
+
+def backfill_listening_events(apps, schema_editor):
+    # Each play/complete Action becomes a listen, linked to the previous song of its session
+    # the way next_track.rebuild_transitions does, and the transition counts are recounted
+    Action = apps.get_model('app', 'Action')
+    ListeningEvent = apps.get_model('app', 'ListeningEvent')
+    SongTransition = apps.get_model('app', 'SongTransition')
+
+    rows = Action.objects.filter(action_type__in=['play', 'complete'], song__isnull=False).order_by(
+        'user_id', 'timestamp', 'id'
+    ).values_list('user_id', 'song_id', 'action_type', 'timestamp')
+
+    events, transitions = [], Counter()
+    previous = None
+    for user_id, song_id, action_type, timestamp in rows.iterator(chunk_size=20000):
+        previous_song_id = None
+        if (previous is not None and previous[0] == user_id and previous[1] != song_id
+                and (timestamp - previous[2]).total_seconds() <= SESSION_GAP_SECONDS):
+            previous_song_id = previous[1]
+            transitions[previous_song_id, song_id] += 1
+        events.append(ListeningEvent(
+            user_id=user_id, song_id=song_id, event_type=action_type, timestamp=timestamp, previous_song_id=previous_song_id
+        ))
+        previous = (user_id, song_id, timestamp)
+        if len(events) >= 20000:
+            ListeningEvent.objects.bulk_create(events, batch_size=5000)
+            events = []
+
+    ListeningEvent.objects.bulk_create(events, batch_size=5000)
+    SongTransition.objects.all().delete()
+    SongTransition.objects.bulk_create([
+        SongTransition(from_song_id=from_song_id, to_song_id=to_song_id, count=count)
+        for (from_song_id, to_song_id), count in transitions.items()
+    ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_song_transition'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListeningEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('play', 'Play'), ('complete', 'Complete')], max_length=10)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='action',
+            name='action_user_type_time_idx',
+        ),
+        migrations.AddField(
+            model_name='listeningevent',
+            name='previous_song',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.song'),
+        ),
+        migrations.AddField(
+            model_name='listeningevent',
+            name='song',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.song'),
+        ),
+        migrations.AddField(
+            model_name='listeningevent',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listening_events', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='listeningevent',
+            index=models.Index(fields=['user', '-timestamp'], name='listen_user_time_idx'),
+        ),
+        migrations.RunPython(backfill_listening_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+from .interaction_matrix import get_data_dir
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIRNAME = 'models'
+CURRENT_POINTER = 'CURRENT'
+META_FILENAME = 'meta.json'
+USER_IDS_FILENAME = 'user_ids.npy'
+ITEM_IDS_FILENAME = 'item_ids.npy'
+
+# Versions kept on disk per model; older ones are pruned after each save
+KEEP_VERSIONS = 3
+
+# Loaded models per process: name -> FactorModel
+_loaded_models = {}
+
+
+def model_dir(name):
+    path = os.path.join(get_data_dir(), MODELS_DIRNAME, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class FactorModel:
+    """
+    A trained factor model loaded from the artifact store.
+
+    Arrays are memory-mapped read-only, so every worker process serving the
+    same version shares the same page cache instead of holding its own copy.
+    """
+
+    def __init__(self, name, version, path, arrays, user_ids, item_ids, meta):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.arrays = arrays
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.meta = meta
+        self._user_index = None
+        self._item_index = None
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    @property
+    def user_index(self):
+        if self._user_index is None:
+            self._user_index = {user_id: i for i, user_id in enumerate(self.user_ids.tolist())}
+        return self._user_index
+
+    @property
+    def item_index(self):
+        if self._item_index is None:
+            self._item_index = {item_id: i for i, item_id in enumerate(self.item_ids.tolist())}
+        return self._item_index
+
+
+def current_version(name):
+    """Version the CURRENT pointer refers to, or None if nothing was saved yet"""
+    try:
+        with open(os.path.join(model_dir(name), CURRENT_POINTER)) as pointer:
+            return pointer.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_model(name, arrays, user_ids, item_ids, meta=None, keep=KEEP_VERSIONS):
+    """
+    Write a new model version and make it current.
+
+    arrays maps names to factor matrices (stored as float32 .npy); user_ids and
+    item_ids give the DB id of each row. The version directory is fully written
+    before the CURRENT pointer is swapped with os.replace, so readers only ever
+    see complete versions.
+    """
+    base = model_dir(name)
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    tmp_path = os.path.join(base, f".tmp-{version}")
+    os.makedirs(tmp_path)
+
+    for key, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{key}.npy"), np.ascontiguousarray(array, dtype=np.float32))
+    np.save(os.path.join(tmp_path, USER_IDS_FILENAME), np.asarray(user_ids, dtype=np.int64))
+    np.save(os.path.join(tmp_path, ITEM_IDS_FILENAME), np.asarray(item_ids, dtype=np.int64))
+
+    meta = dict(meta or {})
+    meta.update({
+        'version': version,
+        'created_at': time.time(),
+        'arrays': {key: list(np.shape(array)) for key, array in arrays.items()}
+    })
+    with open(os.path.join(tmp_path, META_FILENAME), 'w') as f:
+        json.dump(meta, f)
+
+    os.rename(tmp_path, os.path.join(base, version))
+
+    tmp_pointer = os.path.join(base, f".{CURRENT_POINTER}.{version}")
+    with open(tmp_pointer, 'w') as pointer:
+        pointer.write(version)
+    os.replace(tmp_pointer, os.path.join(base, CURRENT_POINTER))
+
+    logger.info(f"Saved {name} model version {version}")
+    prune_versions(name, keep)
+    return version
+
+
+def prune_versions(name, keep=KEEP_VERSIONS):
+    """
+    Delete all but the newest `keep` versions. Processes still mapping a
+    deleted version keep reading it until they swap to the current one.
+    """
+    base = model_dir(name)
+    current = current_version(name)
+    versions = sorted(
+        entry for entry in os.listdir(base)
+        if not entry.startswith('.') and os.path.isdir(os.path.join(base, entry))
+    )
+    for version in versions[:-keep] if keep > 0 else versions:
+        if version != current:
+            shutil.rmtree(os.path.join(base, version), ignore_errors=True)
+
+
+def load_model(name, version=None):
+    """
+    Load a model version (the current one by default), memory-mapped.
+
+    The loaded model is kept per process and reused until the CURRENT pointer
+    moves, which hot-swaps serving to a new version without a restart.
+    """
+    version = version or current_version(name)
+    if version is None:
+        return None
+
+    loaded = _loaded_models.get(name)
+    if loaded is not None and loaded.version == version:
+        return loaded
+
+    path = os.path.join(model_dir(name), version)
+    try:
+        with open(os.path.join(path, META_FILENAME)) as f:
+            meta = json.load(f)
+        arrays = {
+            key: np.load(os.path.join(path, f"{key}.npy"), mmap_mode='r')
+            for key in meta['arrays']
+        }
+        user_ids = np.load(os.path.join(path, USER_IDS_FILENAME))
+        item_ids = np.load(os.path.join(path, ITEM_IDS_FILENAME))
+    except (FileNotFoundError, KeyError, ValueError) as e:
+        logger.error(f"Could not load {name} model version {version}: {str(e)}")
+        return None
+
+    model = FactorModel(name, version, path, arrays, user_ids, item_ids, meta)
+    _loaded_models[name] = model
+    logger.info(f"Loaded {name} model version {version}")
+    return model
@@ -1,7 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 import numpy as np
 class UserProfile(models.Model):
     # Basic connection to auth user
@@ -41,6 +42,21 @@ def save_user_profile(sender, instance, **kwargs):
         UserProfile.objects.create(user=instance)
     
 from django.core.exceptions import ValidationError
+# Normalized artist and genre names; Song.artist / Song.genre keep the original comma-joined strings
+class Artist(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Genre(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
 # Song Model
 class Song(models.Model):
     spotify_id = models.CharField(max_length=255, unique=True, blank=True, null=True)
@@ -52,6 +68,10 @@ class Song(models.Model):
     url = models.URLField(null=True, blank=True)
     album_cover = models.URLField(blank=True, null=True)
 
+    # Parsed from artist/genre on save (see song_tags.py); indexed for "songs by artist/genre" lookups
+    artists = models.ManyToManyField(Artist, related_name='songs', blank=True)
+    genres = models.ManyToManyField(Genre, related_name='songs', blank=True)
+
     def __str__(self):
         return f"{self.name} by {self.artist}"
 
@@ -63,6 +83,15 @@ class Song(models.Model):
     def save(self, *args, **kwargs):
         self.full_clean()  # Run validation before saving
         super().save(*args, **kwargs)
+
+# Signal to keep the normalized artist/genre links in sync with the song's strings
+@receiver(post_save, sender=Song)
+def sync_song_tags_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'artist', 'genre'} & set(update_fields):
+        return
+    from .song_tags import sync_song_tags
+    sync_song_tags(instance)
+
 # Action Model
 class Action(models.Model):
     ACTION_CHOICES = [
@@ -111,6 +140,58 @@ class Action(models.Model):
             models.Index(fields=['search_type']),   # For analyzing search patterns
         ]
 
+# Signal to drop the user's cached ALS fold-in vector when their actions change
+@receiver([post_save, post_delete], sender=Action)
+def invalidate_user_factor_cache(sender, instance, **kwargs):
+    from .algorithms import invalidate_als_user_vector
+    invalidate_als_user_vector(instance.user_id)
+
+# Signal to move the user to a new activity version, so their cached recommendation lists are missed
+@receiver([post_save, post_delete], sender=Action)
+def bump_user_activity_version(sender, instance, **kwargs):
+    from .recommendation_cache import bump_user_activity_version
+    bump_user_activity_version(instance.user_id)
+
+# Signal to fold a new or deleted action into the user's feature counters
+@receiver(post_save, sender=Action)
+def add_action_to_user_features(sender, instance, created, **kwargs):
+    if created:
+        from .user_features import apply_action
+        apply_action(instance)
+
+@receiver(post_delete, sender=Action)
+def remove_action_from_user_features(sender, instance, origin=None, **kwargs):
+    # Deleting the user drops their features too, and a deleted song's actions are repaired by rebuild_user_features
+    origin_model = getattr(origin, 'model', type(origin))
+    if origin_model in (User, Song):
+        return
+    from .user_features import apply_action
+    apply_action(instance, sign=-1)
+
+# Signal to keep the song/artist popularity counters current
+@receiver(post_save, sender=Action)
+def add_action_to_popularity_stats(sender, instance, created, **kwargs):
+    if created:
+        from .popularity import apply_action
+        apply_action(instance)
+
+@receiver(post_delete, sender=Action)
+def remove_action_from_popularity_stats(sender, instance, **kwargs):
+    from .popularity import apply_action
+    apply_action(instance, sign=-1)
+
+# Signal to count the action in its song's hourly trending bucket
+@receiver(post_save, sender=Action)
+def add_action_to_trending_buckets(sender, instance, created, **kwargs):
+    if created:
+        from .trending import apply_action
+        apply_action(instance)
+
+@receiver(post_delete, sender=Action)
+def remove_action_from_trending_buckets(sender, instance, **kwargs):
+    from .trending import apply_action
+    apply_action(instance, sign=-1)
+
 # Add this to your models.py
 class Playlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -154,10 +235,194 @@ class UserSimilarity(models.Model):
     user2 = models.ForeignKey(User, related_name='similarities_user2', on_delete=models.CASCADE)
     similarity_score = models.FloatField()
 
+    # Stored terms of similarity_score = (overlap_score + artist_score) / normalizer,
+    # so a new action can update the score in place without rescoring the pair
+    overlap_score = models.FloatField(default=0.0)  # Weighted, time-decayed common actions
+    artist_score = models.FloatField(default=0.0)  # Favorite artist overlap term
+    normalizer = models.FloatField(default=1.0)  # sqrt(actions of user1 * actions of user2)
+
+    class Meta:
+        # Each row is one entry of user1's top-K neighbor list
+        constraints = [
+            models.UniqueConstraint(fields=['user1', 'user2'], name='unique_user_similarity_pair')
+        ]
+        indexes = [
+            # Serves "top N neighbors of user1" straight from the index (covering on PostgreSQL)
+            models.Index(fields=['user1', '-similarity_score'], include=['user2'], name='usersim_user1_score_idx'),
+        ]
+
     def __str__(self):
         return f"Similarity between {self.user1.username} and {self.user2.username}"
 
 
+# Per-user interaction features, updated as each action is written (see user_features.py)
+class UserFeatures(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='features')
+    artist_weights = models.JSONField(default=dict)  # Artist -> weighted action count
+    genre_weights = models.JSONField(default=dict)  # Genre -> weighted action count
+    action_counts = models.JSONField(default=dict)  # Action type -> count
+    last_liked_song = models.ForeignKey(Song, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    recent_plays = models.JSONField(default=list)  # [song_id, unix timestamp] pairs, newest first
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Features of {self.user.username}"
+
+
+# Per-song action counters, updated as actions are written (see popularity.py).
+# The recent_* counters cover the last STATS_WINDOW_DAYS and are re-aggregated by refresh_popularity_stats
+class SongStats(models.Model):
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    play_count = models.IntegerField(default=0)
+    like_count = models.IntegerField(default=0)
+    save_count = models.IntegerField(default=0)
+    skip_count = models.IntegerField(default=0)
+    view_count = models.IntegerField(default=0)
+    share_count = models.IntegerField(default=0)
+    complete_count = models.IntegerField(default=0)
+    action_count = models.IntegerField(default=0)  # All action types
+    recent_play_count = models.IntegerField(default=0)
+    recent_like_count = models.IntegerField(default=0)
+    recent_save_count = models.IntegerField(default=0)
+    recent_action_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Top-N popularity lists are read straight off these
+            models.Index(fields=['-play_count'], name='songstats_play_idx'),
+            models.Index(fields=['-action_count'], name='songstats_action_idx'),
+            models.Index(fields=['-recent_action_count'], name='songstats_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Stats of {self.song.name}"
+
+
+# Actions per song per hour; trending scores sum (and decay) these instead of scanning Action (see trending.py)
+class SongHourlyCount(models.Model):
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='hourly_counts')
+    hour = models.DateTimeField()  # Start of the hour
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'hour'], name='unique_song_hour')
+        ]
+        indexes = [
+            # Window reads are a range scan on hour (covering on PostgreSQL)
+            models.Index(fields=['hour'], include=['song', 'count'], name='songhourly_hour_idx'),
+        ]
+
+
+# One listen (play or complete), repeats included: Action keeps a single row per
+# user, song and type, so listening sessions are read from here (see next_track.py)
+class ListeningEvent(models.Model):
+    EVENT_CHOICES = [
+        ('play', 'Play'),
+        ('complete', 'Complete'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listening_events')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='+')
+    event_type = models.CharField(choices=EVENT_CHOICES, max_length=10)
+    timestamp = models.DateTimeField(default=timezone.now)
+    # Song of the listen this one was counted as a transition from, if any
+    previous_song = models.ForeignKey(Song, on_delete=models.SET_NULL, related_name='+', blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # A user's latest listens, for the current session
+            models.Index(fields=['user', '-timestamp'], name='listen_user_time_idx'),
+        ]
+
+# Signal to count a listen as a transition from the previous song of its session, and take it back out on delete
+@receiver(post_save, sender=ListeningEvent)
+def add_listen_to_song_transitions(sender, instance, created, **kwargs):
+    if created:
+        from .next_track import apply_listen
+        apply_listen(instance)
+
+@receiver(post_delete, sender=ListeningEvent)
+def remove_listen_from_song_transitions(sender, instance, **kwargs):
+    from .next_track import apply_listen
+    apply_listen(instance, sign=-1)
+
+
+# How often listeners played to_song right after from_song in one session: the
+# sparse first-order transition matrix behind next-track recommendations (see next_track.py)
+class SongTransition(models.Model):
+    from_song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='transitions')
+    to_song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='+')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['from_song', 'to_song'], name='unique_song_transition')
+        ]
+        indexes = [
+            # "Most likely next songs after from_song" is read straight off the index (covering on PostgreSQL)
+            models.Index(fields=['from_song', '-count'], include=['to_song'], name='songtransition_from_count_idx'),
+        ]
+
+
+# One entry of a song's top-K item-item neighbor list, from co-occurring interactions (see song_similarity.py)
+class SongNeighbor(models.Model):
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()  # Cosine similarity of the two songs' listener sets
+    co_count = models.IntegerField(default=0)  # Users who interacted with both
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'neighbor'], name='unique_song_neighbor_pair')
+        ]
+        indexes = [
+            # Serves "top N neighbors of a song" straight from the index (covering on PostgreSQL)
+            models.Index(fields=['song', '-score'], include=['neighbor'], name='songneighbor_song_score_idx'),
+        ]
+
+
+# Per-artist action counters and the weighted popularity score the artist views rank by
+class ArtistStats(models.Model):
+    artist = models.OneToOneField(Artist, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    play_count = models.IntegerField(default=0)
+    like_count = models.IntegerField(default=0)
+    save_count = models.IntegerField(default=0)
+    action_count = models.IntegerField(default=0)
+    recent_action_count = models.IntegerField(default=0)
+    score = models.FloatField(default=0.0)  # play + 5*like + 3*save + 2*recent actions
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='artiststats_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"Stats of {self.artist.name}"
+
+
+# MinHash signature of a user's songs and favorite artists (for approximate neighbor lookup)
+class UserMinHash(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='minhash')
+    signature = models.BinaryField()  # uint32 array, one value per permutation
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+# LSH band bucket of a user's MinHash signature; users sharing a bucket are neighbor candidates
+class LSHBucket(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lsh_buckets')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'band'], name='unique_lsh_user_band')
+        ]
+        indexes = [
+            models.Index(fields=['band', 'bucket']),
+        ]
+
+
 # Friend Request Model
 class FriendRequest(models.Model):
     STATUS_CHOICES = [
@@ -0,0 +1,191 @@
+"""
+Next-track recommendations from song-to-song transitions within listening sessions.
+
+Sessions are read from ListeningEvent, which logs every play and complete,
+repeats included (an Action is only written for a user's first play of a
+song). Each listen is counted as a transition from the previous song of its
+session when it is written, and taken back out when it is deleted; listens
+either side of a deleted one are not relinked until rebuild_transitions runs.
+"""
+import logging
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ListeningEvent, Song, SongTransition
+
+logger = logging.getLogger(__name__)
+
+# Longest pause inside one listening session
+SESSION_GAP = timezone.timedelta(minutes=30)
+
+# Plays read to find the current session, and how many of its latest songs the
+# next-track scores blend (each one back counts SEED_DECAY times less)
+SESSION_LOOKBACK = 20
+SESSION_SEEDS = 3
+SEED_DECAY = 0.5
+
+# Most frequent transitions read per seed song
+TRANSITIONS_PER_SEED = 50
+
+
+def record_listen(user, song, event_type='play'):
+    """Log one play or complete of the song; the signal counts its transition"""
+    return ListeningEvent.objects.create(user=user, song=song, event_type=event_type)
+
+
+def _previous_session_song(event):
+    """Song of the user's listen right before the event, if it was less than SESSION_GAP earlier"""
+    return ListeningEvent.objects.filter(
+        Q(timestamp__lt=event.timestamp) | Q(timestamp=event.timestamp, id__lt=event.id),
+        user_id=event.user_id,
+        timestamp__gte=event.timestamp - SESSION_GAP
+    ).order_by('-timestamp', '-id').values_list('song_id', flat=True).first()
+
+
+def _add_transition(from_song_id, to_song_id, delta):
+    if delta > 0:
+        SongTransition.objects.bulk_create(
+            [SongTransition(from_song_id=from_song_id, to_song_id=to_song_id)], ignore_conflicts=True
+        )
+    transitions = SongTransition.objects.filter(from_song_id=from_song_id, to_song_id=to_song_id)
+    transitions.update(count=F('count') + delta)
+    if delta < 0:
+        transitions.filter(count__lte=0).delete()
+
+
+def apply_listen(event, sign=1):
+    """
+    Count a just-written listen (sign=1) as a transition from the previous song
+    of its session, or take a deleted one's transition back out (sign=-1).
+    The counted song is kept on the event, so the delete needs no lookup.
+    """
+    if sign < 0:
+        if event.previous_song_id is not None:
+            with transaction.atomic():
+                _add_transition(event.previous_song_id, event.song_id, -1)
+        return
+
+    previous_song_id = _previous_session_song(event)
+    # A play followed by its own complete is not a transition
+    if previous_song_id is None or previous_song_id == event.song_id:
+        return
+
+    with transaction.atomic():
+        _add_transition(previous_song_id, event.song_id, 1)
+        ListeningEvent.objects.filter(pk=event.pk).update(previous_song_id=previous_song_id)
+    event.previous_song_id = previous_song_id
+
+
+def rebuild_transitions(chunk_size=20000):
+    """
+    Recompute every transition count, and the transition each listen is
+    counted as, from the listening history (backfill and repair, e.g. after deletes)
+    """
+    started = time.time()
+    rows = ListeningEvent.objects.order_by('user_id', 'timestamp', 'id').values_list(
+        'id', 'user_id', 'song_id', 'timestamp', 'previous_song_id'
+    )
+
+    event_ids, user_ids, song_ids, timestamps, stored_previous = [], [], [], [], []
+    for event_id, user_id, song_id, timestamp, previous_song_id in rows.iterator(chunk_size=chunk_size):
+        event_ids.append(event_id)
+        user_ids.append(user_id)
+        song_ids.append(song_id)
+        timestamps.append(timestamp.timestamp())
+        stored_previous.append(-1 if previous_song_id is None else previous_song_id)
+    event_ids = np.asarray(event_ids, dtype=np.int64)
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+
+    # Consecutive listens of one user, close enough to share a session, on different songs
+    follows = (
+        (user_ids[1:] == user_ids[:-1])
+        & (timestamps[1:] - timestamps[:-1] <= SESSION_GAP.total_seconds())
+        & (song_ids[1:] != song_ids[:-1])
+    )
+    pairs, counts = np.unique(np.column_stack([song_ids[:-1][follows], song_ids[1:][follows]]), axis=0, return_counts=True)
+
+    previous = np.full(len(song_ids), -1, dtype=np.int64)
+    previous[1:][follows] = song_ids[:-1][follows]
+    changed = np.flatnonzero(previous != np.asarray(stored_previous, dtype=np.int64))
+
+    transitions = [
+        SongTransition(from_song_id=from_song_id, to_song_id=to_song_id, count=count)
+        for (from_song_id, to_song_id), count in zip(pairs.tolist(), counts.tolist())
+    ]
+    relinked = [
+        ListeningEvent(id=event_id, previous_song_id=None if song_id < 0 else song_id)
+        for event_id, song_id in zip(event_ids[changed].tolist(), previous[changed].tolist())
+    ]
+    with transaction.atomic():
+        SongTransition.objects.all().delete()
+        SongTransition.objects.bulk_create(transitions, batch_size=1000)
+        ListeningEvent.objects.bulk_update(relinked, ['previous_song'], batch_size=1000)
+
+    logger.info(
+        f"Rebuilt {len(transitions)} song transitions from {len(song_ids)} listens "
+        f"({len(relinked)} relinked) in {time.time() - started:.2f}s"
+    )
+    return len(transitions)
+
+
+def current_session(user_id, now=None):
+    """
+    Song ids of the user's current listening session, oldest first: the run of
+    their latest listens with no pause over SESSION_GAP, if the last one was
+    less than SESSION_GAP ago. One indexed read of SESSION_LOOKBACK rows.
+    """
+    now = now or timezone.now()
+    events = list(
+        ListeningEvent.objects.filter(user_id=user_id)
+        .order_by('-timestamp', '-id').values_list('song_id', 'timestamp')[:SESSION_LOOKBACK]
+    )
+
+    session = []
+    last_seen = now
+    for song_id, timestamp in events:
+        if last_seen - timestamp > SESSION_GAP:
+            break
+        if not session or session[-1] != song_id:
+            session.append(song_id)
+        last_seen = timestamp
+    return session[::-1]
+
+
+def next_song_scores(session, limit=10):
+    """
+    [(song id, score)] of the likeliest next songs after the session, best
+    first: the transition probabilities out of its last SESSION_SEEDS songs
+    (estimated over each song's top transitions), decayed by how far back the
+    song is. Songs already in the session are left out.
+    """
+    scores = defaultdict(float)
+    for distance, seed in enumerate(reversed(session[-SESSION_SEEDS:])):
+        transitions = list(
+            SongTransition.objects.filter(from_song_id=seed).order_by('-count')
+            .values_list('to_song_id', 'count')[:TRANSITIONS_PER_SEED]
+        )
+        total = sum(count for _, count in transitions)
+        for song_id, count in transitions:
+            scores[song_id] += SEED_DECAY ** distance * count / total
+
+    played = set(session)
+    ranked = sorted(((song_id, score) for song_id, score in scores.items() if song_id not in played), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit]
+
+
+def next_tracks(user_id, limit=10, current_song_id=None):
+    """(session song ids, likeliest next Song objects); current_song_id is the song playing now, if the client knows it"""
+    session = current_session(user_id)
+    if current_song_id is not None and (not session or session[-1] != current_song_id):
+        session.append(current_song_id)
+
+    song_ids = [song_id for song_id, _ in next_song_scores(session, limit)]
+    songs = Song.objects.in_bulk(song_ids)
+    return session, [songs[song_id] for song_id in song_ids if song_id in songs]
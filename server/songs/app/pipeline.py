@@ -0,0 +1,389 @@
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from functools import cached_property
+
+from django.core.cache import cache
+
+from .models import Action, Song, UserProfile
+from .algorithms import (
+    get_similar_users,
+    collaborative_song_scores,
+    content_song_scores,
+    calculate_als_recommendations,
+    calculate_svd_recommendations,
+    cached_get_recommendations
+)
+from .recommendation_cache import cache_songs, current_recommendation_key
+from .popularity import popular_songs
+from .trending import trending_song_ids
+from .graph_walk import get_graph
+from .spotify_utils import get_related_spotify_tracks, get_recommendations_for_new_user, store_spotify_tracks
+
+logger = logging.getLogger(__name__)
+
+# Latency budgets in milliseconds. Overruns are logged; external (Spotify)
+# sources are skipped once the whole pipeline is past PIPELINE_BUDGET_MS.
+SOURCE_BUDGETS_MS = {
+    'collaborative': 150,
+    'content': 50,
+    'model': 100,
+    'als': 100,
+    'svd': 100,
+    'bpr': 100,
+    'graph': 50,
+    'trending': 50,
+    'popular': 30,
+    'spotify': 1000,
+    'discover': 1000
+}
+STAGE_BUDGETS_MS = {'merge': 10, 'filter': 10, 'rank': 50, 'diversify': 10, 'load': 50}
+PIPELINE_BUDGET_MS = 1500
+EXTERNAL_SOURCES = {'spotify', 'discover'}
+
+NEW_USER_ACTIONS = 3  # Users with fewer actions get Spotify's new-user picks
+CANDIDATES_PER_RESULT = 3  # Each source is asked for this many candidates per requested result
+TOP_GENRES = 5
+
+# Genre affinity weights used by the genre rank boost
+GENRE_ACTION_WEIGHTS = {'like': 5.0, 'save': 3.0}  # Other action types count 1.0
+
+
+class RecommendationContext:
+    """
+    One user's data for one pipeline run, loaded on first use and shared by
+    every stage, plus what the run produced (candidates, scores, timings).
+    """
+
+    def __init__(self, user, limit=20):
+        self.user = user
+        self.limit = limit
+        self.candidates = {}  # Source name -> [(song_id, score)], best first
+        self.sources = defaultdict(set)  # Song id -> names of the sources that proposed it
+        self.scores = {}  # Song id -> final score
+        self.songs = []
+        self.timings = {}  # Stage name -> milliseconds
+        self.model_source = None  # Which factor model (or fallback) the 'model' source used
+
+    @cached_property
+    def actions(self):
+        """(song_id, action_type) of every action of the user"""
+        return list(Action.objects.filter(user=self.user).values_list('song_id', 'action_type'))
+
+    @property
+    def action_count(self):
+        return len(self.actions)
+
+    @cached_property
+    def seen_song_ids(self):
+        return {song_id for song_id, _ in self.actions if song_id is not None}
+
+    @cached_property
+    def preferences(self):
+        profile = UserProfile.objects.filter(user=self.user).first()
+        return (profile.preferences or {}) if profile else {}
+
+    @property
+    def favorite_artists(self):
+        return self.preferences.get('favorite_artists', []) or []
+
+    @property
+    def favorite_genres(self):
+        return self.preferences.get('favorite_genres', []) or []
+
+    @cached_property
+    def _seen_song_genres(self):
+        genres = defaultdict(list)
+        rows = Song.genres.through.objects.filter(song_id__in=self.seen_song_ids).values_list('song_id', 'genre__name')
+        for song_id, name in rows:
+            genres[song_id].append(name)
+        return genres
+
+    @cached_property
+    def top_genres(self):
+        """Genres of the user's most listened songs, by action count"""
+        counts = Counter()
+        for song_id, _ in self.actions:
+            counts.update(self._seen_song_genres.get(song_id, ()))
+        return [name for name, _ in counts.most_common(TOP_GENRES)]
+
+    @cached_property
+    def genre_weights(self):
+        """Genre -> affinity from the user's history, likes and saves weighted higher"""
+        weights = defaultdict(float)
+        for song_id, action_type in self.actions:
+            for name in self._seen_song_genres.get(song_id, ()):
+                weights[name] += GENRE_ACTION_WEIGHTS.get(action_type, 1.0)
+        return weights
+
+
+def _top_scored(song_scores, n):
+    """[(song_id, score)] of the n highest scores, ties by song id"""
+    return sorted(song_scores.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+def _rank_scored(song_ids):
+    """Scores for a ranked id list without scores of its own: 1.0 for the first, falling linearly"""
+    return [(song_id, 1.0 - i / len(song_ids)) for i, song_id in enumerate(song_ids)]
+
+
+def _collaborative_candidates(context, n):
+    similar_users = get_similar_users(context.user)
+    return _top_scored(collaborative_song_scores(similar_users, context.seen_song_ids), n)
+
+
+def _content_candidates(context, n):
+    scores = content_song_scores(context.favorite_artists, context.top_genres, context.seen_song_ids)
+    return list(scores.items())[:n]
+
+
+def _cached_song_ids(context, algorithm):
+    cached = cache.get(current_recommendation_key(context.user.id, algorithm))
+    return [song['id'] for song in cached] if cached else None
+
+
+def _model_candidates(context, n):
+    """
+    The best factor model list for the user: popularity for users with little
+    history, then the nightly ALS/SVD lists, computing (and caching) one if
+    neither is cached.
+    """
+    action_count = context.action_count
+    if action_count < 5:
+        # Not enough user data, fall back to popularity-based recommendations
+        context.model_source = 'popularity'
+        return _rank_scored([song.id for song in popular_songs('action_count', n)])
+
+    # Prefer ALS for users with more data (it can handle implicit feedback better)
+    cached_als = _cached_song_ids(context, 'als') if action_count > 20 else None
+    if cached_als:
+        context.model_source = 'cached_als'
+        return _rank_scored(cached_als[:n])
+
+    cached_svd = _cached_song_ids(context, 'svd')
+    if cached_svd:
+        context.model_source = 'cached_svd'
+        return _rank_scored(cached_svd[:n])
+
+    # Nothing in cache, so calculate on the fly
+    algorithm = 'als' if action_count > 20 else 'svd'
+    cache_key = current_recommendation_key(context.user.id, algorithm)
+    if algorithm == 'als':
+        songs = calculate_als_recommendations(context.user, n)
+    else:
+        songs = calculate_svd_recommendations(context.user, n)
+    cache_songs(cache_key, songs, 3600)
+    context.model_source = algorithm
+    return _rank_scored([song.id for song in songs])
+
+
+def _factor_candidates(algorithm):
+    def candidates(context, n):
+        return _rank_scored([song.id for song in cached_get_recommendations(context.user, n, algorithm=algorithm)])
+    return candidates
+
+
+def _graph_candidates(context, n):
+    return get_graph().recommend_for_user(context.user.id, n, exclude_song_ids=context.seen_song_ids)
+
+
+def _trending_candidates(context, n):
+    return _rank_scored(trending_song_ids(days=7, limit=n))
+
+
+def _popular_candidates(context, n):
+    return _rank_scored([song.id for song in popular_songs('play_count', n, fill=False)])
+
+
+def _spotify_candidates(context, n):
+    """Spotify tracks for the user's favorite artists/genres (new users get Spotify's new-user picks), stored as Songs"""
+    if context.action_count < NEW_USER_ACTIONS:
+        tracks = get_recommendations_for_new_user(context.user, limit=n)
+    else:
+        tracks = []
+        # Pick a random artist / genre from the top 3 favorites for variety
+        if context.favorite_artists:
+            tracks += get_related_spotify_tracks(artist=random.choice(context.favorite_artists[:3]), limit=max(n // 2, 1))
+        if context.favorite_genres:
+            tracks += get_related_spotify_tracks(genre=random.choice(context.favorite_genres[:3]), limit=max(n // 2, 1))
+        if not tracks:
+            tracks = get_related_spotify_tracks(limit=n)
+    return _rank_scored(list(dict.fromkeys(song.id for song in store_spotify_tracks(tracks))))
+
+
+def _discover_candidates(context, n):
+    """Spotify tracks that are not in the Song table yet"""
+    tracks = [track for track in get_related_spotify_tracks(limit=n) if track.get('spotify_id')]
+    known = set(Song.objects.filter(spotify_id__in=[track['spotify_id'] for track in tracks]).values_list('spotify_id', flat=True))
+    new_tracks = [track for track in tracks if track['spotify_id'] not in known]
+    return _rank_scored([song.id for song in store_spotify_tracks(new_tracks)])
+
+
+CANDIDATE_SOURCES = {
+    'collaborative': _collaborative_candidates,
+    'content': _content_candidates,
+    'model': _model_candidates,
+    'als': _factor_candidates('als'),
+    'svd': _factor_candidates('svd'),
+    'bpr': _factor_candidates('bpr'),
+    'graph': _graph_candidates,
+    'trending': _trending_candidates,
+    'popular': _popular_candidates,
+    'spotify': _spotify_candidates,
+    'discover': _discover_candidates
+}
+
+
+class RecommendationPipeline:
+    """
+    Candidate generation followed by merge, filter, rank and diversify stages.
+
+    sources maps candidate source names (CANDIDATE_SOURCES) to merge weights;
+    fallback_sources only run when the sources produced fewer than `limit`
+    candidates. Merged scores are the weighted sum of each source's scores,
+    normalized to a maximum of 1 per source unless normalize is False.
+    genre_boost adds the user's genre affinity to the score, and diversity
+    is the share of results drawn at random from below the top.
+    Every stage is timed against its budget (SOURCE_BUDGETS_MS / STAGE_BUDGETS_MS).
+    """
+
+    def __init__(self, name, sources, fallback_sources=None, normalize=True, exclude_seen=True,
+                 genre_boost=0.0, diversity=0.0, budget_ms=PIPELINE_BUDGET_MS):
+        self.name = name
+        self.sources = sources
+        self.fallback_sources = fallback_sources or {}
+        self.normalize = normalize
+        self.exclude_seen = exclude_seen
+        self.genre_boost = genre_boost
+        self.diversity = diversity
+        self.budget_ms = budget_ms
+
+    def run(self, user, limit=20, context=None):
+        """Run every stage for the user; returns the context, with the result in context.songs"""
+        context = context or RecommendationContext(user, limit)
+        context.limit = limit
+        started = time.time()
+
+        self._generate(context, self.sources, limit, started)
+        if self.fallback_sources and self._candidate_count(context) < limit:
+            self._generate(context, self.fallback_sources, limit, started)
+        weights = {**self.sources, **self.fallback_sources}
+
+        merged = self._timed(context, 'merge', self._merge_candidates, context, weights)
+        merged = self._timed(context, 'filter', self._filter, context, merged)
+        ranked = self._timed(context, 'rank', self._rank, context, merged)
+        ranked = self._timed(context, 'diversify', self._diversify, ranked, limit)
+        context.songs = self._timed(context, 'load', self._load, ranked)
+
+        context.timings['total'] = (time.time() - started) * 1000
+        logger.debug(
+            f"Pipeline {self.name} for user {user.id}: {len(context.songs)} songs, "
+            + ", ".join(f"{stage} {ms:.1f}ms" for stage, ms in context.timings.items())
+        )
+        return context
+
+    def _timed(self, context, stage, function, *args):
+        stage_started = time.time()
+        result = function(*args)
+        elapsed = (time.time() - stage_started) * 1000
+        context.timings[stage] = elapsed
+
+        budget = SOURCE_BUDGETS_MS.get(stage, STAGE_BUDGETS_MS.get(stage))
+        if budget is not None and elapsed > budget:
+            logger.warning(f"Pipeline {self.name} stage {stage} took {elapsed:.0f}ms (budget {budget}ms)")
+        return result
+
+    def _generate(self, context, sources, limit, started):
+        n = limit * CANDIDATES_PER_RESULT
+        for name in sources:
+            if name in context.candidates:
+                continue
+            if name in EXTERNAL_SOURCES and (time.time() - started) * 1000 > self.budget_ms:
+                logger.warning(f"Pipeline {self.name} skipped source {name}: over its {self.budget_ms}ms budget")
+                continue
+            try:
+                context.candidates[name] = self._timed(context, name, CANDIDATE_SOURCES[name], context, n)
+            except Exception as e:
+                # One failing source should not take the whole list down
+                logger.exception(f"Pipeline {self.name} source {name} failed: {str(e)}")
+                context.candidates[name] = []
+            for song_id, _ in context.candidates[name]:
+                context.sources[song_id].add(name)
+
+    def _candidate_count(self, context):
+        song_ids = set(context.sources)
+        return len(song_ids - context.seen_song_ids if self.exclude_seen else song_ids)
+
+    def _merge_candidates(self, context, weights):
+        merged = defaultdict(float)
+        for name, weight in weights.items():
+            candidates = context.candidates.get(name) or []
+            top = max((abs(score) for _, score in candidates), default=0.0)
+            scale = weight / top if self.normalize and top > 0 else weight
+            for song_id, score in candidates:
+                merged[song_id] += score * scale
+        return merged
+
+    def _filter(self, context, merged):
+        if self.exclude_seen:
+            merged = {song_id: score for song_id, score in merged.items() if song_id not in context.seen_song_ids}
+        context.scores = merged
+        return merged
+
+    def _rank(self, context, merged):
+        scores = dict(merged)
+        genre_weights = context.genre_weights if self.genre_boost else None
+        if genre_weights:
+            max_weight = max(genre_weights.values())
+            rows = Song.genres.through.objects.filter(song_id__in=list(scores)).values_list('song_id', 'genre__name')
+            for song_id, name in rows:
+                scores[song_id] += self.genre_boost * genre_weights.get(name, 0.0) / max_weight
+            context.scores = scores
+        return [song_id for song_id, _ in _top_scored(scores, len(scores))]
+
+    def _diversify(self, ranked, limit):
+        """Keep the top (1 - diversity) share of the results and fill the rest at random from lower down"""
+        if not self.diversity or len(ranked) <= limit:
+            return ranked[:limit]
+        top_count = int(limit * (1 - self.diversity))
+        return ranked[:top_count] + random.sample(ranked[top_count:], limit - top_count)
+
+    def _load(self, song_ids):
+        songs = Song.objects.in_bulk(song_ids)
+        return [songs[song_id] for song_id in song_ids if song_id in songs]
+
+
+# Collaborative and content-based scores as stored by calculate_recommendation_scores
+COMBINED_SCORES = RecommendationPipeline('combined_scores', {'collaborative': 0.7, 'content': 0.3}, normalize=False)
+
+# Collaborative filtering only
+COLLABORATIVE = RecommendationPipeline('collaborative', {'collaborative': 1.0})
+
+# Collaborative plus content-based candidates, for the "recommended songs" list
+COLLABORATIVE_AND_CONTENT = RecommendationPipeline('collaborative_and_content', {'collaborative': 1.0, 'content': 1.0}, diversity=0.2)
+
+# Best factor model list re-ranked by the user's genre affinity
+HYBRID = RecommendationPipeline('hybrid', {'model': 1.0}, genre_boost=0.5, diversity=0.2)
+
+# Factor model list plus Spotify tracks for the user's favorites, diversified
+HYBRID_WITH_SPOTIFY = RecommendationPipeline('hybrid_with_spotify', {'model': 1.0, 'spotify': 0.5}, genre_boost=0.5, diversity=0.2)
+
+# Hybrid list topped up from Spotify only when it comes up short
+NEW_TRACKS = RecommendationPipeline('new_tracks', {'model': 1.0}, fallback_sources={'spotify': 0.5}, genre_boost=0.5)
+
+# Spotify's picks for users with little history
+NEW_USER = RecommendationPipeline('new_user', {'spotify': 1.0})
+
+# Single factor models
+ALS = RecommendationPipeline('als', {'als': 1.0}, diversity=0.2)
+SVD = RecommendationPipeline('svd', {'svd': 1.0}, diversity=0.2)
+BPR = RecommendationPipeline('bpr', {'bpr': 1.0}, diversity=0.2)
+
+# Random walks over the user-song graph, no trained model needed
+GRAPH = RecommendationPipeline('graph', {'graph': 1.0}, diversity=0.2)
+
+# The "For You" mix: personalized, trending and new-to-the-catalog tracks in equal weight
+FOR_YOU_MIX = RecommendationPipeline(
+    'for_you_mix', {'model': 1.0, 'spotify': 1.0, 'trending': 1.0, 'discover': 1.0}, genre_boost=0.5, diversity=0.2
+)
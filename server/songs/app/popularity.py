@@ -0,0 +1,177 @@
+import logging
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Action, ArtistStats, Song, SongStats
+
+logger = logging.getLogger(__name__)
+
+# Rolling window covered by the recent_* counters
+STATS_WINDOW_DAYS = 7
+
+# Action types with their own SongStats counter
+SONG_STAT_ACTIONS = ('play', 'like', 'save', 'skip', 'view', 'share', 'complete')
+RECENT_SONG_STAT_ACTIONS = ('play', 'like', 'save')
+ARTIST_STAT_ACTIONS = ('play', 'like', 'save')
+
+# ArtistStats.score = sum of weight * count, plus RECENT_ARTIST_BONUS per action in the window
+ARTIST_SCORE_WEIGHTS = {'play': 1.0, 'like': 5.0, 'save': 3.0}
+RECENT_ARTIST_BONUS = 2.0
+
+
+def _window_start(days=STATS_WINDOW_DAYS):
+    return timezone.now() - timezone.timedelta(days=days)
+
+
+def _song_deltas(action_type, sign, recent):
+    deltas = {'action_count': sign}
+    if action_type in SONG_STAT_ACTIONS:
+        deltas[f'{action_type}_count'] = sign
+    if recent:
+        deltas['recent_action_count'] = sign
+        if action_type in RECENT_SONG_STAT_ACTIONS:
+            deltas[f'recent_{action_type}_count'] = sign
+    return deltas
+
+
+def _artist_deltas(action_type, sign, recent):
+    deltas = {'action_count': sign}
+    score = ARTIST_SCORE_WEIGHTS.get(action_type, 0.0)
+    if action_type in ARTIST_STAT_ACTIONS:
+        deltas[f'{action_type}_count'] = sign
+    if recent:
+        deltas['recent_action_count'] = sign
+        score += RECENT_ARTIST_BONUS
+    deltas['score'] = sign * score
+    return deltas
+
+
+def apply_action(action, sign=1):
+    """
+    Add an action that was just written (sign=1) to its song's and artists'
+    counters, or take a deleted one (sign=-1) back out. Counters are bumped
+    with F() expressions, so concurrent writers never lose an update.
+    """
+    if action.song_id is None:
+        return
+
+    recent = action.timestamp is None or action.timestamp >= _window_start()
+    artist_ids = list(
+        Song.artists.through.objects.filter(song_id=action.song_id).values_list('artist_id', flat=True)
+    )
+
+    with transaction.atomic():
+        if sign > 0:
+            SongStats.objects.bulk_create([SongStats(song_id=action.song_id)], ignore_conflicts=True)
+            ArtistStats.objects.bulk_create([ArtistStats(artist_id=artist_id) for artist_id in artist_ids], ignore_conflicts=True)
+
+        SongStats.objects.filter(song_id=action.song_id).update(**{
+            field: F(field) + delta for field, delta in _song_deltas(action.action_type, sign, recent).items()
+        })
+        if artist_ids:
+            ArtistStats.objects.filter(artist_id__in=artist_ids).update(**{
+                field: F(field) + delta for field, delta in _artist_deltas(action.action_type, sign, recent).items()
+            })
+
+
+def _aggregate_counts(actions, group_field, action_types, prefix=''):
+    """{group value: {counter field: count}} from one GROUP BY over the actions"""
+    counts = defaultdict(lambda: defaultdict(int))
+    rows = actions.values(group_field, 'action_type').annotate(count=Count('id')).values_list(group_field, 'action_type', 'count')
+    for key, action_type, count in rows:
+        if key is None:
+            continue
+        counts[key][f'{prefix}action_count'] += count
+        if action_type in action_types:
+            counts[key][f'{prefix}{action_type}_count'] += count
+    return counts
+
+
+def _write_counts(model, key_field, counts, fields):
+    """Set the counters of every key in counts and zero them on every other row (fields[0] is the total)"""
+    with transaction.atomic():
+        model.objects.exclude(**{fields[0]: 0}).update(**{field: 0 for field in fields})
+        model.objects.bulk_create(
+            [model(**{key_field: key}, **{field: values.get(field, 0) for field in fields}) for key, values in counts.items()],
+            update_conflicts=True,
+            unique_fields=[key_field.removesuffix('_id')],
+            update_fields=fields,
+            batch_size=1000
+        )
+
+
+def _update_artist_scores():
+    recent_bonus = F('recent_action_count') * RECENT_ARTIST_BONUS
+    weighted = sum((F(f'{action_type}_count') * weight for action_type, weight in ARTIST_SCORE_WEIGHTS.items()), recent_bonus)
+    ArtistStats.objects.update(score=weighted)
+
+
+def refresh_recent_stats(days=STATS_WINDOW_DAYS):
+    """
+    Re-aggregate the rolling-window counters from the actions in the window
+    (a range scan on the timestamp index), so actions that aged out of the
+    window stop counting. Meant to run periodically.
+    """
+    started = time.time()
+    recent = Action.objects.filter(timestamp__gte=_window_start(days), song__isnull=False)
+
+    song_fields = ['recent_action_count'] + [f'recent_{action_type}_count' for action_type in RECENT_SONG_STAT_ACTIONS]
+    song_counts = _aggregate_counts(recent, 'song_id', RECENT_SONG_STAT_ACTIONS, prefix='recent_')
+    _write_counts(SongStats, 'song_id', song_counts, song_fields)
+
+    artist_counts = _aggregate_counts(recent, 'song__artists', (), prefix='recent_')
+    _write_counts(ArtistStats, 'artist_id', artist_counts, ['recent_action_count'])
+    _update_artist_scores()
+
+    logger.info(
+        f"Refreshed {days}-day popularity counters for {len(song_counts)} songs and "
+        f"{len(artist_counts)} artists in {time.time() - started:.2f}s"
+    )
+
+
+def rebuild_popularity_stats():
+    """Recompute every counter from the full action history (backfill and repair)"""
+    started = time.time()
+    actions = Action.objects.filter(song__isnull=False)
+
+    song_fields = ['action_count'] + [f'{action_type}_count' for action_type in SONG_STAT_ACTIONS]
+    song_counts = _aggregate_counts(actions, 'song_id', SONG_STAT_ACTIONS)
+    _write_counts(SongStats, 'song_id', song_counts, song_fields)
+
+    artist_fields = ['action_count'] + [f'{action_type}_count' for action_type in ARTIST_STAT_ACTIONS]
+    artist_counts = _aggregate_counts(actions, 'song__artists', ARTIST_STAT_ACTIONS)
+    _write_counts(ArtistStats, 'artist_id', artist_counts, artist_fields)
+
+    logger.info(f"Rebuilt popularity stats for {len(song_counts)} songs and {len(artist_counts)} artists in {time.time() - started:.2f}s")
+    refresh_recent_stats()
+
+
+def popular_songs(counter='play_count', limit=20, songs=None, fill=True):
+    """
+    Songs with the highest SongStats counter, read in index order.
+
+    songs optionally restricts the candidates to a Song queryset. With fill,
+    songs nobody has acted on yet pad the list up to limit, as a zero count would.
+    """
+    stats = SongStats.objects.filter(**{f'{counter}__gt': 0}).order_by(f'-{counter}', 'song_id')
+    if songs is not None:
+        stats = stats.filter(song__in=songs)
+    song_ids = list(stats.values_list('song_id', flat=True)[:limit])
+
+    songs_by_id = Song.objects.in_bulk(song_ids)
+    result = [songs_by_id[song_id] for song_id in song_ids if song_id in songs_by_id]
+    if fill and len(result) < limit:
+        rest = (songs if songs is not None else Song.objects.all()).exclude(id__in=song_ids)
+        result.extend(rest[:limit - len(result)])
+    return result
+
+
+def popular_artists(limit=20):
+    """(artist name, score) pairs with the highest ArtistStats score, best first"""
+    return list(
+        ArtistStats.objects.filter(score__gt=0).order_by('-score', 'artist_id').values_list('artist__name', 'score')[:limit]
+    )
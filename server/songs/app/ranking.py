@@ -0,0 +1,85 @@
+import numpy as np
+from scipy.sparse import issparse
+
+
+def mask_scores(scores, seen=None, allowed=None):
+    """
+    Copy of scores with excluded items set to -inf.
+
+    seen marks items to drop: a boolean array shaped like scores (or one
+    items-long row applied to every user), or a sparse matrix whose stored
+    entries are the seen (row, item) pairs. allowed is an optional boolean
+    items-long filter; items outside it are dropped too.
+    """
+    scores = np.array(scores, dtype=np.result_type(scores, np.float32))
+    if seen is not None:
+        if issparse(seen):
+            seen = seen.tocoo()
+            if scores.ndim == 1:
+                scores[seen.col] = -np.inf
+            else:
+                scores[seen.row, seen.col] = -np.inf
+        else:
+            scores[..., np.asarray(seen, dtype=bool)] = -np.inf
+    if allowed is not None:
+        scores[..., ~np.asarray(allowed, dtype=bool)] = -np.inf
+    return scores
+
+
+def top_k_indices(scores, k):
+    """
+    (indices, scores) of the k highest entries of each row, best first, ties
+    broken by index. Selection is an argpartition, so only the k winners are sorted.
+    """
+    n_items = scores.shape[-1]
+    k = min(k, n_items)
+    if k <= 0:
+        shape = scores.shape[:-1] + (0,)
+        return np.empty(shape, dtype=np.int64), np.empty(shape, dtype=scores.dtype)
+    if k < n_items:
+        top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+        top_scores = np.take_along_axis(scores, top, axis=-1)
+        _prefer_lower_indices_at_cutoff(scores, top, top_scores)
+    else:
+        top = np.broadcast_to(np.arange(n_items), scores.shape).copy()
+        top_scores = np.take_along_axis(scores, top, axis=-1)
+    order = np.lexsort((top, -top_scores), axis=-1)
+    return np.take_along_axis(top, order, axis=-1), np.take_along_axis(top_scores, order, axis=-1)
+
+
+def _prefer_lower_indices_at_cutoff(scores, top, top_scores):
+    """
+    argpartition picks arbitrarily among items tied with the k-th score; redo
+    the (rare) rows where that left out a lower index, so results are the same
+    as a full stable sort. Rows cut off at -inf are padding and left alone.
+    """
+    scores_2d, top_2d, top_scores_2d = (np.atleast_2d(array) for array in (scores, top, top_scores))
+    cutoff = top_scores_2d.min(axis=1)
+    tied = np.count_nonzero(scores_2d == cutoff[:, None], axis=1)
+    selected = np.count_nonzero(top_scores_2d == cutoff[:, None], axis=1)
+    k = top_2d.shape[1]
+    for row in np.flatnonzero((tied > selected) & np.isfinite(cutoff)):
+        above = np.flatnonzero(scores_2d[row] > cutoff[row])
+        at_cutoff = np.flatnonzero(scores_2d[row] == cutoff[row])[:k - len(above)]
+        top_2d[row] = np.concatenate([above, at_cutoff])
+        top_scores_2d[row] = scores_2d[row, top_2d[row]]
+
+
+def top_k(scores, k, seen=None, allowed=None, ids=None):
+    """
+    Top-k items of a score vector (one user) or matrix (one row per user),
+    excluding seen items and items outside allowed (see mask_scores).
+
+    Returns (items, scores) best first, where items are indices into the score
+    columns, or entries of ids (e.g. a model's item_ids) when given. A vector
+    only returns the items that were not excluded; matrix rows keep k columns
+    and pad with excluded items scored -inf.
+    """
+    scores = mask_scores(scores, seen, allowed)
+    top, top_scores = top_k_indices(scores, k)
+    if scores.ndim == 1:
+        valid = np.isfinite(top_scores)
+        top, top_scores = top[valid], top_scores[valid]
+    if ids is not None:
+        top = np.asarray(ids)[top]
+    return top, top_scores
@@ -0,0 +1,82 @@
+import time
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .model_store import current_version
+from .models import Song
+
+# Song fields stored with each cached list, so a hit is served without touching the DB
+SONG_PAYLOAD_FIELDS = ('id', 'spotify_id', 'name', 'artist', 'album', 'duration', 'genre', 'url', 'album_cover')
+
+# Version counters outlive any list cached under them; one that expires restarts
+# from the clock, so it never comes back to a value an old list was keyed with
+ACTIVITY_VERSION_TIMEOUT = 30 * 86400
+
+# Keys per get_many when reading the versions of many users
+VERSION_BATCH_SIZE = 10000
+
+
+def _activity_version_key(user_id):
+    return f"user_activity_version:{user_id}"
+
+
+def _new_activity_version():
+    return int(time.time() * 1000)
+
+
+def user_activity_versions(user_ids):
+    """Current activity version of each user, in order; users without one get a fresh one"""
+    user_ids = list(user_ids)
+    versions = []
+    for start in range(0, len(user_ids), VERSION_BATCH_SIZE):
+        keys = [_activity_version_key(user_id) for user_id in user_ids[start:start + VERSION_BATCH_SIZE]]
+        found = cache.get_many(keys)
+        missing = {key: _new_activity_version() for key in keys if key not in found}
+        for key, version in missing.items():
+            # Another process may have started the counter in the meantime
+            if not cache.add(key, version, ACTIVITY_VERSION_TIMEOUT):
+                missing[key] = cache.get(key, version)
+        versions.extend(found.get(key, missing.get(key)) for key in keys)
+    return versions
+
+
+def user_activity_version(user_id):
+    return user_activity_versions([user_id])[0]
+
+
+def bump_user_activity_version(user_id):
+    """Move the user to a new activity version, orphaning every list cached under the old one"""
+    key = _activity_version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_activity_version(), ACTIVITY_VERSION_TIMEOUT)
+
+
+def recommendation_cache_key(user_id, algorithm, model_version, activity_version):
+    """Key of a user's cached list; it changes whenever the model or the user's activity does"""
+    return f"user_recommendations:{user_id}:{algorithm}:{model_version or 'none'}:{activity_version}"
+
+
+def serialize_song(song):
+    return {field: getattr(song, field) for field in SONG_PAYLOAD_FIELDS}
+
+
+def songs_from_payload(payload):
+    """Song instances rebuilt from a cached payload (no query)"""
+    return [Song.from_db(DEFAULT_DB_ALIAS, SONG_PAYLOAD_FIELDS, [entry[field] for field in SONG_PAYLOAD_FIELDS]) for entry in payload]
+
+
+def current_recommendation_key(user_id, algorithm):
+    """
+    Key of the user's list for the current `algorithm` model and their current
+    activity. Read it before computing a list, so an action written meanwhile
+    moves readers past the list instead of onto it.
+    """
+    return recommendation_cache_key(user_id, algorithm, current_version(algorithm), user_activity_version(user_id))
+
+
+def cache_songs(key, songs, timeout):
+    """Cache a list of Song objects as payloads"""
+    cache.set(key, [serialize_song(song) for song in songs], timeout)
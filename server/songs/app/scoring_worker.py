@@ -0,0 +1,41 @@
+# Entry points for the nightly scoring process pool. Spawned workers unpickle
+# these functions before Django is set up, so this module must not import
+# models (or anything that does) at import time.
+import os
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Per worker process: the memory-mapped model, seen-items and activity version arrays
+_worker_state = {}
+
+
+def init_worker(algorithm, version, seen_dir):
+    """Set up Django in a fresh worker and attach to the model and seen files without copying them"""
+    import django
+    django.setup()
+
+    from .model_store import load_model
+    _worker_state['model'] = load_model(algorithm, version)
+    _worker_state['seen_indptr'] = np.load(os.path.join(seen_dir, 'indptr.npy'), mmap_mode='r')
+    _worker_state['seen_indices'] = np.load(os.path.join(seen_dir, 'indices.npy'), mmap_mode='r')
+    _worker_state['activity_versions'] = np.load(os.path.join(seen_dir, 'activity_versions.npy'), mmap_mode='r')
+
+
+def score_chunk_in_worker(algorithm, start, end, limit, timeout):
+    """Score and cache users start:end; returns (start, end, users written, seconds)"""
+    from .batch_scoring import _cache_chunk
+
+    started = time.time()
+    model = _worker_state['model']
+    indptr, indices = _worker_state['seen_indptr'], _worker_state['seen_indices']
+
+    offset = indptr[start]
+    seen_block = csr_matrix(
+        (np.ones(indptr[end] - offset, dtype=bool), np.asarray(indices[offset:indptr[end]]), np.asarray(indptr[start:end + 1]) - offset),
+        shape=(end - start, len(model.item_ids))
+    )
+    activity_versions = _worker_state['activity_versions'][start:end]
+    written = _cache_chunk(model, algorithm, seen_block, activity_versions, start, end, limit, timeout)
+    return start, end, written, time.time() - started
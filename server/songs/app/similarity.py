@@ -0,0 +1,519 @@
+import logging
+import math
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, Count, Exists, F, FloatField, Min, OuterRef, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import Action, UserProfile, UserSimilarity
+
+logger = logging.getLogger(__name__)
+
+# Same weights and decay as calculate_user_similarity so batch scores match the per-pair version
+SIMILARITY_ACTION_WEIGHTS = {
+    'share': 5.0,
+    'like': 3.0,
+    'save': 4.0,
+    'play': 1.0
+}
+TIME_DECAY_RATE = 0.01  # per day
+ARTIST_SIMILARITY_WEIGHT = 2.0
+
+# Only each user's strongest neighbors are stored, so the table grows as O(users * K)
+SIMILARITY_TOP_K = getattr(settings, 'SIMILARITY_TOP_K', 50)
+SIMILARITY_MIN_SCORE = getattr(settings, 'SIMILARITY_MIN_SCORE', 0.0)
+
+ACTION_TYPE_INDEX = {action_type: i for i, action_type in enumerate(SIMILARITY_ACTION_WEIGHTS)}
+ACTION_TYPE_SCALE = np.sqrt(np.array(list(SIMILARITY_ACTION_WEIGHTS.values())))
+
+
+def load_interactions(queryset, now=None, chunk_size=20000):
+    """
+    Stream (user_id, song_id, action_type, timestamp) rows into flat numpy arrays.
+    Returns user ids, song ids (-1 for actions without a song, e.g. searches),
+    action type index (-1 for unweighted types) and time decay.
+    """
+    now = now or timezone.now()
+    now_ts = now.timestamp()
+
+    user_ids, song_ids, type_idx, ages = [], [], [], []
+    rows = queryset.values_list('user_id', 'song_id', 'action_type', 'timestamp').iterator(chunk_size=chunk_size)
+    for user_id, song_id, action_type, timestamp in rows:
+        user_ids.append(user_id)
+        song_ids.append(song_id if song_id is not None else -1)
+        type_idx.append(ACTION_TYPE_INDEX.get(action_type, -1))
+        ages.append(now_ts - timestamp.timestamp() if timestamp else 0.0)
+
+    # Whole days since the action, as in calculate_user_similarity
+    days = np.floor(np.asarray(ages, dtype=np.float64) / 86400.0)
+    return (
+        np.asarray(user_ids, dtype=np.int64),
+        np.asarray(song_ids, dtype=np.int64),
+        np.asarray(type_idx, dtype=np.int64),
+        np.exp(-TIME_DECAY_RATE * days),
+    )
+
+
+def build_similarity_matrices(user_index, user_ids, song_ids, type_idx, decay, artist_sets):
+    """
+    Build the sparse matrices the similarity score is made of.
+
+    Returns:
+    - weighted: users x (songs * action types), sqrt(weight) * time decay, so that
+      weighted @ weighted.T is the weighted action overlap for every pair
+    - seen: users x songs binary matrix of any interaction (defines "common songs");
+      song-less actions share one column, as the None song id did in calculate_user_similarity
+    - artists: users x artists with rows scaled to unit length, so that
+      artists @ artists.T is the favorite artist overlap |A & B| / sqrt(|A| * |B|)
+    """
+    n_users = len(user_index)
+    rows = np.array([user_index[u] for u in user_ids.tolist()], dtype=np.int64)
+
+    song_lookup, song_cols = np.unique(song_ids, return_inverse=True)
+    n_songs = len(song_lookup)
+    n_types = len(ACTION_TYPE_INDEX)
+
+    seen = csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, song_cols)),
+        shape=(n_users, n_songs)
+    )
+    seen.data[:] = 1.0  # Collapse duplicate (user, song) entries
+
+    weighted_mask = type_idx >= 0
+    weighted = csr_matrix(
+        (
+            decay[weighted_mask] * ACTION_TYPE_SCALE[type_idx[weighted_mask]],
+            (rows[weighted_mask], song_cols[weighted_mask] * n_types + type_idx[weighted_mask])
+        ),
+        shape=(n_users, n_songs * n_types)
+    )
+
+    artist_index = {}
+    artist_rows, artist_cols, artist_vals = [], [], []
+    for user_id, artists in artist_sets.items():
+        row = user_index.get(user_id)
+        if row is None or not artists:
+            continue
+        scale = 1.0 / math.sqrt(len(artists))
+        for artist in artists:
+            artist_rows.append(row)
+            artist_cols.append(artist_index.setdefault(artist, len(artist_index)))
+            artist_vals.append(scale)
+    artists = csr_matrix(
+        (np.asarray(artist_vals), (np.asarray(artist_rows, dtype=np.int64), np.asarray(artist_cols, dtype=np.int64))),
+        shape=(n_users, max(len(artist_index), 1))
+    )
+
+    return weighted, seen, artists
+
+
+def score_user_block(block, weighted, seen, artists, action_counts):
+    """
+    Similarity terms of the users in `block` (row indices) against every user.
+
+    Only pairs with at least one common song are returned, matching
+    calculate_user_similarity. Returns row/col indices (row is a position in
+    `block`) with the weighted action overlap, the favorite artist term and
+    the normalizer sqrt(actions of user1 * actions of user2), so that
+    similarity = (overlap + artist) / normalizer.
+    """
+    overlap = weighted[block] @ weighted.T
+    artist = ARTIST_SIMILARITY_WEIGHT * (artists[block] @ artists.T)
+    common = ((seen[block] @ seen.T) > 0).tocoo()
+    rows, cols = common.row, common.col
+
+    overlap_values = np.asarray(overlap[rows, cols], dtype=np.float64).ravel()
+    artist_values = np.asarray(artist[rows, cols], dtype=np.float64).ravel()
+    normalizer = np.sqrt(action_counts[block][rows] * action_counts[cols])
+
+    return rows, cols, overlap_values, artist_values, normalizer
+
+
+def similarity_rows(user1_ids, user2_ids, overlap, artist, normalizer, top_k=None):
+    """
+    Build UserSimilarity instances for the pairs scoring above SIMILARITY_MIN_SCORE.
+    With top_k, only the top_k highest scoring rows of each user1 are kept.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(normalizer > 0, (overlap + artist) / normalizer, 0.0)
+
+    keep = np.flatnonzero((scores > SIMILARITY_MIN_SCORE) & (user1_ids != user2_ids))
+
+    if top_k is not None and len(keep):
+        # Sort by user1, then by descending score, and keep the first top_k of each user1
+        order = keep[np.lexsort((-scores[keep], user1_ids[keep]))]
+        grouped = user1_ids[order]
+        group_start = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+        rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+        keep = order[rank < top_k]
+
+    return [
+        UserSimilarity(
+            user1_id=u1, user2_id=u2, similarity_score=score,
+            overlap_score=o, artist_score=a, normalizer=n
+        )
+        for u1, u2, score, o, a, n in zip(
+            user1_ids[keep].tolist(), user2_ids[keep].tolist(), scores[keep].tolist(),
+            overlap[keep].tolist(), artist[keep].tolist(), normalizer[keep].tolist()
+        )
+    ]
+
+
+def replace_user_neighbors(user_id, similarities):
+    """
+    Atomically replace a user's stored neighbor list (rows where user1 is the user).
+    `similarities` are unsaved UserSimilarity instances with user1_id == user_id.
+    """
+    with transaction.atomic():
+        UserSimilarity.objects.filter(user1_id=user_id).delete()
+        UserSimilarity.objects.bulk_create(similarities, batch_size=5000)
+
+
+def upsert_similarities(similarities):
+    """
+    Insert or update individual similarity rows, then trim the affected
+    users back to their top-K neighbors.
+    """
+    if not similarities:
+        return
+    UserSimilarity.objects.bulk_create(
+        similarities,
+        update_conflicts=True,
+        unique_fields=['user1', 'user2'],
+        update_fields=['similarity_score', 'overlap_score', 'artist_score', 'normalizer'],
+        batch_size=5000
+    )
+    prune_user_neighbors({sim.user1_id for sim in similarities})
+
+
+def prune_user_neighbors(user_ids, top_k=None):
+    """Delete rows that fell out of a user's top-K or below the score threshold"""
+    top_k = top_k or SIMILARITY_TOP_K
+    user_ids = list(user_ids)
+
+    UserSimilarity.objects.filter(user1_id__in=user_ids, similarity_score__lte=SIMILARITY_MIN_SCORE).delete()
+
+    overflowing = UserSimilarity.objects.filter(user1_id__in=user_ids).values('user1_id').annotate(
+        n=Count('id')
+    ).filter(n__gt=top_k)
+    for item in overflowing:
+        keep_ids = list(UserSimilarity.objects.filter(
+            user1_id=item['user1_id']
+        ).order_by('-similarity_score').values_list('id', flat=True)[:top_k])
+        UserSimilarity.objects.filter(user1_id=item['user1_id']).exclude(id__in=keep_ids).delete()
+
+
+def _favorite_artist_sets(user_ids=None):
+    """Map user id -> set of favorite artists from UserProfile.preferences"""
+    profiles = UserProfile.objects.all()
+    if user_ids is not None:
+        profiles = profiles.filter(user_id__in=user_ids)
+
+    artist_sets = {}
+    for user_id, preferences in profiles.values_list('user_id', 'preferences'):
+        artists = (preferences or {}).get('favorite_artists') or []
+        artist_sets[user_id] = set(artists)
+    return artist_sets
+
+
+def _action_counts(user_index, queryset):
+    """Total number of actions per user (all types), aligned with user_index"""
+    counts = np.zeros(len(user_index), dtype=np.float64)
+    for item in queryset.values('user_id').annotate(n=Count('id')):
+        row = user_index.get(item['user_id'])
+        if row is not None:
+            counts[row] = item['n']
+    return counts
+
+
+def recompute_all_user_similarities(block_size=1000, top_k=None):
+    """
+    Recompute UserSimilarity for every pair of users in one pass.
+
+    The interaction log is loaded once into sparse matrices and scores are
+    computed block by block with sparse matrix products, then each block's
+    users get their top-K neighbor lists replaced with a bulk insert.
+    """
+    top_k = top_k or SIMILARITY_TOP_K
+    started = time.time()
+    now = timezone.now()
+
+    all_user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    user_index = {user_id: i for i, user_id in enumerate(all_user_ids)}
+
+    user_ids, song_ids, type_idx, decay = load_interactions(Action.objects.all(), now=now)
+    weighted, seen, artists = build_similarity_matrices(
+        user_index, user_ids, song_ids, type_idx, decay, _favorite_artist_sets()
+    )
+    action_counts = _action_counts(user_index, Action.objects.all())
+
+    logger.info(
+        f"Similarity matrices built for {len(all_user_ids)} users and {len(user_ids)} actions "
+        f"in {time.time() - started:.1f}s"
+    )
+
+    user_id_array = np.asarray(all_user_ids, dtype=np.int64)
+    total_rows = 0
+
+    for start in range(0, len(all_user_ids), block_size):
+        block = np.arange(start, min(start + block_size, len(all_user_ids)))
+        rows, cols, overlap, artist, normalizer = score_user_block(block, weighted, seen, artists, action_counts)
+        similarities = similarity_rows(
+            user_id_array[block[rows]], user_id_array[cols], overlap, artist, normalizer, top_k=top_k
+        )
+
+        with transaction.atomic():
+            UserSimilarity.objects.filter(user1_id__in=user_id_array[block].tolist()).delete()
+            UserSimilarity.objects.bulk_create(similarities, batch_size=5000)
+        total_rows += len(similarities)
+
+    logger.info(f"Stored {total_rows} user similarities in {time.time() - started:.1f}s")
+    return total_rows
+
+
+def score_user_against(user_id, other_user_ids=None, top_k=None):
+    """
+    Exact similarity terms between one user and everyone they share a song with
+    (optionally restricted to `other_user_ids`).
+
+    Only the actions on the user's own songs are loaded for other users, since
+    the weighted overlap can only come from common songs.
+    Returns unsaved UserSimilarity instances as (user's own rows, reverse rows);
+    with top_k, the user's own rows are limited to their top_k neighbors.
+    """
+    user_songs = Action.objects.filter(user_id=user_id, song__isnull=False).values('song_id')
+    candidate_actions = Action.objects.filter(song_id__in=user_songs)
+    if Action.objects.filter(user_id=user_id, song__isnull=True).exists():
+        # Song-less actions (searches) count as a common interaction
+        candidate_actions = candidate_actions | Action.objects.filter(song__isnull=True)
+    if other_user_ids is not None:
+        candidate_actions = candidate_actions.filter(user_id__in=[user_id, *other_user_ids])
+
+    user_ids, song_ids, type_idx, decay = load_interactions(candidate_actions)
+
+    user_index = {user_id: 0}
+    for other_id in sorted(set(user_ids.tolist()) - {user_id}):
+        user_index[other_id] = len(user_index)
+
+    weighted, seen, artists = build_similarity_matrices(
+        user_index, user_ids, song_ids, type_idx, decay, _favorite_artist_sets(list(user_index))
+    )
+    action_counts = _action_counts(user_index, Action.objects.filter(user_id__in=list(user_index)))
+
+    _, cols, overlap, artist, normalizer = score_user_block(np.array([0]), weighted, seen, artists, action_counts)
+    index_to_user = np.asarray(list(user_index), dtype=np.int64)
+    others = index_to_user[cols]
+    this_user = np.full(len(cols), user_id, dtype=np.int64)
+
+    return (
+        similarity_rows(this_user, others, overlap, artist, normalizer, top_k=top_k),
+        similarity_rows(others, this_user, overlap, artist, normalizer)
+    )
+
+
+def recompute_user_similarities(user):
+    """
+    Recompute similarities between one user and everyone they share a song with.
+
+    The user's own neighbor list is replaced with their top-K; the reverse rows
+    are upserted into the other users' lists, which are trimmed back to top-K.
+    """
+    own, reverse = score_user_against(user.id, top_k=SIMILARITY_TOP_K)
+
+    with transaction.atomic():
+        replace_user_neighbors(user.id, own)
+        UserSimilarity.objects.filter(user2=user).exclude(
+            user1_id__in=[sim.user1_id for sim in reverse]
+        ).delete()
+        upsert_similarities(reverse)
+
+    return [(sim.user2_id, sim.similarity_score) for sim in own]
+
+
+def _entry_thresholds(user_ids, top_k=None):
+    """Score a new row must beat to enter each user's list: the K-th stored score once the list is full"""
+    top_k = top_k or SIMILARITY_TOP_K
+    thresholds = dict.fromkeys(user_ids, SIMILARITY_MIN_SCORE)
+    full = UserSimilarity.objects.filter(user1_id__in=list(user_ids)).values('user1_id').annotate(
+        n=Count('id'), kth=Min('similarity_score')
+    ).filter(n__gte=top_k).values_list('user1_id', 'kth')
+    for user_id, kth in full:
+        thresholds[user_id] = max(kth, SIMILARITY_MIN_SCORE)
+    return thresholds
+
+
+def _rows_that_can_enter(user_id, action_count, missing, thresholds):
+    """
+    The missing (user1, user2) rows between user_id and other users that could
+    enter user1's top-K list, from an upper bound of the pair's score read with
+    aggregate queries:
+    - overlap <= sum of the weights of the (song, action type) pairs both users
+      have, i.e. the overlap without time decay (decay <= 1)
+    - the artist term is computed exactly from the favorite artists
+    - the normalizer is exact: sqrt(action counts of the two users)
+    """
+    if not missing:
+        return []
+
+    other_ids = list({user2_id if user1_id == user_id else user1_id for user1_id, user2_id in missing})
+    weight = Case(
+        *(When(action_type=action_type, then=Value(w)) for action_type, w in SIMILARITY_ACTION_WEIGHTS.items()),
+        default=Value(0.0), output_field=FloatField()
+    )
+    shared = Exists(Action.objects.filter(
+        user_id=user_id, song_id=OuterRef('song_id'), action_type=OuterRef('action_type')
+    ))
+    overlap_bounds = dict(
+        Action.objects.filter(shared, user_id__in=other_ids, action_type__in=list(SIMILARITY_ACTION_WEIGHTS))
+        .values('user_id').annotate(bound=Sum(weight)).values_list('user_id', 'bound')
+    )
+    action_counts = dict(
+        Action.objects.filter(user_id__in=other_ids).values('user_id').annotate(n=Count('id')).values_list('user_id', 'n')
+    )
+    artist_sets = _favorite_artist_sets([user_id, *other_ids])
+    own_artists = artist_sets.get(user_id, set())
+
+    bounds = {}
+    for other_id in other_ids:
+        normalizer = math.sqrt(action_count * action_counts.get(other_id, 0))
+        if normalizer:
+            overlap = overlap_bounds.get(other_id) or 0.0
+            bounds[other_id] = (overlap + _artist_term(own_artists, artist_sets.get(other_id, set()))) / normalizer
+
+    candidates = []
+    for user1_id, user2_id in missing:
+        other_id = user2_id if user1_id == user_id else user1_id
+        if other_id in bounds and bounds[other_id] > thresholds[user1_id]:
+            candidates.append((user1_id, user2_id))
+    return candidates
+
+
+def update_similarities_for_action(action):
+    """
+    Incrementally fold one new Action into the stored similarity terms.
+
+    Only rows that can change are touched:
+    - every row of the acting user gets its normalizer rescaled, because their
+      total action count grew by one (a single UPDATE statement)
+    - rows between the acting user and the song's audience get the new weighted
+      overlap term added to the stored numerator
+    - pairs of the audience that have no row yet (never scored, or pruned out
+      of a top-K) are scored exactly only when an upper bound of their score
+      beats the K-th score of the list the row would go to (see
+      _rows_that_can_enter), and only rows that make it into a list are written
+    The cost is proportional to the song's audience, not the user base.
+    """
+    user_id = action.user_id
+    action_count = Action.objects.filter(user_id=user_id).count()
+
+    with transaction.atomic():
+        if action_count > 1:
+            factor = math.sqrt(action_count / (action_count - 1))
+            UserSimilarity.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id)).update(
+                normalizer=F('normalizer') * factor,
+                similarity_score=F('similarity_score') / factor
+            )
+
+        if action.song_id is None:
+            return 0
+
+        # Overlap added by the new action: it is fresh, so its own decay is 1
+        weight = SIMILARITY_ACTION_WEIGHTS.get(action.action_type)
+        now = timezone.now()
+        deltas = {}
+        audience = Action.objects.filter(song_id=action.song_id).exclude(user_id=user_id)
+        for other_id, action_type, timestamp in audience.values_list('user_id', 'action_type', 'timestamp'):
+            deltas.setdefault(other_id, 0.0)
+            if weight is not None and action_type == action.action_type:
+                days = (now - timestamp).days if timestamp else 0
+                deltas[other_id] += weight * math.exp(-TIME_DECAY_RATE * days)
+
+        if not deltas:
+            return 0
+
+        existing = list(UserSimilarity.objects.filter(
+            Q(user1_id=user_id, user2_id__in=list(deltas)) | Q(user2_id=user_id, user1_id__in=list(deltas))
+        ))
+        changed = []
+        for sim in existing:
+            other_id = sim.user2_id if sim.user1_id == user_id else sim.user1_id
+            if deltas[other_id]:
+                sim.overlap_score += deltas[other_id]
+                sim.similarity_score = (sim.overlap_score + sim.artist_score) / sim.normalizer if sim.normalizer else 0.0
+                changed.append(sim)
+        UserSimilarity.objects.bulk_update(changed, ['overlap_score', 'similarity_score'], batch_size=5000)
+
+        # Either direction of a pair may be missing: each list is pruned on its own
+        stored = {(sim.user1_id, sim.user2_id) for sim in existing}
+        missing = [
+            row for other_id in deltas for row in ((user_id, other_id), (other_id, user_id)) if row not in stored
+        ]
+        thresholds = _entry_thresholds({user_id, *deltas}) if missing else {}
+        missing = set(_rows_that_can_enter(user_id, action_count, missing, thresholds))
+        added = []
+        if missing:
+            other_ids = list({user2_id if user1_id == user_id else user1_id for user1_id, user2_id in missing})
+            own, reverse = score_user_against(user_id, other_ids)
+            added = [
+                sim for sim in own + reverse
+                if (sim.user1_id, sim.user2_id) in missing and sim.similarity_score > thresholds[sim.user1_id]
+            ]
+            upsert_similarities(added)
+
+    return len(changed) + len(added)
+
+
+def _artist_term(artists1, artists2):
+    """Favorite artist term of a pair, as in build_similarity_matrices: weight * |A & B| / sqrt(|A| * |B|)"""
+    if not artists1 or not artists2:
+        return 0.0
+    return ARTIST_SIMILARITY_WEIGHT * len(artists1 & artists2) / math.sqrt(len(artists1) * len(artists2))
+
+
+def refresh_artist_scores(user_id):
+    """
+    Recompute the favorite artist term of every stored row of the user (both
+    directions) after their favorite artists changed, and the score with it.
+
+    Rows that still hold a whole pre-split score (migration 0014 copied it into
+    overlap_score with normalizer 1 and no artist term) are rescored exactly
+    instead, and dropped when the pair no longer shares a song.
+    """
+    rows = list(UserSimilarity.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id)))
+    if not rows:
+        return 0
+
+    def other(sim):
+        return sim.user2_id if sim.user1_id == user_id else sim.user1_id
+
+    legacy = [sim for sim in rows if sim.normalizer == 1.0 and sim.artist_score == 0.0]
+    current = [sim for sim in rows if not (sim.normalizer == 1.0 and sim.artist_score == 0.0)]
+    artist_sets = _favorite_artist_sets([user_id, *{other(sim) for sim in current}])
+
+    changed = []
+    for sim in current:
+        artist = _artist_term(artist_sets.get(user_id, set()), artist_sets.get(other(sim), set()))
+        if abs(artist - sim.artist_score) > 1e-12:
+            sim.artist_score = artist
+            sim.similarity_score = (sim.overlap_score + artist) / sim.normalizer if sim.normalizer else 0.0
+            changed.append(sim)
+
+    with transaction.atomic():
+        UserSimilarity.objects.bulk_update(changed, ['artist_score', 'similarity_score'], batch_size=5000)
+        if legacy:
+            legacy_others = list({other(sim) for sim in legacy})
+            own, reverse = score_user_against(user_id, legacy_others)
+            rescored = {(sim.user1_id, sim.user2_id) for sim in own + reverse}
+            UserSimilarity.objects.filter(id__in=[
+                sim.id for sim in legacy if (sim.user1_id, sim.user2_id) not in rescored
+            ]).delete()
+            upsert_similarities(own + reverse)
+        if changed:
+            prune_user_neighbors({sim.user1_id for sim in changed})
+
+    return len(changed) + len(legacy)
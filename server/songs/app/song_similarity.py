@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .interaction_matrix import INTERACTION_WEIGHTS, get_data_dir, load_interaction_matrix
+from .models import Action, Song, SongNeighbor
+
+logger = logging.getLogger(__name__)
+
+# Only each song's strongest neighbors are stored, so the table grows as O(songs * K)
+SONG_NEIGHBORS_TOP_K = getattr(settings, 'SONG_NEIGHBORS_TOP_K', 50)
+# A single shared listener gives two niche songs a perfect cosine; ask for a few
+SONG_NEIGHBORS_MIN_CO_COUNT = getattr(settings, 'SONG_NEIGHBORS_MIN_CO_COUNT', 2)
+
+STATE_FILENAME = 'song_neighbors.json'
+
+
+def listener_matrix(data):
+    """Binary songs x users CSR matrix of who interacted with each song, and the listener count of each song"""
+    listeners = data.matrix.T.tocsr().astype(np.float32)
+    listeners.data[:] = 1.0
+    return listeners, np.diff(listeners.indptr).astype(np.float64)
+
+
+def score_song_block(block, listeners, counts, min_co_count=None):
+    """
+    Cosine similarity of the songs in `block` (matrix columns) with every song
+    they share at least min_co_count listeners with:
+    co_count / sqrt(listeners of song1 * listeners of song2).
+    Returns row (position in block), col, co_count and score arrays.
+    """
+    min_co_count = min_co_count or SONG_NEIGHBORS_MIN_CO_COUNT
+    co = (listeners[block] @ listeners.T).tocoo()
+    keep = (co.data >= min_co_count) & (block[co.row] != co.col)
+    rows, cols, co_counts = co.row[keep], co.col[keep], co.data[keep]
+    return rows, cols, co_counts, co_counts / np.sqrt(counts[block[rows]] * counts[cols])
+
+
+def neighbor_rows(song_ids, block, rows, cols, co_counts, scores, top_k=None):
+    """Unsaved SongNeighbor instances for the top_k neighbors of each song in block, ties by song id"""
+    top_k = top_k or SONG_NEIGHBORS_TOP_K
+    if not len(rows):
+        return []
+
+    # Sort by song, then by descending score, and keep the first top_k of each song
+    order = np.lexsort((song_ids[cols], -scores, rows))
+    grouped = rows[order]
+    group_start = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+    keep = order[rank < top_k]
+
+    return [
+        SongNeighbor(song_id=song_id, neighbor_id=neighbor_id, score=score, co_count=co_count)
+        for song_id, neighbor_id, score, co_count in zip(
+            song_ids[block[rows[keep]]].tolist(), song_ids[cols[keep]].tolist(),
+            scores[keep].tolist(), co_counts[keep].astype(np.int64).tolist()
+        )
+    ]
+
+
+def _state_path():
+    return os.path.join(get_data_dir(), STATE_FILENAME)
+
+
+def _read_high_water_mark():
+    """Last Action id the stored neighbor lists include, or None before the first build"""
+    try:
+        with open(_state_path()) as state:
+            return json.load(state)['high_water_mark']
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def _write_high_water_mark(mark):
+    tmp_path = f"{_state_path()}.tmp"
+    with open(tmp_path, 'w') as state:
+        json.dump({'high_water_mark': mark}, state)
+    os.replace(tmp_path, _state_path())
+
+
+def changed_song_columns(data, since_id):
+    """
+    Matrix columns whose neighbor lists changed with the interactions after
+    since_id: the songs acted on, and every song of the users who acted (their
+    co-counts with the new song grew). Other lists that hold one of these songs
+    keep a slightly stale score until the next rebuild.
+    """
+    pairs = Action.objects.filter(
+        id__gt=since_id, id__lte=data.high_water_mark, song__isnull=False, action_type__in=list(INTERACTION_WEIGHTS)
+    ).values_list('user_id', 'song_id').distinct()
+
+    user_rows, columns = set(), set()
+    for user_id, song_id in pairs:
+        if user_id in data.user_index and song_id in data.song_index:
+            user_rows.add(data.user_index[user_id])
+            columns.add(data.song_index[song_id])
+    if user_rows:
+        columns.update(data.matrix[sorted(user_rows)].indices.tolist())
+    return np.asarray(sorted(columns), dtype=np.int64)
+
+
+def refresh_song_neighbors(rebuild=False, block_size=500, top_k=None):
+    """
+    Bring SongNeighbor up to date with the interaction matrix.
+
+    The first run (or rebuild=True) scores every song; later runs only rescore
+    the songs touched by interactions since the last refresh. Scores come from
+    one sparse product per block of songs, and each block's lists are replaced
+    with a bulk insert. Returns (songs rescored, neighbor rows stored).
+    """
+    started = time.time()
+    data = load_interaction_matrix()
+    since_id = None if rebuild else _read_high_water_mark()
+
+    if since_id is None:
+        columns = np.arange(len(data.song_ids), dtype=np.int64)
+    else:
+        columns = changed_song_columns(data, since_id)
+
+    # The snapshot can still hold songs deleted since; they get no list and are nobody's neighbor
+    listeners, counts = listener_matrix(data)
+    existing = np.isin(data.song_ids, np.fromiter(Song.objects.values_list('id', flat=True), dtype=np.int64))
+    listeners = listeners.multiply(existing[:, None]).tocsr()
+    listeners.eliminate_zeros()
+    counts = np.where(existing, counts, 0.0)
+    columns = columns[existing[columns]]
+
+    total_rows = 0
+    for start in range(0, len(columns), block_size):
+        block = columns[start:start + block_size]
+        neighbors = neighbor_rows(data.song_ids, block, *score_song_block(block, listeners, counts), top_k=top_k)
+        with transaction.atomic():
+            SongNeighbor.objects.filter(song_id__in=data.song_ids[block].tolist()).delete()
+            SongNeighbor.objects.bulk_create(neighbors, batch_size=5000)
+        total_rows += len(neighbors)
+
+    _write_high_water_mark(data.high_water_mark)
+    logger.info(
+        f"Rescored neighbors of {len(columns)} songs ({total_rows} rows, up to action {data.high_water_mark}) "
+        f"in {time.time() - started:.2f}s"
+    )
+    return len(columns), total_rows
+
+
+def similar_songs(song_id, limit=10, spotify_only=False):
+    """
+    The song's stored neighbors, most similar first, read with one indexed
+    query. An empty list means the song is cold (too few shared listeners yet).
+    """
+    neighbors = SongNeighbor.objects.filter(song_id=song_id)
+    if spotify_only:
+        neighbors = neighbors.filter(neighbor__spotify_id__isnull=False)
+    return [entry.neighbor for entry in neighbors.select_related('neighbor').order_by('-score')[:limit]]
@@ -0,0 +1,46 @@
+from django.db.models import Count
+
+from .models import Artist, Genre, Song
+
+
+def split_names(value):
+    """Names from a comma-joined artist/genre string, stripped and de-duplicated in order"""
+    if not value:
+        return []
+    return list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+
+
+def _get_or_create_names(model, names):
+    """Rows for the given names, creating the missing ones in one insert"""
+    if not names:
+        return []
+    existing = {obj.name: obj for obj in model.objects.filter(name__in=names)}
+    missing = [model(name=name) for name in names if name not in existing]
+    if missing:
+        model.objects.bulk_create(missing, ignore_conflicts=True)
+        existing.update((obj.name, obj) for obj in model.objects.filter(name__in=[obj.name for obj in missing]))
+    return [existing[name] for name in names if name in existing]
+
+
+def sync_song_tags(song):
+    """Point the song's artists/genres links at the names in its artist/genre strings"""
+    song.artists.set(_get_or_create_names(Artist, split_names(song.artist)))
+    song.genres.set(_get_or_create_names(Genre, split_names(song.genre)))
+
+
+def songs_by_artists(names):
+    """Songs linked to any of the artists (an index seek on the artist -> song link table)"""
+    return Song.objects.filter(id__in=Song.artists.through.objects.filter(artist__name__in=names).values('song_id'))
+
+
+def songs_by_genres(names):
+    """Songs linked to any of the genres"""
+    return Song.objects.filter(id__in=Song.genres.through.objects.filter(genre__name__in=names).values('song_id'))
+
+
+def genre_match_counts(song_queryset, genres):
+    """song_id -> number of the given genres the song has, for songs with at least one"""
+    return dict(
+        Song.genres.through.objects.filter(song__in=song_queryset, genre__name__in=genres)
+        .values('song_id').annotate(matches=Count('genre_id')).values_list('song_id', 'matches')
+    )
@@ -0,0 +1,146 @@
+import logging
+import time
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Action, Song, SongHourlyCount
+
+logger = logging.getLogger(__name__)
+
+# Hourly buckets are kept for twice the longest window TrendingSongsView serves (90 days),
+# so velocity can compare it with the window before
+BUCKET_RETENTION_DAYS = 180
+
+# Decay half-life as a fraction of the window: activity at the start of a
+# window counts a quarter as much as activity in the last hour
+DECAY_HALF_LIFE_FRACTION = 0.5
+
+# Decay weights are applied in SQL per slice of whole hours; a window is cut into
+# at most this many slices, each weighted by the mean decay of its hours
+DECAY_SLICES = 48
+
+
+def bucket_hour(timestamp):
+    """Start of the (UTC) hour the timestamp falls in"""
+    return timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def apply_action(action, sign=1):
+    """Count an action that was just written (sign=1) in its song's hourly bucket, or take a deleted one out"""
+    if action.song_id is None:
+        return
+
+    hour = bucket_hour(action.timestamp or timezone.now())
+    with transaction.atomic():
+        if sign > 0:
+            SongHourlyCount.objects.bulk_create([SongHourlyCount(song_id=action.song_id, hour=hour)], ignore_conflicts=True)
+        SongHourlyCount.objects.filter(song_id=action.song_id, hour=hour).update(count=F('count') + sign)
+
+
+def _window_start(now, days):
+    return bucket_hour(now - timezone.timedelta(days=days))
+
+
+def _decay_weight(start, now, half_life_hours):
+    """
+    SQL expression for the decay weight of a bucket: the window's hours are
+    cut into at most DECAY_SLICES slices, newest first, and every bucket in a
+    slice counts the mean of 0.5 ** (age in hours / half_life_hours) over it
+    (exact per bucket for windows of DECAY_SLICES hours or less).
+    """
+    hours = max(int(np.ceil((now - start).total_seconds() / 3600.0)), 1)
+    newest = start + timezone.timedelta(hours=hours - 1)
+    width = int(np.ceil(hours / DECAY_SLICES))
+    # Age in hours of every bucket in the window, newest first
+    ages = (now - newest).total_seconds() / 3600.0 + np.arange(hours)
+    weights = 0.5 ** (ages / half_life_hours)
+
+    whens = [
+        When(hour__gte=newest - timezone.timedelta(hours=offset + width - 1), then=Value(float(weights[offset:offset + width].mean())))
+        for offset in range(0, hours, width)
+    ]
+    return Case(*whens, default=Value(0.0), output_field=FloatField())
+
+
+def trending_scores(days=7, half_life_hours=None, now=None, limit=None):
+    """
+    Exponentially decayed action count of the songs active in the last `days`:
+    each hourly bucket counts 0.5 ** (age in hours / half_life_hours), see
+    _decay_weight. Summed and ranked with one GROUP BY, so only `limit` rows
+    (default every active song) are read. Returns (song ids, scores) arrays, best first.
+    """
+    now = now or timezone.now()
+    half_life_hours = half_life_hours or days * 24 * DECAY_HALF_LIFE_FRACTION
+    start = _window_start(now, days)
+    rows = SongHourlyCount.objects.filter(hour__gte=start, hour__lt=now, count__gt=0).values('song_id').annotate(
+        score=Sum(F('count') * _decay_weight(start, now, half_life_hours), output_field=FloatField())
+    ).order_by('-score', 'song_id').values_list('song_id', 'score')
+    rows = list(rows[:limit] if limit else rows)
+    return np.array([row[0] for row in rows], dtype=np.int64), np.array([row[1] for row in rows], dtype=np.float64)
+
+
+def trending_velocity(days=7, now=None, limit=None):
+    """
+    How fast the songs active in the last `days` are growing: (actions in the
+    window + 1) / (actions in the window before + 1), from one GROUP BY over
+    both windows. Returns (song ids, velocities, current window counts)
+    arrays, fastest first (ties by current count).
+    """
+    now = now or timezone.now()
+    start = _window_start(now, days)
+    rows = SongHourlyCount.objects.filter(hour__gte=_window_start(start, days), hour__lt=now, count__gt=0).values('song_id').annotate(
+        current=Sum('count', filter=Q(hour__gte=start), default=0),
+        previous=Sum('count', filter=Q(hour__lt=start), default=0)
+    ).filter(current__gt=0).annotate(
+        velocity=(F('current') + 1.0) / (F('previous') + 1.0)
+    ).order_by('-velocity', '-current', 'song_id').values_list('song_id', 'velocity', 'current')
+    rows = list(rows[:limit] if limit else rows)
+    return (
+        np.array([row[0] for row in rows], dtype=np.int64),
+        np.array([row[1] for row in rows], dtype=np.float64),
+        np.array([row[2] for row in rows], dtype=np.float64)
+    )
+
+
+def trending_song_ids(days=7, limit=20, rank='score'):
+    """Ids of the top trending songs, best first; rank is 'score' (decayed count) or 'velocity'"""
+    if rank == 'velocity':
+        song_ids, _, _ = trending_velocity(days, limit=limit)
+    else:
+        song_ids, _ = trending_scores(days, limit=limit)
+    return song_ids.tolist()
+
+
+def get_trending(days=7, limit=20, rank='score'):
+    """Top trending Song objects, best first"""
+    song_ids = trending_song_ids(days, limit, rank)
+    songs = Song.objects.in_bulk(song_ids)
+    return [songs[song_id] for song_id in song_ids if song_id in songs]
+
+
+def prune_buckets(days=BUCKET_RETENTION_DAYS):
+    """Delete buckets older than the retention period"""
+    deleted, _ = SongHourlyCount.objects.filter(hour__lt=_window_start(timezone.now(), days)).delete()
+    return deleted
+
+
+def rebuild_buckets(days=BUCKET_RETENTION_DAYS):
+    """Recompute the buckets of the retention period from the action history (backfill and repair)"""
+    started = time.time()
+    since = _window_start(timezone.now(), days)
+    rows = Action.objects.filter(timestamp__gte=since, song__isnull=False).annotate(
+        hour=TruncHour('timestamp', tzinfo=dt_timezone.utc)
+    ).values('song_id', 'hour').annotate(count=Count('id')).values_list('song_id', 'hour', 'count')
+
+    buckets = [SongHourlyCount(song_id=song_id, hour=hour, count=count) for song_id, hour, count in rows]
+    with transaction.atomic():
+        SongHourlyCount.objects.filter(hour__gte=since).delete()
+        SongHourlyCount.objects.bulk_create(buckets, batch_size=1000)
+
+    logger.info(f"Rebuilt {len(buckets)} hourly trending buckets ({days} days) in {time.time() - started:.2f}s")
+    return len(buckets)
@@ -96,6 +96,7 @@ urlpatterns = [
     path('api/recommendations/for-you/', views.ForYouRecommendationsView.as_view(), name='for-you-recommendations'),
     path('api/recommendations/trending/',views.TrendingSongsView.as_view(), name='trending-songs'),
     path('api/recommendations/similar/', views.SimilarSongsView.as_view(), name='similar-songs'),
+    path('api/recommendations/next/', views.NextTrackRecommendationView.as_view(), name='next-tracks'),
     path('api/recommendations/new-tracks/', views.NewTracksRecommendationView.as_view(), name='new-tracks'),
     path('api/recommendations/user-based/', views.UserBasedRecommendationView.as_view(), name='user-based-recommendations'),
     path('api/recommendations/matrix/', views.MatrixFactorizationRecommendationView.as_view(), name='matrix-factorization'),
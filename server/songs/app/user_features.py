@@ -0,0 +1,162 @@
+import logging
+import time
+
+from django.db import transaction
+
+from .models import Action, Song, UserFeatures, UserProfile
+from .similarity import refresh_artist_scores
+from .song_tags import split_names
+
+logger = logging.getLogger(__name__)
+
+# How much each action type counts towards a user's artist/genre affinity
+FEATURE_ACTION_WEIGHTS = {
+    'like': 3.0,
+    'save': 3.0,
+    'share': 2.0,
+    'complete': 2.0,
+    'play': 1.0,
+    'view': 0.5,
+    'skip': -1.0
+}
+
+RECENT_PLAYS_LIMIT = 50  # Plays kept per user for base-track selection
+FAVORITES_LIMIT = 5  # Favorite artists/genres mirrored into UserProfile.preferences
+
+
+def _add_weight(weights, key, delta):
+    if not key:
+        return
+    value = weights.get(key, 0.0) + delta
+    if abs(value) < 1e-9:
+        weights.pop(key, None)
+    else:
+        weights[key] = value
+
+
+def top_keys(weights, limit=FAVORITES_LIMIT):
+    """Keys with the highest positive weight"""
+    return [key for key, value in sorted(weights.items(), key=lambda item: item[1], reverse=True) if value > 0][:limit]
+
+
+def _apply_to_features(features, action_type, song_id, artist, genre, timestamp, sign=1):
+    """Fold one action (sign=1) or its removal (sign=-1) into the counters"""
+    _add_weight(features.action_counts, action_type, sign)
+
+    weight = FEATURE_ACTION_WEIGHTS.get(action_type)
+    if song_id is None or weight is None:
+        return
+
+    for name in split_names(artist):
+        _add_weight(features.artist_weights, name, sign * weight)
+    for name in split_names(genre):
+        _add_weight(features.genre_weights, name, sign * weight)
+
+    if action_type in ('like', 'save'):
+        if sign > 0:
+            features.last_liked_song_id = song_id
+        elif features.last_liked_song_id == song_id:
+            features.last_liked_song_id = None  # Resolved from the index in apply_action
+
+    if action_type == 'play':
+        if sign > 0:
+            features.recent_plays.insert(0, [song_id, timestamp])
+            del features.recent_plays[RECENT_PLAYS_LIMIT:]
+        else:
+            features.recent_plays = [play for play in features.recent_plays if play[0] != song_id]
+
+
+def sync_profile_preferences(user_id, features):
+    """Mirror the top artists/genres into UserProfile.preferences, writing only when they changed"""
+    favorite_artists = top_keys(features.artist_weights)
+    favorite_genres = top_keys(features.genre_weights)
+
+    profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
+    preferences = profile.preferences or {}
+    if preferences.get('favorite_artists') == favorite_artists and preferences.get('favorite_genres') == favorite_genres:
+        return False
+
+    preferences['favorite_artists'] = favorite_artists
+    preferences['favorite_genres'] = favorite_genres
+    profile.preferences = preferences
+    profile.save(update_fields=['preferences'])
+    return True
+
+
+def apply_action(action, sign=1):
+    """
+    Update the user's features for an action that was just written (sign=1)
+    or deleted (sign=-1). Touches only the user's feature row, so the cost
+    does not grow with the user's history. A delete never creates rows, and
+    skips the artist/genre weights when the song is already gone.
+    """
+    timestamp = action.timestamp.timestamp() if action.timestamp else time.time()
+    song = None
+    if action.song_id is not None and sign > 0:
+        song = {'artist': action.song.artist, 'genre': action.song.genre}
+    elif action.song_id is not None:
+        # The song may have been deleted already, so its tags are read without loading it
+        song = Song.objects.filter(id=action.song_id).values('artist', 'genre').first()
+
+    with transaction.atomic():
+        if sign > 0:
+            features, _ = UserFeatures.objects.select_for_update().get_or_create(user_id=action.user_id)
+        else:
+            features = UserFeatures.objects.select_for_update().filter(user_id=action.user_id).first()
+            if features is None:
+                return None
+        _apply_to_features(
+            features, action.action_type, action.song_id,
+            song['artist'] if song else None, song['genre'] if song else None,
+            timestamp, sign
+        )
+
+        if sign < 0 and features.last_liked_song_id is None and action.action_type in ('like', 'save'):
+            features.last_liked_song_id = Action.objects.filter(
+                user_id=action.user_id, action_type__in=['like', 'save'], song__isnull=False
+            ).exclude(id=action.id).order_by('-timestamp').values_list('song_id', flat=True).first()
+
+        features.save()
+        # New favorites change the artist term of the user's stored similarities
+        if (song is not None and action.action_type in FEATURE_ACTION_WEIGHTS
+                and (sign > 0 or UserProfile.objects.filter(user_id=action.user_id).exists())
+                and sync_profile_preferences(action.user_id, features)):
+            refresh_artist_scores(action.user_id)
+
+    return features
+
+
+def rebuild_user_features(user_id):
+    """Recompute a user's features from their full action history (backfill and repair)"""
+    features = UserFeatures(user_id=user_id)
+    history = Action.objects.filter(user_id=user_id).order_by('timestamp', 'id').values_list(
+        'action_type', 'song_id', 'song__artist', 'song__genre', 'timestamp'
+    )
+    for action_type, song_id, artist, genre, timestamp in history:
+        _apply_to_features(features, action_type, song_id, artist, genre, timestamp.timestamp())
+
+    with transaction.atomic():
+        features.save()
+        if sync_profile_preferences(user_id, features):
+            refresh_artist_scores(user_id)
+    return features
+
+
+def get_user_features(user):
+    """Stored features for the user, or an empty unsaved instance if none exist yet"""
+    try:
+        return UserFeatures.objects.get(user=user)
+    except UserFeatures.DoesNotExist:
+        return UserFeatures(user=user)
+
+
+def most_played_recently(features, days=7):
+    """Song id the user played most within the last `days`, from the recent plays window"""
+    cutoff = time.time() - days * 86400
+    counts = {}
+    for song_id, played_at in features.recent_plays:
+        if played_at >= cutoff:
+            counts[song_id] = counts.get(song_id, 0) + 1
+    if not counts:
+        return None
+    return max(counts, key=counts.get)
@@ -13,7 +13,7 @@ from django.views.decorators.csrf import csrf_exempt
 import math
 from collections import defaultdict
 from django.db.models import Count
-from .algorithms import recommend_songs_collaborative, recommend_songs_content_based, update_preferences_based_on_actions
+from .algorithms import update_preferences_based_on_actions
 from .models import FriendRequest
 from django.views import View
 from rest_framework.decorators import api_view, permission_classes
@@ -272,19 +272,15 @@ def spotify_search(request):
 @permission_classes([IsAuthenticated])
 def recommended_songs(request):
     """Returns recommended songs based on collaborative and content-based filtering"""
-    # Call the recommendation functions from algorithms.py
-    collaborative_recommendations = recommend_songs_collaborative(request.user)
-    content_based_recommendations = recommend_songs_content_based(request.user)
-
-    recommended_songs = list(set(collaborative_recommendations + content_based_recommendations))
+    context = COLLABORATIVE_AND_CONTENT.run(request.user, limit=50)
 
     recommendations_data = [
         {
             'song': song.name,
             'artist': song.artist,
-            'recommendation_source': 'Collaborative' if song in collaborative_recommendations else 'Content-Based'
+            'recommendation_source': 'Collaborative' if 'collaborative' in context.sources[song.id] else 'Content-Based'
         }
-        for song in recommended_songs
+        for song in context.songs
     ]
 
     return JsonResponse({'status': 'success', 'recommendations': recommendations_data})
@@ -987,12 +983,16 @@ def play_song(request, spotify_track_id):
             url=song_details['url']
         )
 
+    # Every play is a listen; the Action only records the user's first play of the song
+    record_listen(user, song, 'play')
     Action.objects.get_or_create(
         user=user, 
         song=song, 
         action_type='play',
-        duration=duration,
-        context=data.get('context')  # e.g., 'playlist', 'search_results', 'recommendation'
+        defaults={
+            'duration': duration,
+            'context': data.get('context')  # e.g., 'playlist', 'search_results', 'recommendation'
+        }
     )
     return JsonResponse({'status': 'success', 'message': 'Song played successfully'})
 
@@ -1110,7 +1110,8 @@ def complete_song(request, spotify_track_id):
             url=song_details['url']
         )
 
-    Action.objects.create(user=user, song=song, action_type='complete')
+    record_listen(user, song, 'complete')
+    Action.objects.get_or_create(user=user, song=song, action_type='complete')
     return JsonResponse({'status': 'success', 'message': 'Song completion recorded'})
 
 
@@ -1226,13 +1227,15 @@ def log_interaction(request):
                 url=song_details.get('url')
             )
         
-        # Create the action with additional optional fields
-        Action.objects.create(
+        if action_type in ('play', 'complete'):
+            record_listen(user, song, action_type)
+
+        # Create the action with additional optional fields; repeats keep the first one
+        Action.objects.get_or_create(
             user=user,
             song=song,
             action_type=action_type,
-            duration=data.get('duration'),
-            context=data.get('context')
+            defaults={'duration': data.get('duration'), 'context': data.get('context')}
         )
         
         return JsonResponse({'status': 'success', 'message': f'Song {action_type} interaction logged'})
@@ -1864,139 +1867,6 @@ def trigger_preferences_update(request):
 
 import random
 
-def diversify_recommendations(recommendations, diversity_factor=0.2):
-    """
-    Diversify recommendations to prevent echo chamber effect.
-    """
-    diversified = []
-    seen_artists = set()
-    
-    for song, score in recommendations:
-        if song.artist not in seen_artists or random.random() < diversity_factor:
-            diversified.append((song, score))
-            seen_artists.add(song.artist)
-    
-    return diversified
-def recommend_songs_combined(user, limit=20):
-    """
-    Combine collaborative filtering and content-based recommendations.
-    """
-    # Get collaborative filtering recommendations
-    collaborative_recommendations = recommend_songs_collaborative(user, limit=limit // 2)
-    
-    # Get content-based recommendations
-    content_based_recommendations = recommend_songs_content_based(user, limit=limit // 2)
-    
-    # Combine the recommendations
-    combined_recommendations = collaborative_recommendations + content_based_recommendations
-    
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_recommendations = []
-    for song in combined_recommendations:
-        # Fix: The error occurs here because 'song' is a list, not an object with spotify_id attribute
-        # Access the spotify_id correctly based on the structure of your recommendation items
-        
-        # If song is an object with spotify_id attribute
-        if hasattr(song, 'spotify_id'):
-            if song.spotify_id not in seen:
-                unique_recommendations.append(song)
-                seen.add(song.spotify_id)
-        # If song is a tuple (song, score) where song is an object
-        elif isinstance(song, tuple) and hasattr(song[0], 'spotify_id'):
-            if song[0].spotify_id not in seen:
-                unique_recommendations.append(song[0])
-                seen.add(song[0].spotify_id)
-        # If song is a dictionary with spotify_id key
-        elif isinstance(song, dict) and 'spotify_id' in song:
-            if song['spotify_id'] not in seen:
-                unique_recommendations.append(song)
-                seen.add(song['spotify_id'])
-    
-    # Limit the number of recommendations to the specified limit
-    unique_recommendations = unique_recommendations[:limit]
-    
-    return unique_recommendations, len(unique_recommendations)
-def recommend_songs_hybrid(user, limit=20):
-    """
-    Enhanced hybrid recommendation system that combines:
-    1. Collaborative filtering
-    2. Content-based recommendations
-    3. Spotify API for enriching recommendations
-    4. Special handling for new users
-    """
-    # Check if user has very limited history
-    action_count = Action.objects.filter(user=user).count()
-    if action_count <= 1:
-        # For new users, get recommendations based on their limited history
-        spotify_tracks = get_recommendations_for_new_user(user, limit=limit)
-        return store_spotify_tracks(spotify_tracks)
-    
-    # For users with more history, use the existing recommendation system
-    # with additional enrichment from Spotify
-    
-    # 1. Get recommendations from existing system
-    recommended_songs, _ = recommend_songs_combined(user, limit=limit // 2)
-    
-    # 2. Extract artists and genres from user preferences
-    try:
-        profile = UserProfile.objects.get(user=user)
-        preferences = profile.preferences
-        favorite_artists = preferences.get('favorite_artists', [])
-        favorite_genres = preferences.get('favorite_genres', [])
-    except UserProfile.DoesNotExist:
-        favorite_artists = []
-        favorite_genres = []
-    
-    # Get ids of songs we already have
-    existing_song_ids = set(song.spotify_id for song in recommended_songs)
-    
-    # 3. Enrich with artist-based recommendations from Spotify
-    spotify_recommendations = []
-    
-    if favorite_artists:
-        # Pick a random artist from top 3 favorites for variety
-        artist = random.choice(favorite_artists[:3]) if len(favorite_artists) >= 3 else favorite_artists[0]
-        artist_tracks = get_related_spotify_tracks(artist=artist, limit=limit // 4)
-        # Only add tracks we don't already have
-        for track in artist_tracks:
-            if track['spotify_id'] not in existing_song_ids:
-                spotify_recommendations.append(track)
-                existing_song_ids.add(track['spotify_id'])
-    
-    # 4. Enrich with genre-based recommendations
-    if favorite_genres and len(spotify_recommendations) < limit // 2:
-        # Pick a random genre from top 3 favorites
-        genre = random.choice(favorite_genres[:3]) if len(favorite_genres) >= 3 else favorite_genres[0]
-        genre_tracks = get_related_spotify_tracks(genre=genre, limit=limit // 4)
-        # Only add tracks we don't already have
-        for track in genre_tracks:
-            if track['spotify_id'] not in existing_song_ids:
-                spotify_recommendations.append(track)
-                existing_song_ids.add(track['spotify_id'])
-    
-    # 5. Store the Spotify tracks and combine with existing recommendations
-    spotify_songs = store_spotify_tracks(spotify_recommendations)
-    all_recommendations = list(recommended_songs) + spotify_songs
-    
-    # 6. Apply diversity to prevent echo chamber
-    diverse_recommendations = diversify_recommendations(
-        [(song, random.random()) for song in all_recommendations], 
-        diversity_factor=0.2
-    )
-    
-    # Return unique recommendations up to the limit
-    seen_ids = set()
-    unique_recommendations = []
-    
-    for song, _ in diverse_recommendations:
-        if song.id not in seen_ids and len(unique_recommendations) < limit:
-            seen_ids.add(song.id)
-            unique_recommendations.append(song)
-    
-    return unique_recommendations
-
-
 @csrf_protect
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -2007,11 +1877,8 @@ def get_song_recommendations(request):
     user = request.user
     limit = int(request.query_params.get('limit', 30))
     
-    # Update user preferences based on their actions
-    update_preferences_based_on_actions(user)
-    
-    # Get recommendations using the hybrid approach
-    recommended_songs = recommend_songs_hybrid(user, limit=limit)
+    # Get recommendations using the hybrid approach, enriched from Spotify
+    recommended_songs = HYBRID_WITH_SPOTIFY.run(user, limit).songs
     
     # Format the response
     recommendations = []
@@ -2149,12 +2016,12 @@ def recommend_songs(request):
     # 3. Get relevant existing songs from the database
     matching_songs = []
     
-    # Find songs with matching artist or genre (safely handle None values)
+    # Find songs sharing an artist or genre with the base song (index lookups on the link tables)
     query = Q()
     if artist:
-        query |= Q(artist__icontains=artist)
+        query |= Q(id__in=songs_by_artists(split_names(artist)).values('id'))
     if genre:
-        query |= Q(genre__icontains=genre)
+        query |= Q(id__in=songs_by_genres(split_names(genre)).values('id'))
     
     if query:
         # Only filter if we have valid criteria
@@ -2178,9 +2045,9 @@ def recommend_songs(request):
             
             pref_query = Q()
             if favorite_artists:
-                pref_query |= Q(artist__in=favorite_artists)
+                pref_query |= Q(id__in=songs_by_artists(favorite_artists).values('id'))
             if favorite_genres:
-                pref_query |= Q(genre__in=favorite_genres)
+                pref_query |= Q(id__in=songs_by_genres(favorite_genres).values('id'))
                 
             if pref_query:
                 # Find additional songs based on user preferences
@@ -2205,22 +2072,14 @@ def recommend_songs(request):
     # If we still don't have enough, add some random popular songs
     if len(matching_songs) < existing_song_limit:
         # Get popular songs based on play counts
-        popular_songs = Action.objects.filter(
-            action_type='play'
-        ).values('song').annotate(
-            count=Count('id')
-        ).order_by('-count')[:existing_song_limit * 2]  # Get more than needed in case of duplicates
+        # Get more than needed in case of duplicates
+        popular_song_objects = popular_songs('play_count', existing_song_limit * 2, fill=False)
         
-        if popular_songs:
-            popular_song_ids = [item['song'] for item in popular_songs if item.get('song')]
-            if popular_song_ids:
-                popular_song_objects = list(Song.objects.filter(id__in=popular_song_ids))
-                
-                # Exclude songs already in matching_songs
-                matching_song_ids = [song.id for song in matching_songs]
-                popular_song_objects = [song for song in popular_song_objects if song.id not in matching_song_ids]
-                
-                matching_songs.extend(popular_song_objects)
+        # Exclude songs already in matching_songs
+        matching_song_ids = [song.id for song in matching_songs]
+        popular_song_objects = [song for song in popular_song_objects if song.id not in matching_song_ids]
+        
+        matching_songs.extend(popular_song_objects)
     
     # Take only the number of existing songs we need
     existing_recommendations = matching_songs[:existing_song_limit]
@@ -2279,44 +2138,22 @@ def get_user_base_track(user):
     Determine which track to use as the basis for recommendations.
     Analyzes user's recent activity to find the most relevant track.
     """
-    # Strategy 1: Last liked/saved song
-    last_liked = Action.objects.filter(
-        user=user, 
-        action_type__in=['like', 'save'],
-        song__isnull=False  # Ensure the song is not null
-    ).order_by('-timestamp').first()
-    
-    if last_liked and last_liked.song:
-        song = last_liked.song
-        return {
-            'spotify_id': song.spotify_id,
-            'name': song.name,
-            'artist': song.artist,
-            'genre': song.genre
-        }
+    # Recent activity is kept in the user's feature row, so no history scan is needed
+    features = get_user_features(user)
     
+    # Strategy 1: Last liked/saved song
     # Strategy 2: Most played song in the last week
-    one_week_ago = timezone.now() - timezone.timedelta(days=7)
-    most_played = Action.objects.filter(
-        user=user,
-        action_type='play',
-        timestamp__gte=one_week_ago,
-        song__isnull=False  # Ensure the song is not null
-    ).values('song').annotate(
-        play_count=Count('id')
-    ).order_by('-play_count').first()
-    
-    if most_played and most_played.get('song'):
-        try:
-            song = Song.objects.get(id=most_played['song'])
+    for song_id in (features.last_liked_song_id, most_played_recently(features, days=7)):
+        if song_id is None:
+            continue
+        song = Song.objects.filter(id=song_id).first()
+        if song:
             return {
                 'spotify_id': song.spotify_id,
                 'name': song.name,
                 'artist': song.artist,
                 'genre': song.genre
             }
-        except Song.DoesNotExist:
-            pass
     
     # Strategy 3: Check user's preferred genres/artists and pick a popular song
     try:
@@ -2326,14 +2163,13 @@ def get_user_base_track(user):
         
         query = Q()
         if favorite_genres:
-            query |= Q(genre__in=favorite_genres)
+            query |= Q(id__in=songs_by_genres(favorite_genres).values('id'))
         if favorite_artists:
-            query |= Q(artist__in=favorite_artists)
+            query |= Q(id__in=songs_by_artists(favorite_artists).values('id'))
             
         if query:
-            popular_match = Song.objects.filter(query).annotate(
-                play_count=Count('action', filter=Q(action__action_type='play'))
-            ).order_by('-play_count').first()
+            matches = popular_songs('play_count', limit=1, songs=Song.objects.filter(query))
+            popular_match = matches[0] if matches else None
             
             if popular_match:
                 return {
@@ -2346,9 +2182,8 @@ def get_user_base_track(user):
         pass
     
     # Strategy 4: Fall back to a generally popular song
-    popular_song = Song.objects.annotate(
-        play_count=Count('action', filter=Q(action__action_type='play'))
-    ).order_by('-play_count').first()
+    popular = popular_songs('play_count', limit=1)
+    popular_song = popular[0] if popular else None
     
     if popular_song:
         return {
@@ -2369,16 +2204,14 @@ def get_general_recommendations(request, limit):
     user = request.user
     
     # Get popular songs from our database
-    popular_songs = Song.objects.annotate(
-        play_count=Count('action', filter=Q(action__action_type='play'))
-    ).order_by('-play_count')[:limit//2]
+    popular = popular_songs('play_count', limit=limit//2)
     
     # Get some trending songs from Spotify
     trending_songs = get_trending_spotify_tracks(limit=limit//2)
     stored_trending = store_spotify_tracks(trending_songs)
     
     # Combine recommendations
-    all_recommendations = list(popular_songs) + list(stored_trending)
+    all_recommendations = popular + list(stored_trending)
     random.shuffle(all_recommendations)
     
     # Format the response
@@ -2401,7 +2234,7 @@ def get_general_recommendations(request, limit):
         'status': 'success',
         'count': len(recommendations),
         'new_discoveries': len(stored_trending),
-        'from_library': len(popular_songs),
+        'from_library': len(popular),
         'recommendation_type': 'general',  # Indicate these are general recommendations
         'recommendations': recommendations
     }, status=status.HTTP_200_OK)
@@ -2428,43 +2261,13 @@ def get_for_you_recommendations(request):
     user = request.user
     limit = int(request.query_params.get('limit', 50))
     
-    # Initialize the recommendations list
-    recommendations = []
-    
-    # 1. Get recommendations for new users if the user has very limited history
-    action_count = Action.objects.filter(user=user).count()
-    if action_count <= 1:
-        new_user_recommendations = get_recommendations_for_new_user(user, limit=limit // 4)
-        recommendations.extend(store_spotify_tracks(new_user_recommendations))
-    
-    # 2. Get personalized recommendations using the hybrid approach
-    personalized_recommendations = recommend_songs_hybrid(user, limit=limit // 4)
-    recommendations.extend(personalized_recommendations)
-    
-    # 3. Get trending songs based on recent activity
-    recent_date = timezone.now() - timezone.timedelta(days=7)
-    trending_songs = Action.objects.filter(
-        timestamp__gte=recent_date
-    ).values('song').annotate(
-        count=Count('id')
-    ).order_by('-count')[:limit // 4]
-    
-    song_ids = [item['song'] for item in trending_songs]
-    trending_songs = Song.objects.filter(id__in=song_ids)
-    recommendations.extend(trending_songs)
-    
-    # 4. Get new songs from Spotify that are not in the Song table
-    new_songs = get_related_spotify_tracks(limit=limit // 4)
-    existing_song_ids = set(Song.objects.values_list('spotify_id', flat=True))
-    new_songs = [song for song in new_songs if song['spotify_id'] not in existing_song_ids]
-    recommendations.extend(store_spotify_tracks(new_songs))  # Store and add as Song objects for consistency
+    # Personalized (or new-user) picks, Spotify tracks for the user's favorites,
+    # trending songs and new songs from Spotify, merged in one pipeline run
+    recommendations = FOR_YOU_MIX.run(user, limit).songs
     
     # Shuffle the recommendations to mix them up
     random.shuffle(recommendations)
     
-    # Limit the number of recommendations to the specified limit
-    recommendations = recommendations[:limit]
-    
     # Format the response
     response_data = []
     for song in recommendations:
@@ -2524,6 +2327,27 @@ def get_recommendations(request, spotify_id):
             'details': 'The provided ID does not match the expected Spotify ID format'
         }, status=400)
 
+    # Songs with enough shared listeners are answered from the local neighbor index
+    song = Song.objects.filter(spotify_id=spotify_id).first()
+    similar_songs = get_similar_songs(song.id, 5, spotify_only=True) if song else []
+    if similar_songs:
+        return JsonResponse({
+            'original_track': {
+                'id': spotify_id,
+                'name': song.name,
+                'artist': song.artist,
+                'album_cover': song.album_cover
+            },
+            'recommendations': [{
+                'id': similar.spotify_id,
+                'name': similar.name,
+                'artist': similar.artist,
+                'album': similar.album,
+                'preview_url': None,
+                'album_cover': similar.album_cover
+            } for similar in similar_songs]
+        }, safe=True)
+
     # Get access token
     access_token = get_spotify_token()
     if not access_token:
@@ -2692,7 +2516,9 @@ def recommend_friends(request, limit=10):
     """
     user = request.user
     
-    # Ensure user similarities are up-to-date
+    # Ensure the user has a stored neighbor list; new users get one from the LSH index
+    if not UserSimilarity.objects.filter(user1=user).exists():
+        similar_users_from_lsh(user)
     
     # Get existing friends (users with accepted friend requests)
     existing_friends = FriendRequest.objects.filter(
@@ -2753,6 +2579,29 @@ def recommend_friends(request, limit=10):
             # Skip users without profiles
             continue
     
+    # Top up with the listeners random walks from the user reach most often
+    if len(recommendations) < limit:
+        suggested_ids = excluded_ids.union(recommendation['user_id'] for recommendation in recommendations)
+        walked = get_graph().similar_users(user.id, limit - len(recommendations), exclude_user_ids=suggested_ids)
+        walked_users = User.objects.select_related('profile').in_bulk([user_id for user_id, _ in walked])
+        for user_id, _ in walked:
+            walked_user = walked_users.get(user_id)
+            try:
+                profile = walked_user.profile if walked_user else None
+            except UserProfile.DoesNotExist:
+                profile = None
+            if profile is None:
+                continue
+            recommendations.append({
+                'user_id': walked_user.id,
+                'username': walked_user.username,
+                'name': profile.name or walked_user.username,
+                'profile_picture': request.build_absolute_uri(profile.profile_picture.url) if profile.profile_picture else None,
+                'similarity_score': None,
+                'common_artists': [],
+                'total_common_artists': 0
+            })
+    
     # If no similar users found, recommend random users
     if not recommendations:
         random_users = User.objects.exclude(id__in=excluded_ids).order_by('?')[:limit]
@@ -3006,15 +2855,12 @@ from datetime import datetime
 
 from .models import Song, Action, Recommendation, UserProfile
 from .algorithms import (
-    recommend_songs_combined, 
     get_trending_songs, 
     cached_get_recommendations,
-    diversify_recommendations,
-    hybrid_recommendation,
     calculate_svd_recommendations,
     calculate_als_recommendations,
-    update_preferences_based_on_actions,
-    update_user_similarities
+    calculate_bpr_recommendations,
+    update_preferences_based_on_actions
 )
 from .spotify_utils import (
     get_spotify_track, 
@@ -3022,6 +2868,39 @@ from .spotify_utils import (
     get_recommendations_for_new_user,
     store_spotify_tracks
 )
+from .similarity import update_similarities_for_action
+from .lsh import similar_users_from_lsh, update_user_signature, song_token
+from .user_features import get_user_features, most_played_recently
+from .song_tags import split_names, songs_by_artists, songs_by_genres
+from .popularity import popular_songs, popular_artists
+from .song_similarity import similar_songs as get_similar_songs
+from .graph_walk import get_graph
+from .next_track import next_tracks, record_listen
+from .pipeline import (
+    RecommendationContext,
+    NEW_USER_ACTIONS,
+    NEW_USER,
+    HYBRID,
+    HYBRID_WITH_SPOTIFY,
+    NEW_TRACKS,
+    ALS,
+    SVD,
+    BPR,
+    GRAPH,
+    COLLABORATIVE,
+    COLLABORATIVE_AND_CONTENT,
+    FOR_YOU_MIX
+)
+
+# Pipelines behind ForYouRecommendationsView's algorithm parameter
+FOR_YOU_PIPELINES = {
+    'hybrid': HYBRID,
+    'als': ALS,
+    'svd': SVD,
+    'bpr': BPR,
+    'collaborative': COLLABORATIVE_AND_CONTENT,
+    'graph': GRAPH
+}
 
 # JWT Authentication middleware
 from rest_framework_simplejwt.authentication import JWTAuthentication
@@ -3077,40 +2956,23 @@ class ForYouRecommendationsView(RecommendationAPIView):
                 return Response({"error": "Limit must be a valid integer"}, status=status.HTTP_400_BAD_REQUEST)
                 
             algorithm = request.query_params.get('algorithm', 'hybrid')
-            if algorithm not in ['hybrid', 'als', 'svd', 'collaborative']:
+            if algorithm not in FOR_YOU_PIPELINES:
                 return Response({"error": "Invalid algorithm specified"}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Check if user is new or has limited interactions
-            action_count = Action.objects.filter(user=user).count()
+            # Choose recommendation pipeline based on request; all of them share one context
+            context = RecommendationContext(user, limit)
             
-            if action_count < 3:
+            if context.action_count < NEW_USER_ACTIONS:
                 # For new users with limited history, use the specialized method
-                track_data = get_recommendations_for_new_user(user, limit)
-                songs = store_spotify_tracks(track_data)
+                songs = NEW_USER.run(user, limit, context).songs
                 recommendation_source = "new_user"
             else:
-                # Update user preferences based on actions before getting recommendations
-                update_preferences_based_on_actions(user)
-                
-                # Choose recommendation algorithm based on request or user profile
+                pipeline = FOR_YOU_PIPELINES[algorithm]
+                songs = pipeline.run(user, limit, context).songs
                 if algorithm == 'hybrid':
-                    songs, recommendation_source = hybrid_recommendation(user, limit)
-                elif algorithm == 'als':
-                    songs = cached_get_recommendations(user, limit, algorithm='als')
-                    recommendation_source = "als"
-                elif algorithm == 'svd':
-                    songs = cached_get_recommendations(user, limit, algorithm='svd')
-                    recommendation_source = "svd"
-                elif algorithm == 'collaborative':
-                    songs, _ = recommend_songs_combined(user, limit)
-                    recommendation_source = "collaborative"
+                    recommendation_source = f"hybrid_{context.model_source}"
                 else:
-                    # Default to hybrid
-                    songs, recommendation_source = hybrid_recommendation(user, limit)
-                
-                # Add diversity to recommendations
-                song_scores = [(song, 1.0) for song in songs]  # Simple scoring for diversification
-                songs = [s for s, _ in diversify_recommendations(song_scores)]
+                    recommendation_source = algorithm
             
             # Format the response
             response_data = {
@@ -3150,13 +3012,18 @@ class TrendingSongsView(RecommendationAPIView):
             except ValueError:
                 return Response({"error": "Limit must be a valid integer"}, status=status.HTTP_400_BAD_REQUEST)
             
+            rank = request.query_params.get('rank', 'score')
+            if rank not in ('score', 'velocity'):
+                return Response({"error": "Rank must be 'score' or 'velocity'"}, status=status.HTTP_400_BAD_REQUEST)
+            
             # Get trending songs
-            trending_songs = get_trending_songs(days=days, limit=limit)
+            trending_songs = get_trending_songs(days=days, limit=limit, rank=rank)
             
             # Format the response
             response_data = {
                 "trending": [self.format_song_response(song) for song in trending_songs],
                 "time_period_days": days,
+                "rank": rank,
                 "limit": limit
             }
             
@@ -3169,6 +3036,51 @@ class TrendingSongsView(RecommendationAPIView):
             )
 
 
+class NextTrackRecommendationView(RecommendationAPIView):
+    """
+    Get the songs most likely to be played next in the user's current listening session
+    """
+    
+    def get(self, request, *args, **kwargs):
+        try:
+            user = self.get_user_from_request(request)
+            
+            try:
+                limit = int(request.query_params.get('limit', 10))
+                if limit < 1 or limit > 50:
+                    return Response({"error": "Limit must be between 1 and 50"}, status=status.HTTP_400_BAD_REQUEST)
+            except ValueError:
+                return Response({"error": "Limit must be a valid integer"}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Optionally, the song playing right now (it may not be logged yet)
+            current_song_id = None
+            spotify_id = request.query_params.get('spotify_id')
+            if spotify_id:
+                if not validate_spotify_id(spotify_id):
+                    return Response({"error": "Invalid Spotify ID format"}, status=status.HTTP_400_BAD_REQUEST)
+                current_song_id = Song.objects.filter(spotify_id=spotify_id).values_list('id', flat=True).first()
+            
+            session, next_songs = next_tracks(user.id, limit, current_song_id)
+            source = "transitions"
+            if not next_songs:
+                # No session yet, or nothing has followed its songs so far
+                next_songs = popular_songs('play_count', limit)
+                source = "popular"
+            
+            return Response({
+                "next_tracks": [self.format_song_response(song) for song in next_songs],
+                "session": session,
+                "source": source,
+                "limit": limit
+            })
+        except Exception as e:
+            logger.exception(f"Error in NextTrackRecommendationView: {str(e)}")
+            return Response(
+                {"error": "An error occurred while processing your request"}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class SimilarSongsView(RecommendationAPIView):
     """
     Get songs similar to a given song (by spotify_id)
@@ -3198,6 +3110,15 @@ class SimilarSongsView(RecommendationAPIView):
                     song = Song.objects.get(spotify_id=spotify_id)
                     artist = song.artist
                     genre = song.genre
+                    
+                    # Serve from our own co-occurrence index; Spotify is only asked about cold songs
+                    similar_songs = get_similar_songs(song.id, limit)
+                    if similar_songs:
+                        return Response({
+                            "similar_songs": [self.format_song_response(similar) for similar in similar_songs],
+                            "source": "local",
+                            "limit": limit
+                        })
                 except Song.DoesNotExist:
                     # If not, fetch it from Spotify
                     track_data = get_spotify_track(spotify_id)
@@ -3248,52 +3169,14 @@ class NewTracksRecommendationView(RecommendationAPIView):
             except ValueError:
                 return Response({"error": "Limit must be a valid integer"}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Get all song IDs the user has interacted with
-            user_song_ids = set(Action.objects.filter(user=user).values_list('song_id', flat=True))
-            
-            # Get recommended songs using the hybrid algorithm
-            recommended_songs, algorithm = hybrid_recommendation(user, limit=limit*2)
-            
-            # Filter out songs the user has already interacted with
-            new_songs = [song for song in recommended_songs if song.id not in user_song_ids]
-            
-            # If we don't have enough recommendations, fetch some from Spotify
-            if len(new_songs) < limit:
-                # Try to get user preferences
-                try:
-                    profile = UserProfile.objects.get(user=user)
-                    preferences = profile.preferences
-                    
-                    # Get favorite genres or artists
-                    favorite_genres = preferences.get('favorite_genres', [])
-                    favorite_artists = preferences.get('favorite_artists', [])
-                    
-                    if favorite_artists:
-                        spotify_tracks = get_related_spotify_tracks(artist=favorite_artists[0], limit=limit)
-                    elif favorite_genres:
-                        spotify_tracks = get_related_spotify_tracks(genre=favorite_genres[0], limit=limit)
-                    else:
-                        spotify_tracks = get_related_spotify_tracks(limit=limit)
-                        
-                    # Store and add these tracks
-                    spotify_songs = store_spotify_tracks(spotify_tracks)
-                    
-                    # Add only songs that the user hasn't interacted with
-                    for song in spotify_songs:
-                        if song.id not in user_song_ids and song not in new_songs:
-                            new_songs.append(song)
-                            
-                            # If we have enough songs, break
-                            if len(new_songs) >= limit:
-                                break
-                                
-                except UserProfile.DoesNotExist:
-                    pass
+            # Hybrid recommendations the user hasn't interacted with, topped up
+            # from Spotify if there are not enough
+            context = NEW_TRACKS.run(user, limit)
             
             # Format the response
             response_data = {
-                "new_recommendations": [self.format_song_response(song) for song in new_songs[:limit]],
-                "algorithm": f"{algorithm}_with_spotify",
+                "new_recommendations": [self.format_song_response(song) for song in context.songs],
+                "algorithm": f"hybrid_{context.model_source}_with_spotify",
                 "limit": limit
             }
             
@@ -3322,11 +3205,8 @@ class UserBasedRecommendationView(RecommendationAPIView):
             except ValueError:
                 return Response({"error": "Limit must be a valid integer"}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Update user similarities to get fresh recommendations
-            update_user_similarities(user)
-            
-            # Get recommendations using collaborative filtering
-            songs, _ = recommend_songs_collaborative(user, limit)
+            # Neighbors come from the stored top-K rows (kept fresh by the action path), or the LSH index for new users
+            songs = COLLABORATIVE.run(user, limit).songs
             
             # Format the response
             response_data = {
@@ -3346,7 +3226,7 @@ class UserBasedRecommendationView(RecommendationAPIView):
 
 class MatrixFactorizationRecommendationView(RecommendationAPIView):
     """
-    Get recommendations using matrix factorization techniques (SVD or ALS)
+    Get recommendations using matrix factorization techniques (SVD, ALS or BPR)
     """
     
     def get(self, request, *args, **kwargs):
@@ -3360,21 +3240,26 @@ class MatrixFactorizationRecommendationView(RecommendationAPIView):
             except ValueError:
                 return Response({"error": "Limit must be a valid integer"}, status=status.HTTP_400_BAD_REQUEST)
                 
-            algorithm = request.query_params.get('algorithm', 'svd')  # 'svd' or 'als'
-            if algorithm.lower() not in ['svd', 'als']:
-                return Response({"error": "Algorithm must be either 'svd' or 'als'"}, status=status.HTTP_400_BAD_REQUEST)
+            algorithm = request.query_params.get('algorithm', 'svd')  # 'svd', 'als' or 'bpr'
+            if algorithm.lower() not in ['svd', 'als', 'bpr']:
+                return Response({"error": "Algorithm must be 'svd', 'als' or 'bpr'"}, status=status.HTTP_400_BAD_REQUEST)
             
+            # The model comes back with the songs, so the version reported is the one that scored them
             if algorithm.lower() == 'als':
-                songs = calculate_als_recommendations(user, limit)
+                songs, model = calculate_als_recommendations(user, limit, with_model=True)
                 algorithm_name = "Alternating Least Squares"
+            elif algorithm.lower() == 'bpr':
+                songs, model = calculate_bpr_recommendations(user, limit, with_model=True)
+                algorithm_name = "Bayesian Personalized Ranking"
             else:
-                songs = calculate_svd_recommendations(user, limit)
+                songs, model = calculate_svd_recommendations(user, limit, with_model=True)
                 algorithm_name = "Singular Value Decomposition"
             
             # Format the response
             response_data = {
                 "recommendations": [self.format_song_response(song) for song in songs],
                 "algorithm": algorithm_name,
+                "model_version": model.version if model else None,
                 "limit": limit
             }
             
@@ -3447,20 +3332,23 @@ class ActionLoggingView(APIView):
                             genre=track_data['genre']
                         )
                 
-                # Create the action
-                Action.objects.create(
+                if action_type == 'play':
+                    record_listen(user, song, 'play')
+                
+                # Create the action; a repeat (e.g. playing the song again) keeps the first one
+                action, created = Action.objects.get_or_create(
                     user=user,
                     song=song,
-                    action_type=action_type,
-                    timestamp=datetime.now()
+                    action_type=action_type
                 )
                 
-                # Update user preferences based on this new action
-                update_preferences_based_on_actions(user)
+                # User features and preferences are updated by the Action post_save signal
                 
-                # Trigger similarity updates for collaborative filtering (can be done asynchronously)
-                # Note: In production, consider making this a background task
-                update_user_similarities(user)
+                # Fold the new action into the stored similarity terms; only rows shared
+                # with the song's audience change, so this stays cheap on the write path
+                if created:
+                    update_similarities_for_action(action)
+                    update_user_signature(user.id, [song_token(song.id)])
                 
                 return Response({"success": True, "message": f"{action_type} action logged successfully"})
                 
@@ -3814,9 +3702,6 @@ class ArtistRecommendationView(RecommendationAPIView):
         """
         Get recommendations for new artists based on similar users
         """
-        # Update user preferences
-        update_preferences_based_on_actions(user)
-        
         # Get similar users
         similar_users = get_similar_users(user, top_n=20)
         
@@ -3915,48 +3800,9 @@ class ArtistRecommendationView(RecommendationAPIView):
     
     def get_popular_artists_from_db(self, limit):
         """Get popular artists from database based on interactions"""
-        # Combine play, like, and save counts with weights
-        artist_scores = defaultdict(float)
-        
-        # Get play counts
-        play_counts = Action.objects.filter(action_type='play').values('song__artist').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        for item in play_counts:
-            if item['song__artist']:
-                artist_scores[item['song__artist']] += item['count'] * 1.0
-        
-        # Get like counts (weighted higher)
-        like_counts = Action.objects.filter(action_type='like').values('song__artist').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        for item in like_counts:
-            if item['song__artist']:
-                artist_scores[item['song__artist']] += item['count'] * 5.0
-        
-        # Get save counts
-        save_counts = Action.objects.filter(action_type='save').values('song__artist').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        for item in save_counts:
-            if item['song__artist']:
-                artist_scores[item['song__artist']] += item['count'] * 3.0
-        
-        # Get trending (recent) artists
-        recent_date = timezone.now() - timezone.timedelta(days=7)
-        recent_actions = Action.objects.filter(timestamp__gte=recent_date).values('song__artist').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        for item in recent_actions:
-            if item['song__artist']:
-                artist_scores[item['song__artist']] += item['count'] * 2.0  # Trending bonus
-        
-        # Sort and format
-        top_artists = sorted(artist_scores.items(), key=lambda x: x[1], reverse=True)[:limit*2]
+        # Plays, likes (weighted higher), saves and a trending bonus for recent
+        # actions, maintained per artist in ArtistStats (see popularity.py)
+        top_artists = popular_artists(limit*2)
         return [{"name": artist, "score": score} for artist, score in top_artists]
     
     def get_spotify_popular_artists(self, limit):
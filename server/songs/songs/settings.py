@@ -171,6 +171,16 @@ SPOTIFY_CLIENT_ID = env("SPOTIFY_CLIENT_ID", default="")
 SPOTIFY_CLIENT_SECRET = env("SPOTIFY_CLIENT_SECRET", default="")
 SPOTIFY_REDIRECT_URI = env("SPOTIFY_REDIRECT_URI", default="")
 
+# Recommender settings
+SIMILARITY_TOP_K = env.int('SIMILARITY_TOP_K', default=50)  # Neighbors stored per user
+SIMILARITY_MIN_SCORE = env.float('SIMILARITY_MIN_SCORE', default=0.0)
+LSH_NUM_PERM = env.int('LSH_NUM_PERM', default=64)  # MinHash signature length
+LSH_BANDS = env.int('LSH_BANDS', default=16)  # Must divide LSH_NUM_PERM
+RECOMMENDER_DATA_DIR = env('RECOMMENDER_DATA_DIR', default=os.path.join(BASE_DIR, 'recommender_data'))  # Matrix snapshots and model files
+SONG_NEIGHBORS_TOP_K = env.int('SONG_NEIGHBORS_TOP_K', default=50)  # Neighbors stored per song
+SONG_NEIGHBORS_MIN_CO_COUNT = env.int('SONG_NEIGHBORS_MIN_CO_COUNT', default=2)  # Shared listeners needed to be a neighbor
+RECOMMENDATION_WORKERS = env.int('RECOMMENDATION_WORKERS', default=0)  # Nightly scoring processes, 0 = one per core
+
 # eSewa settings
 ESEWA_CONFIG = {
     "MERCHANT_ID": env("ESEWA_MERCHANT_ID", default=""),